@@ -0,0 +1,169 @@
+"""
+Offline checks of the answer cache (app/utils/answer_cache.py) end to end.
+
+Runs main.app in-process with the loadtest.py stand-ins (fakeredis,
+mongomock-motor, FakeAsyncOpenAI numbering its replies) and drives real
+WebSocket sessions. Each case counts the LLM calls it caused:
+
+  exact_hit           the same first question from a new session is served
+                      from the cache: no LLM call, the same reply
+  near_duplicate_hit  a reworded question ("my" for "a") hits via MinHash
+  near_duplicate_ids  a question differing only in its order number does not
+                      (ANSWER_CACHE_NEAR_DUP is turned on for the check)
+  kb_reupload         after a KB re-upload the question goes to the LLM again
+                      and the old reply is not served
+  follow_up_bypass    a context-dependent follow-up ("what about that one?")
+                      is never answered from the cache, even when asked twice
+  standalone_later    a standalone question on a later turn does use the cache
+
+Exits non-zero if any case fails.
+
+Usage:
+    pip install fakeredis lupa mongomock-motor
+    python answer_cache_check.py
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Answer cache offline checks")
+    p.add_argument("--company", default="answer-cache-co")
+    args = p.parse_args()
+    # Fields loadtest.configure_env / install_stand_ins expect
+    args.redis_url = args.mongo_uri = None
+    args.redis_cluster = False
+    args.redis_latency = 0.0
+    args.llm_latency, args.llm_jitter, args.llm_dist, args.llm_token_delay = 0.0, 0.0, "uniform", 0.0
+    args.stream, args.openai_rpm, args.max_sessions, args.customer_rpm = False, 0, None, None
+    args.verbose = False
+    return args
+
+
+class Session:
+    def __init__(self, url: str, company: str, phone: str):
+        self.url, self.company, self.phone = url, company, phone
+
+    async def __aenter__(self):
+        import websockets
+        self.ws = await websockets.connect(self.url, ping_interval=None).__aenter__()
+        await self.ws.recv()
+        await self.ws.send(self.company)
+        await self.ws.recv()
+        await self.ws.send(self.phone)
+        await self.ws.recv()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.ws.__aexit__(*exc)
+
+    async def ask(self, question: str) -> str:
+        await self.ws.send(question)
+        return await self.ws.recv()
+
+
+async def main(args) -> dict:
+    import uvicorn
+    from loadtest import free_port, install_stand_ins
+
+    app = install_stand_ins(args)
+    from app.api import websocket
+    from app.utils.answer_cache import answer_cache
+    from app.utils.company_kb_manager import CompanyKBManager
+
+    llm = websocket.openai_client.client
+    llm.reply_fn = lambda messages: f"Reply #{llm.calls}"
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    kb = CompanyKBManager()
+    await kb.upload_kb(args.company, ["Refunds are issued within 7 days.", "We ship to 40 countries."])
+    url = f"ws://127.0.0.1:{port}/ws/chat"
+    phones = iter(f"95{n:08d}" for n in range(100))
+
+    async def first_turn(question: str) -> str:
+        async with Session(url, args.company, next(phones)) as s:
+            return await s.ask(question)
+
+    async def settle():
+        # The cache store runs in the background after the reply is sent
+        await asyncio.sleep(0.1)
+
+    cases = {}
+
+    def case(name: str, ok: bool, **details):
+        cases[name] = {"ok": bool(ok), **details}
+
+    calls = llm.calls
+    original = await first_turn("How do I get a refund for a damaged order?")
+    await settle()
+    again = await first_turn("how do I get a refund for a damaged order")
+    case("exact_hit", llm.calls == calls + 1 and again == original, llm_calls=llm.calls - calls, replies=[original, again])
+
+    calls, near_before = llm.calls, answer_cache.near_hits
+    near = await first_turn("How do I get a refund for my damaged order?")
+    case("near_duplicate_hit", llm.calls == calls and near == original and answer_cache.near_hits == near_before + 1,
+         llm_calls=llm.calls - calls, reply=near)
+
+    calls = llm.calls
+    order = await first_turn("Where is my order number 4481923, it was due yesterday")
+    await settle()
+    other_orders = [await first_turn(f"Where is my order number {n}, it was due yesterday") for n in (4481924, 9981923)]
+    case("near_duplicate_ids", llm.calls == calls + 3 and order not in other_orders,
+         llm_calls=llm.calls - calls, replies=[order, *other_orders])
+
+    calls = llm.calls
+    await kb.upload_kb(args.company, ["Refunds are issued within 14 days.", "We ship to 40 countries."])
+    await settle()
+    fresh = await first_turn("How do I get a refund for a damaged order?")
+    await settle()
+    cached_fresh = await first_turn("How do I get a refund for a damaged order?")
+    case("kb_reupload", llm.calls == calls + 1 and fresh != original and cached_fresh == fresh,
+         llm_calls=llm.calls - calls, replies=[fresh, cached_fresh])
+
+    calls = llm.calls
+    follow_ups = []
+    for _ in range(2):
+        async with Session(url, args.company, next(phones)) as s:
+            await s.ask("Do you ship internationally?")
+            await settle()
+            follow_ups.append(await s.ask("What about that one?"))
+            await settle()
+    # First session: both turns go to the LLM; second: the first turn is cached, the follow-up is not
+    case("follow_up_bypass", llm.calls == calls + 3 and follow_ups[0] != follow_ups[1],
+         llm_calls=llm.calls - calls, replies=follow_ups)
+
+    calls = llm.calls
+    async with Session(url, args.company, next(phones)) as s:
+        await s.ask("Hello there")
+        await settle()
+        later = await s.ask("How do I get a refund for a damaged order?")
+    case("standalone_later", llm.calls == calls + 1 and later == fresh, llm_calls=llm.calls - calls, reply=later)
+
+    server.should_exit = True
+    await server_task
+    return {"cases": cases, "answer_cache": answer_cache.stats()}
+
+
+if __name__ == "__main__":
+    from loadtest import configure_env
+
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as spool_dir:
+        configure_env(args, spool_dir)
+        os.environ["ANSWER_CACHE_NEAR_DUP"] = "1"
+        report = asyncio.run(main(args))
+    print(json.dumps(report, indent=2))
+    failed = [name for name, result in report["cases"].items() if not result["ok"]]
+    if failed:
+        print(f"Failed: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,82 @@
+import json
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from app.api.deps import require_admin_key
+from app.utils.conversation_manager import ConversationManager
+
+router = APIRouter(prefix="/conversations", dependencies=[Depends(require_admin_key)])
+conversation_manager = ConversationManager()
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _scope(customer_id: Optional[str], company_id: Optional[str]) -> None:
+    if not customer_id and not company_id:
+        raise HTTPException(status_code=400, detail="customer_id or company_id is required")
+
+
+@router.get("")
+async def list_conversations(
+        customer_id: Optional[str] = None,
+        company_id: Optional[str] = None,
+        limit: int = Query(50, ge=1, le=500),
+        cursor: Optional[str] = None,
+        include_messages: bool = False,
+):
+    """
+    A page of conversations, newest first. Pass the returned next_cursor to
+    get the following page. Message bodies are left out unless
+    include_messages=true.
+    """
+    _scope(customer_id, company_id)
+    try:
+        items, next_cursor = await conversation_manager.list_conversations(
+            customer_id=customer_id,
+            company_id=company_id,
+            limit=limit,
+            cursor=cursor,
+            include_messages=include_messages,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": items, "next_cursor": next_cursor}
+
+
+@router.get("/export")
+async def export_conversations(
+        customer_id: Optional[str] = None,
+        company_id: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        include_messages: bool = True,
+):
+    """Every matching conversation as NDJSON (one document per line), streamed from a cursor."""
+    _scope(customer_id, company_id)
+
+    async def lines():
+        async for doc in conversation_manager.export_conversations(
+            customer_id=customer_id,
+            company_id=company_id,
+            since=since,
+            until=until,
+            include_messages=include_messages,
+        ):
+            yield json.dumps(doc, default=_json_default, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@router.get("/{conversation_id}")
+async def get_conversation(conversation_id: str):
+    doc = await conversation_manager.get_conversation(conversation_id)
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return doc
@@ -0,0 +1,14 @@
+import secrets
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+from app.core.config import settings
+
+
+async def require_admin_key(x_admin_key: Optional[str] = Header(None)) -> None:
+    """Admin endpoints require X-Admin-Key; with no ADMIN_API_KEY configured they are disabled (503)."""
+    if not settings.ADMIN_API_KEY:
+        raise HTTPException(status_code=503, detail="Admin API disabled: ADMIN_API_KEY is not set")
+    if x_admin_key is None or not secrets.compare_digest(x_admin_key, settings.ADMIN_API_KEY):
+        raise HTTPException(status_code=401, detail="Invalid admin key")
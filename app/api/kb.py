@@ -0,0 +1,99 @@
+import codecs
+import json
+import time
+from typing import AsyncIterator, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+
+from app.api.deps import require_admin_key
+from app.core.newrelic_logger import logger
+from app.utils.company_kb_manager import CompanyKBManager
+
+router = APIRouter(prefix="/kb", dependencies=[Depends(require_admin_key)])
+company_kb_manager = CompanyKBManager()
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Split a streamed UTF-8 body into lines without holding more than one chunk in memory."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def parse_entry(line: str, fmt: str, lineno: int) -> Optional[str]:
+    """One KB entry from a body line; None for blank lines."""
+    if fmt == "jsonl":
+        if not line.strip():
+            return None
+        try:
+            item = json.loads(line)
+        except ValueError:
+            raise ValueError(f"line {lineno}: invalid JSON")
+        if isinstance(item, dict):
+            item = item.get("text")
+        if not isinstance(item, str):
+            raise ValueError(f'line {lineno}: expected a string or an object with a "text" field')
+        line = item
+    line = line.strip()
+    return line or None
+
+
+@router.post("/{company_id}/ingest")
+async def ingest_kb(
+        company_id: str,
+        request: Request,
+        format: str = "lines",
+):
+    """
+    Replace a company's KB from a streamed request body: one entry per line
+    (format=lines) or one JSON string / {"text": ...} object per line
+    (format=jsonl). Entries are written in batches to a staging key and made
+    live atomically once the whole body has been read, so sessions never see
+    a partial KB. On an error before the commit the upload is discarded and
+    the old KB stays; once committed it is kept (abort() is then a no-op).
+    """
+    if format not in ("lines", "jsonl"):
+        raise HTTPException(status_code=400, detail="format must be 'lines' or 'jsonl'")
+
+    log = logger.bind(company_id=company_id)
+    started = time.perf_counter()
+    ingest = company_kb_manager.start_ingest(company_id)
+    batch = []
+    try:
+        lineno = 0
+        async for line in iter_lines(request.stream()):
+            lineno += 1
+            entry = parse_entry(line, format, lineno)
+            if entry is None:
+                continue
+            batch.append(entry)
+            if len(batch) >= company_kb_manager.INGEST_BATCH:
+                await ingest.add(batch)
+                batch = []
+        await ingest.add(batch)
+        version = await ingest.commit()
+    except ValueError as e:
+        await ingest.abort()
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        log.bind(committed=ingest.committed).error(f"KB ingest failed: {e}")
+        await ingest.abort()
+        raise HTTPException(status_code=500, detail="KB ingest failed")
+
+    elapsed = time.perf_counter() - started
+    log.info(f"Ingested {ingest.count} KB entries as v{version} in {elapsed:.1f}s")
+    return {
+        "company_id": company_id,
+        "version": version,
+        "entries": ingest.count,
+        "seconds": round(elapsed, 3),
+        "entries_per_second": round(ingest.count / elapsed) if elapsed else None,
+    }
@@ -1,30 +1,39 @@
 import asyncio
+from contextlib import aclosing
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 #from loguru import logger
 
 # Import your New Relic logger setup
-from app.core.newrelic_logger import logger
+from app.core.newrelic_logger import clip, logger, sampled
+from app.core.config import settings
+from app.core.metrics import (
+    ACTIVE_CONNECTIONS, MESSAGES_THROTTLED, SESSIONS_REJECTED, TIMEOUTS, TTFT_SECONDS, TURNS, company_label, timed,
+)
 
-from app.utils.session_manager import SessionManager
+from app.utils.session_manager import SessionLeaseLost, SessionManager, new_owner
 from app.utils.customer_manager import CustomerManager
 from app.utils.context_manager import ContextManager
+from app.utils.context_policy import ContextPolicy, ContextWindow
 from app.utils.openai_client import OpenAIClient
-from app.utils.conversation_manager import ConversationManager
+from app.utils.prompt_assembler import CompiledPrefix
+from app.utils.openai_limiter import OpenAIOverloaded
+from app.utils.rate_limiter import admission_control, rate_limiter
+from app.utils.session_reaper import session_reaper
 from app.utils.company_kb_manager import CompanyKBManager
-from app.models.customer import Customer
-from pydantic import ValidationError
+from app.utils.answer_cache import answer_cache, is_standalone
+from app.models.customer import normalize_phone_number
 from datetime import datetime, timezone
 from typing import Optional
-import uuid
-import json
+import math
+import time
 
 
 router = APIRouter()
 session_manager = SessionManager()
 customer_manager = CustomerManager()
 context_manager = ContextManager()
+context_policy = ContextPolicy()
 openai_client = OpenAIClient()
-conversation_manager = ConversationManager()
 company_kb_manager = CompanyKBManager()
 
 
@@ -32,14 +41,145 @@ company_kb_manager = CompanyKBManager()
 async def wait_for_message_with_timeout(websocket: WebSocket, timeout: int = session_manager.EXPIRY_SECONDS) -> str:
     return await asyncio.wait_for(websocket.receive_text(), timeout=timeout)
 
+async def send_notice(websocket: WebSocket, text: str) -> None:
+    """A server message in place of a reply; streaming clients also need the end marker."""
+    await websocket.send_text(text)
+    if settings.STREAM_RESPONSES:
+        await websocket.send_text(settings.STREAM_END_MARKER)
+
+def in_background(pending: set, write, stage: str, backend: str, company: str, log) -> None:
+    """
+    Run a post-reply write off the reply path. Latency and failures are recorded
+    under `stage` like any timed() block; failures are logged, not raised.
+    pending keeps the task referenced until it is done, so the session can wait for it.
+    """
+    async def run():
+        try:
+            with timed(stage, backend, company):
+                await write
+        except SessionLeaseLost:
+            # The next user message hits the same lease check and stops the session
+            log.warning(f"Session lease lost before {stage}")
+        except Exception as e:
+            log.error(f"Background {stage} failed: {e}")
+
+    task = asyncio.create_task(run())
+    pending.add(task)
+    task.add_done_callback(pending.discard)
+
+async def stream_reply(
+        websocket: WebSocket,
+        window: ContextWindow,
+        kb_snippets: list[str],
+        prefix: Optional[CompiledPrefix],
+        company: str,
+        log,
+) -> Optional[str]:
+    """
+    Forward reply deltas to the socket as they arrive, then send the end-of-message marker.
+    Returns the full reply, or None if generation failed.
+    """
+    metrics = {}
+    parts = []
+    try:
+        # aclosing: a disconnect mid-stream closes the generator right away, which
+        # releases its OpenAI limiter slot (instead of whenever it is collected)
+        async with aclosing(openai_client.generate_streaming_response(
+            window.messages, kb_snippets, window.summary, metrics=metrics, prefix=prefix
+        )) as deltas:
+            async for delta in deltas:
+                parts.append(delta)
+                await websocket.send_text(delta)
+    except WebSocketDisconnect:
+        raise
+    except Exception as e:
+        log.error(f"OpenAI streaming failed: {e}")
+        if isinstance(e, OpenAIOverloaded):
+            TIMEOUTS.inc("openai_queue", company)
+        if parts:
+            await websocket.send_text("\n[Error: Could not generate response]")
+        else:
+            await websocket.send_text("Sorry, something went wrong generating a response.")
+        await websocket.send_text(settings.STREAM_END_MARKER)
+        return None
+
+    await websocket.send_text(settings.STREAM_END_MARKER)
+    if "ttft" in metrics:
+        TTFT_SECONDS.observe(metrics["ttft"], company)
+    if sampled("reply_timing"):
+        log.bind(
+            ttft_ms=round(metrics.get("ttft", 0) * 1000, 1),
+            generation_ms=round(metrics.get("total", 0) * 1000, 1),
+        ).info("Streamed reply")
+    return "".join(parts)
+
 @router.websocket("/ws/chat")
 async def websocket_chat(websocket: WebSocket):
-    await websocket.accept()
+    # Refuse before touching Redis/Mongo so a full worker stays cheap to say no
+    if not admission_control.try_admit():
+        SESSIONS_REJECTED.inc("busy")
+        try:
+            await websocket.accept()
+            await websocket.send_text(f"Server busy, retry in {admission_control.retry_hint()} s")
+            await websocket.close(code=1013)
+        except Exception:
+            pass
+        return
+
+    ACTIVE_CONNECTIONS.inc()
+    try:
+        await chat_session(websocket)
+    finally:
+        ACTIVE_CONNECTIONS.dec()
+        admission_control.release()
 
+async def keep_lease(websocket: WebSocket, session_id: str, owner: str, lease_lost: asyncio.Event, log) -> None:
+    """Renew the session lease while connected; close the socket if another connection took it."""
+    keep_alive = session_reaper.keep_alive_keys(session_id)
+    while True:
+        await asyncio.sleep(settings.SESSION_LEASE_SECONDS / 3)
+        try:
+            held = await session_manager.renew_lease(session_id, owner, keep_alive)
+        except Exception as e:
+            log.error(f"Failed to renew session lease: {e}")
+            continue
+        if not held:
+            lease_lost.set()
+            log.warning("Session lease lost, closing connection")
+            try:
+                await websocket.send_text("This session was resumed on another connection.")
+                await websocket.close()
+            except Exception:
+                pass
+            return
+
+async def resume_handshake(websocket: WebSocket, token: str, owner: str) -> Optional[dict]:
+    """Take over an existing session from its resume token. Returns the session meta or None."""
+    try:
+        with timed("session_resume", "redis", "unknown"):
+            status, session_id = await session_manager.resume_session(token, owner)
+            meta = await session_manager.get_session(session_id) if status == "ok" else {}
+    except Exception as e:
+        logger.error(f"Failed to resume session: {e}")
+        await websocket.send_text("Internal server error. Please try again later.")
+        await websocket.close()
+        return None
+
+    if status != "ok" or not meta:
+        await websocket.send_text(
+            "Invalid session token." if status == "invalid" else "Session expired. Please start a new session."
+        )
+        await websocket.close()
+        return None
+    return {"session_id": session_id, **meta}
+
+async def new_session_handshake(websocket: WebSocket, owner: str) -> Optional[dict]:
+    """Company -> phone handshake and session creation. Returns the session meta or None."""
     # Step 0: Company selection before phone number
     await websocket.send_text("Select company for this session:")
 
     company_id = await wait_for_message_with_timeout(websocket)
+    company = company_label(company_id)
 
     # Step 1: Phone number input
     await websocket.send_text("Welcome! Please provide your phone number: ")
@@ -48,48 +188,88 @@ async def websocket_chat(websocket: WebSocket):
         # Wait max 5 minutes (session TTL) for phone number
         phone_number_raw = await wait_for_message_with_timeout(websocket, timeout=session_manager.EXPIRY_SECONDS)
     except asyncio.TimeoutError:
+        TIMEOUTS.inc("handshake", company)
         await websocket.send_text("Session timed out due to inactivity.")
         await websocket.close()
-        return
+        return None
     except Exception:
-        return
+        return None
 
     # Validate phone number
     try:
-        temp_id = str(uuid.uuid4())
-        validated = Customer(_id=temp_id, phone_number=phone_number_raw)
-        normalized_phone = validated.phone_number
-    except ValidationError as e:
+        normalized_phone = normalize_phone_number(phone_number_raw)
+    except ValueError:
         await websocket.send_text("Invalid phone number format. Please try again")
         await websocket.close()
-        return
+        return None
     
     # Get or create customer
     try:
-        customer_id = await customer_manager.get_or_create_customer(normalized_phone)
+        with timed("customer_lookup", "mongo", company):
+            customer_id = await customer_manager.get_or_create_customer(normalized_phone)
     except Exception as e:
         logger.bind(phone_number = normalized_phone).error(f"Failed to get or create customer: {e}")
         await websocket.send_text("Internal server error. Please try again later.")
         await websocket.close()
-        return
+        return None
 
-    # Step 2: Create new session
+    # Step 2: Create new session (holding its lease from the start)
+    start_time = datetime.now(timezone.utc)
+    meta = {
+        "customer_id": customer_id,
+        "company_id": company_id,
+        "phone_number": normalized_phone,
+        "start_time": start_time.isoformat(),
+    }
     try:
-        session = await session_manager.create_session(customer_id)
-        session_id = session["session_id"]
-        start_time = datetime.now(timezone.utc)
+        with timed("session_create", "redis", company):
+            session = await session_manager.create_session(customer_id, metadata=meta, owner=owner)
     except Exception as e:
         logger.error(f"Failed to create session for customer {customer_id}: {e}")
         await websocket.send_text("Internal server error. Please try again later.")
         await websocket.close()
-        return
+        return None
     
-    log = logger.bind(session_id = session_id, customer_id = customer_id)
-    log.info(f"New session created started for customer.")
+    session_id = session["session_id"]
+    logger.bind(session_id = session_id, customer_id = customer_id).info(f"New session created started for customer.")
 
     await websocket.send_text(
         f"Hello Customer {customer_id[:8]}! Your session ID is {session_id[:8]}"
     )
+    # Opt-in so existing clients keep the same frame sequence
+    if websocket.query_params.get("resumable") == "1":
+        await websocket.send_text(f"session_token:{session['token']}")
+    return {"session_id": session_id, **meta}
+
+async def chat_session(websocket: WebSocket):
+    await websocket.accept()
+    owner = new_owner()
+
+    token = websocket.query_params.get("resume")
+    if token:
+        session = await resume_handshake(websocket, token, owner)
+    else:
+        session = await new_session_handshake(websocket, owner)
+    if session is None:
+        return
+
+    session_id = session["session_id"]
+    customer_id = session.get("customer_id")
+    company_id = session.get("company_id")
+    company = company_label(company_id)
+    # Clients that never asked for a token can't resume, so persist them right away
+    resumable = bool(token) or websocket.query_params.get("resumable") == "1"
+    meta = {k: session.get(k) for k in ("customer_id", "company_id", "phone_number", "start_time")}
+
+    log = logger.bind(session_id = session_id, customer_id = customer_id)
+
+    # Connection-local history, written through to Redis on every append while we hold the lease
+    session_history = context_manager.session_history(session_id, owner=owner)
+    if token:
+        with timed("history_load", "redis", company):
+            await session_history.load()
+        log.info(f"Resumed session with {len(session_history)} messages")
+        await websocket.send_text(f"Welcome back! Resumed session {session_id[:8]}")
 
     """# Step 3: Wait for KB upload
     await websocket.send_text("Please upload your Knowledge Base for this session: ")
@@ -108,72 +288,154 @@ async def websocket_chat(websocket: WebSocket):
         await websocket.close()
         return"""
 
-    # Step 3: Fetch company KB directly
+    # Step 3: Load the company KB retrieval index (snippets are selected per turn)
     try:
-        company_kb = await company_kb_manager.get_kb(company_id)
-        if company_kb:
-            await context_manager.add_message(session_id, "system", company_kb)
-            log.info(f"Loaded company KB into session for {company_id}")
+        with timed("kb_load", "redis", company):
+            kb_entries = await company_kb_manager.load_index(company_id)
+        if kb_entries:
+            log.info(f"Loaded company KB index for {company_id} ({kb_entries} entries)")
     except Exception as e:
         log.error(f"Failed to load company KB: {e}")
 
     # Step 4: Conversation Loop
+    lease_lost = asyncio.Event()
+    lease_task = asyncio.create_task(keep_lease(websocket, session_id, owner, lease_lost, log))
+    pending_writes: set = set()
+    ended = False
     try:
         while True:
             try:
                 data = await wait_for_message_with_timeout(websocket)
 
                 # log = logger.bind(customer_id=customer_id, session_id=session_id)
-                log.info(f"Received msg: {data}")
+                if sampled("received_msg"):
+                    log.info("Received msg: {}", clip(data))
             except asyncio.TimeoutError:
+                TIMEOUTS.inc("inactivity", company)
                 await websocket.send_text("Session timed out due to inactivity.")
                 log.info("Session timeout.")
+                ended = True
                 break
             
             # log.info(f"Customer {customer_id} | Session {session_id} | Msg: {data}")
 
-            # Save user msg
-            await context_manager.add_message(session_id, "user", data)
-
-            # Get conversation history + session KB
-            history = await context_manager.get_history(session_id, company_id=company_id)
-
-            # Await OpenAI client
+            # Per-customer and per-company message budgets; Redis trouble lets messages through
             try:
-                reply = await openai_client.generate_response(history)
+                with timed("rate_limit", "redis", company):
+                    throttled, wait = await rate_limiter.take(customer_id, company_id)
             except Exception as e:
-                log.error(f"OpenAI generation failed: {e}")
-                await websocket.send_text("Sorry, something went wrong generating a response.")
+                log.error(f"Rate limit check failed: {e}")
+                throttled = None
+            if throttled:
+                MESSAGES_THROTTLED.inc(throttled, company)
+                log.bind(scope=throttled).warning("Message throttled")
+                await send_notice(
+                    websocket,
+                    f"You're sending messages too quickly. Please wait {math.ceil(wait)} s and try again.",
+                )
                 continue
-            """try:
-                async for token in openai_client.generate_streaming_response(history):
-                    
-                    if token in ("[END]", "\n[Error: Could not generate response]"):
-                        continue
-                    await websocket.send_text(token)
-                    reply_text += token
-            except Exception as e:
-                log.error(f"OpenAI streaming failed: {e}")
-                await websocket.send_text("Sorry, something went wrong generating a response.")
-                continue"""
 
-            # Save bot reply
-            await context_manager.add_message(session_id, "bot", reply)
+            # Stage the user message: it joins the local history now and its write (lease
+            # check + TTL refresh) runs while the window, KB and answer cache are read
+            user_write = session_history.stage("user", data)
+            history = session_history.messages
+            cacheable = settings.ANSWER_CACHE_ENABLED and (len(history) == 1 or is_standalone(data))
 
-            # Refresh session TTL
-            try:
-                await session_manager.refresh_session(session_id)
-            except Exception as e:
-                log.error(f"Error refreshing the session. {e}")
+            # Fit the history into the token-budgeted context window (the summary read
+            # is timed inside); folding old messages is an LLM call, so it runs off the
+            # reply path and this turn keeps the previous summary
+            def fold_in_background(fold) -> None:
+                in_background(pending_writes, fold, "context_summary", context_policy.summarizer.backend, company, log)
 
-            await websocket.send_text(reply)
-            log.info(f"Sent reply: {reply}")
+            async def fit_window() -> ContextWindow:
+                return await context_policy.apply(session_id, history, company, background=fold_in_background)
+
+            # Precompiled prompt prefix, plus the KB entries relevant to this message
+            # (none needed when the whole KB is inlined in the prefix); then repeated
+            # first-turn / standalone questions are looked up in the answer cache
+            async def retrieve() -> tuple:
+                try:
+                    if not company_kb_manager.is_loaded(company_id):
+                        # Not cached on this worker (new version, eviction): read the KB from Redis
+                        with timed("kb_load", "redis", company):
+                            await company_kb_manager.load_index(company_id, counted=False)
+                    with timed("kb_retrieval", "local", company):
+                        prefix = await company_kb_manager.prompt_prefix(company_id)
+                        kb_snippets = [] if prefix.kb_inline else await company_kb_manager.get_relevant_kb(company_id, data)
+                except Exception as e:
+                    log.error(f"KB retrieval failed: {e}")
+                    prefix = None
+                    kb_snippets = []
+
+                kb_version = company_kb_manager.current_version(company_id)
+                cached = None
+                if cacheable:
+                    try:
+                        with timed("answer_cache", "redis", company):
+                            cached = await answer_cache.get(company_id, kb_version, data)
+                    except Exception as e:
+                        log.error(f"Answer cache lookup failed: {e}")
+                return prefix, kb_snippets, kb_version, cached
+
+            window, (prefix, kb_snippets, kb_version, reply) = await asyncio.gather(fit_window(), retrieve())
+            # Nothing is generated or sent for a message that wasn't persisted (or whose lease is gone)
+            with timed("context_commit", "redis", company):
+                await user_write
+
+            # Await OpenAI client
+            from_cache = reply is not None
+            started = time.perf_counter()
+            if from_cache:
+                if settings.STREAM_RESPONSES:
+                    await websocket.send_text(reply)
+                    await websocket.send_text(settings.STREAM_END_MARKER)
+            elif settings.STREAM_RESPONSES:
+                with timed("llm", "openai", company):
+                    reply = await stream_reply(websocket, window, kb_snippets, prefix, company, log)
+                if reply is None:
+                    continue
+            else:
+                try:
+                    with timed("llm", "openai", company):
+                        reply = await openai_client.generate_response(window.messages, kb_snippets, window.summary, prefix)
+                    if sampled("reply_timing"):
+                        log.bind(generation_ms=round((time.perf_counter() - started) * 1000, 1)).info("Generated reply")
+                except Exception as e:
+                    log.error(f"OpenAI generation failed: {e}")
+                    if isinstance(e, OpenAIOverloaded):
+                        TIMEOUTS.inc("openai_queue", company)
+                    await websocket.send_text("Sorry, something went wrong generating a response.")
+                    continue
+
+            if not settings.STREAM_RESPONSES:
+                await websocket.send_text(reply)
+            TURNS.inc(company)
+            if sampled("sent_reply"):
+                log.info("Sent reply: {}", clip(reply))
+
+            # Off the reply path: save the bot reply (after the user message, before the
+            # next one) and refresh the session TTL; cache the answer
+            in_background(pending_writes, session_history.stage("bot", reply), "reply_commit", "redis", company, log)
+            if cacheable and not from_cache:
+                in_background(
+                    pending_writes,
+                    answer_cache.put(company_id, kb_version, data, reply, time.perf_counter() - started),
+                    "answer_cache_store", "redis", company, log,
+                )
 
     except WebSocketDisconnect:
         # await session_manager.end_session(session_id)
         # await context_manager.clear_history(session_id)
         log.info(f"Session {session_id} disconnected for customer {customer_id}")
 
+    except SessionLeaseLost:
+        lease_lost.set()
+        log.warning("Session resumed on another connection, stopping")
+        try:
+            await websocket.send_text("This session was resumed on another connection.")
+        except Exception:
+            pass
+
     except Exception as e:
         log.error(f"Unexpected error in session {session_id}: {e}")
         try:
@@ -181,44 +443,25 @@ async def websocket_chat(websocket: WebSocket):
         except Exception:
             pass
     finally:
-        try:
-            end_time = datetime.now(timezone.utc)
-            raw_history = await context_manager.get_history(session_id, company_id=company_id)
-
-            messages_for_save =[]
-            for raw in raw_history:
-                item = json.loads(raw)
-                ts = item.get("timestamp")
-                try:
-                    dt = datetime.fromisoformat(ts) if ts else datetime.now(timezone.utc)
-                except Exception:
-                    dt = datetime.now(timezone.utc)
-                messages_for_save.append({
-                    "role": item.get("role", "user"),
-                    "message": item.get("message", ""),
-                    "timestamp": dt
-                })
-            
-            customer_doc = await customer_manager.get_customer(normalized_phone)
-            phone_for_record = customer_doc.get("phone_number") if customer_doc else normalized_phone
-
-            conversation_id = await conversation_manager.save_conversation(
-                company_id=company_id,
-                customer_id=customer_id,
-                session_id=session_id,
-                phone_number=phone_for_record,
-                messages=messages_for_save,
-                start_time=start_time,
-                end_time=end_time,
-            )
-            log.bind(conversation_id=conversation_id).info("Conversation persisted")
-        except Exception as e:
-            log.error(f"Failed to persist conversation: {e}")
-
-        await session_manager.end_session(session_id)
-        await context_manager.clear_history(session_id)
+        lease_task.cancel()
+        # Let post-reply writes land before the session is detached or persisted and cleared
+        await session_history.flush()
+        if pending_writes:
+            await asyncio.gather(*pending_writes)
+        if lease_lost.is_set() or session_history.lease_lost:
+            # The new owner persists the session when it ends
+            pass
+        elif resumable and not ended:
+            # Keep the session for a reconnect; SessionReaper persists it if none comes
+            try:
+                with timed("session_detach", "redis", company):
+                    await session_manager.detach(session_id, owner, session_reaper.keep_alive_keys(session_id))
+            except Exception as e:
+                log.error(f"Failed to detach session: {e}")
+        else:
+            await session_reaper.finalize(session_id, meta, session_history.messages)
         try:
             await websocket.close()
         except Exception:
             pass
-        log.info("Session cleanup complete.")
\ No newline at end of file
+        log.info("Session cleanup complete.")
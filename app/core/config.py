@@ -7,12 +7,75 @@ class Settings:
     PROJECT_NAME: str = "Support Bot"
     OPENAI_KEY: str = os.getenv("OPENAI_API_KEY")
     REDIS_URL: str = os.getenv("REDIS_URL")
+    REDIS_CLUSTER = os.getenv("REDIS_CLUSTER", "0") == "1"
+    REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 0))
+    REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", 5))
     MONGODB_URI: str = os.getenv("MONGODB_URI")
     MONGODB_DB: str = os.getenv("MONGODB_DB")
+    MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 10))
     NEW_RELIC_INGEST_LICENSE_KEY = os.getenv("NEW_RELIC_INGEST_LICENSE_KEY")
     NEW_RELIC_LOG_API_URL = os.getenv("NEW_RELIC_LOG_API_URL")
     OPENAI_MODEL = os.getenv("OPENAI_MODEL")
     SYSTEM_PROMPT = os.getenv("SYSTEM_PROMPT")
     WS_URL = os.getenv("WS_URL")
+    NEW_RELIC_QUEUE_SIZE = int(os.getenv("NEW_RELIC_QUEUE_SIZE", 10000))
+    NEW_RELIC_BATCH_SIZE = int(os.getenv("NEW_RELIC_BATCH_SIZE", 100))
+    NEW_RELIC_FLUSH_INTERVAL = float(os.getenv("NEW_RELIC_FLUSH_INTERVAL", 2))
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG")
+    LOG_STDOUT_ASYNC = os.getenv("LOG_STDOUT_ASYNC", "1") == "1"
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+    LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+    LOG_PAYLOAD_CHARS = int(os.getenv("LOG_PAYLOAD_CHARS", 0))
+    OPENAI_FAKE = os.getenv("OPENAI_FAKE", "0") == "1"
+    OPENAI_RPM = int(os.getenv("OPENAI_RPM", 500))
+    OPENAI_TPM = int(os.getenv("OPENAI_TPM", 200000))
+    OPENAI_MAX_IN_FLIGHT = int(os.getenv("OPENAI_MAX_IN_FLIGHT", 16))
+    OPENAI_TARGET_LATENCY = float(os.getenv("OPENAI_TARGET_LATENCY", 10))
+    OPENAI_QUEUE_TIMEOUT = float(os.getenv("OPENAI_QUEUE_TIMEOUT", 10))
+    OPENAI_MAX_QUEUE = int(os.getenv("OPENAI_MAX_QUEUE", 200))
+    STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "0") == "1"
+    STREAM_END_MARKER = os.getenv("STREAM_END_MARKER", "[END]")
+    KB_TOP_K = int(os.getenv("KB_TOP_K", 5))
+    KB_TOKEN_BUDGET = int(os.getenv("KB_TOKEN_BUDGET", 800))
+    KB_CACHE_SIZE = int(os.getenv("KB_CACHE_SIZE", 256))
+    KB_CACHE_TTL = float(os.getenv("KB_CACHE_TTL", 3600))
+    KB_INLINE_TOKENS = int(os.getenv("KB_INLINE_TOKENS", 800))
+    CUSTOMER_CACHE_SIZE = int(os.getenv("CUSTOMER_CACHE_SIZE", 10000))
+    CONVERSATION_WRITE_BEHIND = os.getenv("CONVERSATION_WRITE_BEHIND", "1") == "1"
+    CONVERSATION_SPOOL_DIR = os.getenv("CONVERSATION_SPOOL_DIR", "conversation_spool")
+    CONVERSATION_BATCH_SIZE = int(os.getenv("CONVERSATION_BATCH_SIZE", 100))
+    CONVERSATION_BATCH_AGE = float(os.getenv("CONVERSATION_BATCH_AGE", 1))
+    CONVERSATION_WRITE_CONCURRENCY = int(os.getenv("CONVERSATION_WRITE_CONCURRENCY", 4))
+    ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+    ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", 86400))
+    ANSWER_CACHE_LOCAL_SIZE = int(os.getenv("ANSWER_CACHE_LOCAL_SIZE", 5000))
+    ANSWER_CACHE_NEAR_DUP = os.getenv("ANSWER_CACHE_NEAR_DUP", "0") == "1"
+    ANSWER_CACHE_NEAR_THRESHOLD = float(os.getenv("ANSWER_CACHE_NEAR_THRESHOLD", 0.8))
+    CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 2000))
+    CONTEXT_SUMMARIZER = os.getenv("CONTEXT_SUMMARIZER", "openai")
+    CONTEXT_SUMMARY_TIMEOUT = float(os.getenv("CONTEXT_SUMMARY_TIMEOUT", 10))
+    CONTEXT_ENCODING = os.getenv("CONTEXT_ENCODING", "msgpack")
+    SESSION_LEASE_SECONDS = float(os.getenv("SESSION_LEASE_SECONDS", 15))
+    SESSION_RESUME_GRACE = float(os.getenv("SESSION_RESUME_GRACE", 120))
+    SESSION_REAPER_INTERVAL = float(os.getenv("SESSION_REAPER_INTERVAL", 5))
+    ADMIN_API_KEY = os.getenv("ADMIN_API_KEY")
+    ARCHIVE_PATH = os.getenv("ARCHIVE_PATH", "conversation_archive")
+    ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", 90))
+    ARCHIVE_COMPRESSION = os.getenv("ARCHIVE_COMPRESSION", "zstd")
+    ANALYTICS_CHUNK_SIZE = int(os.getenv("ANALYTICS_CHUNK_SIZE", 100000))
+    ANALYTICS_LAG_SECONDS = float(os.getenv("ANALYTICS_LAG_SECONDS", 600))
+    ANALYTICS_CONCURRENCY_DAYS = int(os.getenv("ANALYTICS_CONCURRENCY_DAYS", 7))
+    MAX_SESSIONS_PER_WORKER = int(os.getenv("MAX_SESSIONS_PER_WORKER", 1000))
+    ADMISSION_RETRY_AFTER = float(os.getenv("ADMISSION_RETRY_AFTER", 5))
+    CUSTOMER_MESSAGES_PER_MINUTE = float(os.getenv("CUSTOMER_MESSAGES_PER_MINUTE", 30))
+    CUSTOMER_MESSAGE_BURST = float(os.getenv("CUSTOMER_MESSAGE_BURST", 10))
+    COMPANY_MESSAGES_PER_MINUTE = float(os.getenv("COMPANY_MESSAGES_PER_MINUTE", 0))
+    COMPANY_MESSAGE_BURST = float(os.getenv("COMPANY_MESSAGE_BURST", 300))
+    WARMUP_REDIS_CONNECTIONS = int(os.getenv("WARMUP_REDIS_CONNECTIONS", 10))
+    WARMUP_KB_COMPANIES = int(os.getenv("WARMUP_KB_COMPANIES", 20))
+    WARMUP_LLM_CONNECTIONS = int(os.getenv("WARMUP_LLM_CONNECTIONS", 2))
+    WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", 30))
+    WARMUP_RETRY_INTERVAL = float(os.getenv("WARMUP_RETRY_INTERVAL", 5))
+    HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", 2))
 
 settings = Settings()
\ No newline at end of file
@@ -0,0 +1,181 @@
+"""
+Minimal in-process metrics with Prometheus text exposition.
+
+Kept dependency-free and cheap enough to leave on in production: an
+observation is a bisect plus a few integer adds on a per-label-set list, with
+no locking (everything runs on the event loop thread). Exposed by the
+/metrics route in main.py.
+"""
+
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# company_id comes from the client, so cap how many distinct values become labels
+MAX_COMPANY_LABELS = 200
+_companies: set = set()
+
+
+def company_label(company_id: str | None) -> str:
+    if not company_id:
+        return "unknown"
+    if company_id in _companies:
+        return company_id
+    if len(_companies) < MAX_COMPANY_LABELS:
+        _companies.add(company_id)
+        return company_id
+    return "other"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    TYPE = "counter"
+
+    def __init__(self, name: str, doc: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} {self.TYPE}"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class Gauge(Counter):
+    TYPE = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels: str, value: float) -> None:
+        self._values[labels] = value
+
+
+class Histogram:
+    def __init__(self, name: str, doc: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # per label set: [count per bucket..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, series in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = 'le="%s"' % bound
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            cumulative += series[len(self.buckets)]
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-1]}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Tuple[str, Callable[[], Dict[str, float]]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, prefix: str, collect: Callable[[], Dict[str, float]]) -> None:
+        """Export a component's stats() dict as gauges named <prefix>_<key>."""
+        self._collectors.append((prefix, collect))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, collect in self._collectors:
+            try:
+                stats = collect()
+            except Exception:
+                continue
+            for key, value in stats.items():
+                if isinstance(value, (int, float)):
+                    lines.append(f"# TYPE {prefix}_{key} gauge")
+                    lines.append(f"{prefix}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "chatbot_stage_seconds", "Latency of each websocket_chat stage", ("stage", "backend", "company"),
+))
+STAGE_ERRORS = registry.register(Counter(
+    "chatbot_stage_errors_total", "Exceptions raised per websocket_chat stage", ("stage", "backend", "company"),
+))
+TIMEOUTS = registry.register(Counter(
+    "chatbot_timeouts_total", "Timeouts by kind", ("kind", "company"),
+))
+ACTIVE_CONNECTIONS = registry.register(Gauge(
+    "chatbot_active_connections", "Open /ws/chat websockets",
+))
+TTFT_SECONDS = registry.register(Histogram(
+    "chatbot_llm_ttft_seconds", "Time to first streamed token", ("company",),
+))
+TURNS = registry.register(Counter(
+    "chatbot_turns_total", "Completed chat turns", ("company",),
+))
+SESSIONS_REJECTED = registry.register(Counter(
+    "chatbot_sessions_rejected_total", "Connections refused by admission control", ("reason",),
+))
+MESSAGES_THROTTLED = registry.register(Counter(
+    "chatbot_messages_throttled_total", "Messages refused by the rate limiter", ("scope", "company"),
+))
+
+
+class timed:
+    """
+    with timed("llm", "openai", company): ...
+    Records the block's duration in chatbot_stage_seconds and counts exceptions
+    in chatbot_stage_errors_total (the exception still propagates).
+    """
+
+    __slots__ = ("labels", "started")
+
+    def __init__(self, stage: str, backend: str, company: str):
+        self.labels = (stage, backend, company)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        STAGE_SECONDS.observe(time.perf_counter() - self.started, *self.labels)
+        if exc_type is not None:
+            STAGE_ERRORS.inc(*self.labels)
+        return False
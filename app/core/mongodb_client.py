@@ -10,7 +10,8 @@ async def connect_to_mongo():
     Create a MongoDB client and assign database reference.
     """
     global client, db
-    client = AsyncIOMotorClient(settings.MONGODB_URI, serverSelectionTimeoutMS=5000)
+    # minPoolSize: the driver keeps that many connections open (warmup.py opens them up front)
+    client = AsyncIOMotorClient(settings.MONGODB_URI, serverSelectionTimeoutMS=5000, minPoolSize=settings.MONGO_MIN_POOL_SIZE)
     db = client[settings.MONGODB_DB]
     logger.info(f"Connected to MongoDB at {settings.MONGODB_URI}, using DB: {settings.MONGODB_DB}")
 
@@ -1,6 +1,43 @@
 import app.core.mongodb_client as mongo_client
 from loguru import logger
 
+# Indexes the app's queries rely on, per collection the data actually lives in:
+# (keys, options)
+REQUIRED_INDEXES = {
+    # Customers collection index (already present)
+    "customers": [
+        ([("phone_number", 1)], {"unique": True}),
+    ],
+    # Conversations: lookups by id/session, keyset listing per customer and per company
+    "conversations": [
+        ([("conversation_id", 1)], {"unique": True}),
+        ([("session_id", 1)], {}),
+        ([("customer_id", 1), ("created_at", -1), ("conversation_id", -1)], {}),
+        ([("company_id", 1), ("created_at", -1), ("conversation_id", -1)], {}),
+        # Tiering job scans by age; the analytics job resumes from a (created_at, id) watermark
+        ([("created_at", 1), ("conversation_id", 1)], {}),
+    ],
+    # Company KB chunks written by bulk ingestion, read back in order per upload
+    "company_kb_chunks": [
+        ([("company_id", 1), ("upload_id", 1), ("seq", 1)], {}),
+        ([("upload_id", 1)], {}),
+    ],
+}
+
+
+async def verify_indexes() -> None:
+    """Raise if any REQUIRED_INDEXES entry is missing from its collection."""
+    missing = []
+    for name, indexes in REQUIRED_INDEXES.items():
+        info = await mongo_client.db[name].index_information()
+        existing = {tuple((k, int(d)) for k, d in spec["key"]) for spec in info.values()}
+        for keys, _ in indexes:
+            if tuple(keys) not in existing:
+                missing.append(f"{name}: {keys}")
+    if missing:
+        raise RuntimeError(f"Missing MongoDB indexes: {'; '.join(missing)}")
+
+
 async def init_mongodb():
     """
     Initialize MongoDB collections and indexes.
@@ -9,15 +46,14 @@ async def init_mongodb():
     if mongo_client.db is None:
         await mongo_client.connect_to_mongo()
 
-    # Customers collection index (already present)
-    customers = mongo_client.db["customers"]
-    await customers.create_index("phone_number", unique=True)
-
-    # Conversations collection: index for queries by customer_id, session_id and created_at
-    conversations = mongo_client.db["conversation"]
-    await conversations.create_index("conversation_id", unique=True)
-    await conversations.create_index([("customer_id", 1), ("created_at", -1)])
-    await conversations.create_index("session_id")
-
+    for name, indexes in REQUIRED_INDEXES.items():
+        collection = mongo_client.db[name]
+        for keys, options in indexes:
+            try:
+                await collection.create_index(keys, **options)
+            except Exception as e:
+                # e.g. no createIndex permission; verify_indexes decides if that matters
+                logger.warning(f"Could not create index {keys} on '{name}': {e}")
 
-    logger.info("MongoDB initialized: 'customers' + 'conversations' collection with unique index on phone_number")
+    await verify_indexes()
+    logger.info(f"MongoDB initialized, indexes verified on: {', '.join(REQUIRED_INDEXES)}")
@@ -1,71 +1,375 @@
 from loguru import logger as _logger
 import requests
+from requests.adapters import HTTPAdapter
+import atexit
+import collections
+import gzip
+import json
+import random
 import socket
+import sys
+import threading
 import time
 from app.core.config import settings
 
 HEADERS = {
     "Content-Type": "application/json",
+    "Content-Encoding": "gzip",
     "Api-Key": settings.NEW_RELIC_INGEST_LICENSE_KEY,  
 }
 
 
 class NewRelicSink:
-    """Custom Loguru sink to send logs to New Relic."""
+    """
+    Custom Loguru sink to send logs to New Relic.
+
+    write() never does network I/O: records are appended to a bounded in-memory
+    queue and a background thread ships them in gzipped batches, so a slow or
+    unreachable ingest endpoint cannot stall the event loop. When the queue is
+    full the oldest record is dropped and counted in `dropped`.
+    """
+
+    def __init__(
+            self,
+            url: str | None = None,
+            max_queue: int = settings.NEW_RELIC_QUEUE_SIZE,
+            batch_size: int = settings.NEW_RELIC_BATCH_SIZE,
+            flush_interval: float = settings.NEW_RELIC_FLUSH_INTERVAL,
+            timeout: float = 5,
+    ):
+        self.url = url or settings.NEW_RELIC_LOG_API_URL
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.dropped = 0
+        self.sent = 0
+        self.failed = 0
+
+        self._queue = collections.deque(maxlen=max_queue)
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._flushing = False
+        self._closed = False
+        self._host = socket.gethostname()
+
+        self._http = requests.Session()
+        self._http.headers.update(HEADERS)
+        self._http.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self._http.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+
+        self._worker = threading.Thread(target=self._run, name="newrelic-shipper", daemon=True)
+        self._worker.start()
 
     def write(self, message):
         record = message.record
-        level = record["level"].name
-        log_message = record["message"]
 
         # Extract context if provided
         session_id = record["extra"].get("session_id", None)
         customer_id = record["extra"].get("customer_id", None)
 
+        entry = {
+            "timestamp": int(record["time"].timestamp() * 1000),
+            "message": record["message"],
+            "level": record["level"].name,
+            "attributes": {
+                "module": record["module"],
+                "function": record["function"],
+                "line": record["line"],
+                "session_id": session_id,
+                "customer_id": customer_id,
+            },
+        }
+
+        with self._cond:
+            if self._closed:
+                self.dropped += 1
+                return
+            if len(self._queue) == self._queue.maxlen:
+                # deque(maxlen) evicts the oldest record on append
+                self.dropped += 1
+            self._queue.append(entry)
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while not self._closed and len(self._queue) < self.batch_size:
+                    if self._flushing and self._queue:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                if not self._queue:
+                    if self._closed:
+                        return
+                    continue
+
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                self._in_flight = len(batch)
+
+            self._ship(batch)
+
+            with self._cond:
+                self._in_flight = 0
+                self._cond.notify_all()
+
+    def _ship(self, batch: list[dict]) -> None:
         payload = [
             {
                 "common": {
                     "attributes": {
                         "service.name": "chatbot",
-                        "host": socket.gethostname(),
+                        "host": self._host,
                         "environment": "test"
                     }
                 },
-                "logs": [
-                    {
-                        "timestamp": int(time.time() * 1000),
-                        "message": log_message,
-                        "level": level,
-                        "attributes": {
-                            "module": record["module"],
-                            "function": record["function"],
-                            "line": record["line"],
-                            "session_id": session_id,
-                            "customer_id": customer_id,
-                        },
-                    }
-                ],
+                "logs": batch,
             }
         ]
+        body = gzip.compress(json.dumps(payload, default=str).encode("utf-8"))
 
         try:
-            resp = requests.post(settings.NEW_RELIC_LOG_API_URL, headers=HEADERS, json=payload, timeout=5)
+            resp = self._http.post(self.url, data=body, timeout=self.timeout)
             if resp.status_code != 202:
+                self.failed += len(batch)
                 print(f"New Relic log send failed: {resp.status_code}, body: {resp.text}")
+            else:
+                self.sent += len(batch)
         except Exception as e:
+            self.failed += len(batch)
             print(f"Failed to send log to New Relic: {e}")
 
+    def drain(self, timeout: float = 5) -> bool:
+        """
+        Block until the queue is drained or `timeout` expires. Returns True if drained.
+        (Not named flush(): Loguru calls flush() on stream sinks after every write.)
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            # Ship partial batches right away instead of waiting for the batch age
+            self._flushing = True
+            self._cond.notify_all()
+            try:
+                while self._queue or self._in_flight:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self._flushing = False
+        return True
+
+    def close(self, timeout: float = 5) -> None:
+        """Flush pending records and stop the worker thread."""
+        self.drain(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._worker.join(timeout)
+        self._http.close()
+        if self.dropped:
+            print(f"New Relic sink dropped {self.dropped} log records")
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._queue),
+            "sent": self.sent,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
+
+
+class StdoutSink:
+    """
+    Loguru sink for the console that never blocks the caller.
+
+    write() appends the formatted line to a bounded queue; a background thread
+    writes queued lines to stdout in batches, so a slow consumer of the
+    process's stdout (a log shipper pipe, a paused terminal) cannot stall the
+    event loop. When the queue is full the oldest line is dropped and counted.
+    """
+
+    def __init__(self, stream=None, max_queue: int = settings.LOG_QUEUE_SIZE):
+        self._stream = stream
+        self.dropped = 0
+        self.written = 0
+        self._queue = collections.deque(maxlen=max_queue)
+        self._cond = threading.Condition()
+        self._writing = False
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="stdout-log-writer", daemon=True)
+        self._worker.start()
+
+    def write(self, message):
+        with self._cond:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+            self._queue.append(str(message))
+            if not self._writing:
+                self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                lines = list(self._queue)
+                self._queue.clear()
+                self._writing = True
+            stream = self._stream or sys.stdout
+            try:
+                stream.write("".join(lines))
+                stream.flush()
+            except Exception:
+                pass
+            with self._cond:
+                self.written += len(lines)
+                self._writing = False
+                self._cond.notify_all()
+
+    def drain(self, timeout: float = 5) -> bool:
+        """Block until queued lines are written (or timeout). Returns True if drained."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._queue or self._writing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout: float = 5) -> None:
+        self.drain(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._worker.join(timeout)
+
+    def stats(self) -> dict:
+        return {"queued": len(self._queue), "written": self.written, "dropped": self.dropped}
+
+
+def _parse_sample_rates(spec: str) -> dict:
+    """"received_msg=0.1,sent_reply=0.05" -> {"received_msg": 0.1, "sent_reply": 0.05}"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in (spec or "").split(","))):
+        event, _, rate = item.partition("=")
+        rates[event.strip()] = float(rate)
+    return rates
+
+
+SAMPLE_RATES = _parse_sample_rates(settings.LOG_SAMPLE_RATES)
+_sampled_out = collections.Counter()
+
+
+def sampled(event: str) -> bool:
+    """
+    Whether to emit this occurrence of a high-volume log event, per
+    LOG_SAMPLE_RATES (events not listed are always emitted).
+        if sampled("sent_reply"): log.info("Sent reply: {}", clip(reply))
+    """
+    rate = SAMPLE_RATES.get(event)
+    if rate is None or rate >= 1 or random.random() < rate:
+        return True
+    _sampled_out[event] += 1
+    return False
+
+
+def clip(text, limit: int = settings.LOG_PAYLOAD_CHARS) -> str:
+    """Truncate a logged payload (message bodies, replies) to LOG_PAYLOAD_CHARS; 0 keeps it whole."""
+    text = str(text)
+    if limit and len(text) > limit:
+        return f"{text[:limit]}... [+{len(text) - limit} chars]"
+    return text
+
 
 _logger.remove()
 
-_logger.add(lambda msg: print(msg, end=""), level="DEBUG")
+if settings.LOG_STDOUT_ASYNC:
+    stdout_sink = StdoutSink()
+    _logger.add(stdout_sink, level=settings.LOG_LEVEL)
+    # Scripts exit without a shutdown hook; don't lose their last lines
+    atexit.register(stdout_sink.drain)
+else:
+    stdout_sink = None
+    _logger.add(lambda msg: print(msg, end=""), level=settings.LOG_LEVEL)
+
+newrelic_sink = NewRelicSink()
+_logger.add(newrelic_sink, level="ERROR", backtrace=True, diagnose=True)
+
+
+def close_log_sinks() -> None:
+    if stdout_sink is not None:
+        stdout_sink.close()
+    newrelic_sink.close()
+
+
+def log_stats() -> dict:
+    stats = {f"sampled_out_{event}": count for event, count in _sampled_out.items()}
+    if stdout_sink is not None:
+        stats.update({f"stdout_{key}": value for key, value in stdout_sink.stats().items()})
+    return stats
 
-_logger.add(NewRelicSink(), level="ERROR", backtrace=True, diagnose=True)
 
 class DepthLogger:
-    """Wrapper to enforce logger.opt(depth=1) automatically."""
+    """
+    Wrapper around the loguru logger that reports the caller's location
+    (opt(depth=1) skips this wrapper's frame).
+
+    The opt-wrapped logger is built once per instance, not on every call, and
+    bind() returns another DepthLogger. Tracebacks are only attached to
+    error/critical records logged while an exception is being handled.
+    Pass format arguments instead of f-strings on hot paths, so nothing is
+    formatted when no sink accepts the level:
+        log.info("Received msg: {}", clip(data))
+    """
+
+    __slots__ = ("_base", "_log", "_exc")
+
+    def __init__(self, base=_logger):
+        self._base = base
+        self._log = base.opt(depth=1)
+        self._exc = None
+
+    def bind(self, **kwargs) -> "DepthLogger":
+        return DepthLogger(self._base.bind(**kwargs))
+
+    def _with_exception(self):
+        if sys.exc_info()[0] is None:
+            return self._log
+        if self._exc is None:
+            self._exc = self._base.opt(depth=1, exception=True)
+        return self._exc
+
+    def debug(self, message, *args, **kwargs):
+        self._log.debug(message, *args, **kwargs)
+
+    def info(self, message, *args, **kwargs):
+        self._log.info(message, *args, **kwargs)
+
+    def success(self, message, *args, **kwargs):
+        self._log.success(message, *args, **kwargs)
+
+    def warning(self, message, *args, **kwargs):
+        self._log.warning(message, *args, **kwargs)
+
+    def error(self, message, *args, **kwargs):
+        self._with_exception().error(message, *args, **kwargs)
+
+    def critical(self, message, *args, **kwargs):
+        self._with_exception().critical(message, *args, **kwargs)
+
+    def exception(self, message, *args, **kwargs):
+        self._with_exception().error(message, *args, **kwargs)
 
     def __getattr__(self, name):
-        return getattr(_logger.opt(depth=1, exception=True), name)
-    
+        return getattr(self._log, name)
+
+
 logger = DepthLogger()
\ No newline at end of file
@@ -1,7 +1,47 @@
 import redis.asyncio as redis
+from redis.asyncio.cluster import RedisCluster
 from app.core.config import settings
 
-redis_client = redis.from_url(
-    settings.REDIS_URL,
-    decode_responses = True
-)
\ No newline at end of file
+
+def hash_tag(value: str) -> str:
+    """
+    Wrap value in {} so every key built with it hashes to the same cluster
+    slot. Scripts and MULTI blocks may only touch keys of one slot, so all
+    keys of a session are tagged with its session id (and a company's KB keys
+    with its company id).
+    """
+    return f"{{{value}}}"
+
+
+def _connect(decode_responses: bool):
+    if settings.REDIS_CLUSTER:
+        # REDIS_URL names any node; the rest are discovered. The pool is per node
+        # and raises once exhausted (0 = effectively unbounded, like from_url)
+        return RedisCluster.from_url(
+            settings.REDIS_URL,
+            decode_responses = decode_responses,
+            max_connections = settings.REDIS_MAX_CONNECTIONS or 2 ** 31,
+        )
+    if settings.REDIS_MAX_CONNECTIONS:
+        # Bursts past the cap wait up to REDIS_POOL_TIMEOUT for a free connection instead of failing
+        return redis.Redis(connection_pool=redis.BlockingConnectionPool.from_url(
+            settings.REDIS_URL,
+            decode_responses = decode_responses,
+            max_connections = settings.REDIS_MAX_CONNECTIONS,
+            timeout = settings.REDIS_POOL_TIMEOUT,
+        ))
+    return redis.from_url(
+        settings.REDIS_URL,
+        decode_responses = decode_responses
+    )
+
+
+redis_client = _connect(decode_responses=True)
+
+# Same server, raw bytes in and out (for msgpack-encoded values)
+redis_binary_client = _connect(decode_responses=False)
+
+# KB invalidations. A cluster broadcasts PUBLISH to every node, so a plain connection
+# to the REDIS_URL node serves publishers and subscribers alike (the asyncio
+# RedisCluster of redis-py 6.x has neither publish nor pubsub)
+redis_pubsub_client = redis.from_url(settings.REDIS_URL, decode_responses=True) if settings.REDIS_CLUSTER else redis_client
@@ -22,6 +22,7 @@ class Conversation(BaseModel):
     company_id: Optional[str] = None
     phone_number: Optional[str] = Field(None, description="Normalized phone number (E.164)")
     messages: List[MessageItem] = Field(..., description="Ordered list of messages in the conversation")
+    message_count: Optional[int] = Field(None, description="len(messages), so listings can skip the bodies")
     start_time: datetime = Field(..., description="Session start time (UTC)")
     end_time: datetime = Field(..., description="Session end time (UTC)")
     created_at: datetime = Field(default_factory=datetime.utcnow, description="Record insertion time (UTC)")
\ No newline at end of file
@@ -1,7 +1,24 @@
 from pydantic import BaseModel, Field, EmailStr, field_validator
+from functools import lru_cache
 import phonenumbers
 from typing import Optional
 
+
+@lru_cache(maxsize=65536)
+def normalize_phone_number(v: str) -> str:
+    """
+    Validate and normalize phone numbers to E.164 (e.g., +919876543210).
+    Memoized: phonenumbers parsing is the expensive part of connection setup.
+    Raises ValueError if invalid.
+    """
+    try:
+        parsed = phonenumbers.parse(v, "IN")
+        if not phonenumbers.is_valid_number(parsed):
+            raise ValueError("Invalid phone number")
+        return phonenumbers.format_number(parsed, phonenumbers.PhoneNumberFormat.E164)
+    except Exception:
+        raise ValueError("Invalid phone number format")
+
 class Customer(BaseModel):
     id: str = Field(..., alias="_id")
     phone_number: str
@@ -15,10 +32,4 @@ class Customer(BaseModel):
         Validate and normalize phone numbers to E.164 (e.g., +919876543210).
         Raises ValueError if invalid.
         """
-        try:
-            parsed = phonenumbers.parse(v, "IN")
-            if not phonenumbers.is_valid_number(parsed):
-                raise ValueError("Invalid phone number")
-            return phonenumbers.format_number(parsed, phonenumbers.PhoneNumberFormat.E164)
-        except Exception:
-            raise ValueError("Invalid phone number format")
\ No newline at end of file
+        return normalize_phone_number(v)
\ No newline at end of file
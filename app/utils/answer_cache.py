@@ -0,0 +1,227 @@
+"""
+Per-company answer cache for FAQ-style questions.
+
+Replies are keyed by company, KB version and the normalized question, stored
+in Redis with a TTL and fronted by a small in-process LRU. Because the KB
+version is part of the key, re-uploading a KB makes old answers unreachable
+immediately (they then age out of Redis).
+
+Optionally, questions that are near-duplicates of one this worker has already
+answered (MinHash over character 3-grams, banded LSH) are served the same reply,
+but only when both carry exactly the same numbers and identifiers (order and
+ticket numbers, emails): "order 4481923" is never served the answer for
+"order 4481924".
+
+Only use it for turns that don't depend on earlier context: the first turn of
+a session, or a question that stands alone (see is_standalone).
+"""
+
+import hashlib
+import re
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.newrelic_logger import logger
+from app.core.redis_client import redis_client
+
+_PUNCT_RE = re.compile(r"[^\w\s]", re.UNICODE)
+# Emails, and any token with a digit in it (order/ticket ids, amounts, dates)
+_IDENTIFIER_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+|[\w-]*\d[\w-]*", re.UNICODE)
+_SPACE_RE = re.compile(r"\s+")
+
+# Words that usually point back at earlier turns ("what about that one?")
+_CONTEXT_WORDS = {
+    "it", "its", "that", "this", "those", "these", "they", "them", "their",
+    "he", "she", "him", "her", "there", "same", "above", "previous", "earlier",
+}
+_FOLLOW_UP_PREFIXES = ("and ", "also ", "what about ", "how about ", "then ", "so ")
+
+
+def normalize_query(query: str) -> str:
+    return _SPACE_RE.sub(" ", _PUNCT_RE.sub(" ", query.lower())).strip()
+
+
+def identifiers(query: str) -> Tuple[str, ...]:
+    """The question's numbers and identifiers, which a near-duplicate must match exactly."""
+    return tuple(sorted(m.lower() for m in _IDENTIFIER_RE.findall(query)))
+
+
+def is_standalone(query: str) -> bool:
+    normalized = normalize_query(query)
+    if not normalized or normalized.startswith(_FOLLOW_UP_PREFIXES):
+        return False
+    return not any(word in _CONTEXT_WORDS for word in normalized.split())
+
+
+class MinHashIndex:
+    """
+    Banded MinHash LSH over character 3-grams of normalized questions. Each
+    question is stored with a tag; a query only matches questions with an equal tag.
+    """
+
+    PRIME = (1 << 61) - 1
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, threshold: float = 0.8, max_entries: int = 10000, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, self.PRIME, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, self.PRIME, size=num_perm, dtype=np.uint64)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._signatures: Dict[str, np.ndarray] = {}
+        self._tags: Dict[str, Hashable] = {}
+        self._buckets: Dict[Tuple[int, bytes], set] = {}
+
+    def signature(self, text: str) -> np.ndarray:
+        shingles = {text[i:i + 3] for i in range(max(len(text) - 2, 1))}
+        hashes = np.array([zlib.crc32(s.encode("utf-8")) for s in shingles], dtype=np.uint64)
+        # (a*x + b) mod p for every permutation/shingle pair; uint64 wraparound is fine for hashing
+        return ((np.outer(hashes, self.a) + self.b) % self.PRIME).min(axis=0)
+
+    def _band_keys(self, sig: np.ndarray):
+        for band in range(self.bands):
+            yield band, sig[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def add(self, key: str, text: str, tag: Hashable = None) -> None:
+        if len(self._signatures) >= self.max_entries:
+            self._signatures.clear()
+            self._tags.clear()
+            self._buckets.clear()
+        sig = self.signature(text)
+        self._signatures[key] = sig
+        self._tags[key] = tag
+        for band_key in self._band_keys(sig):
+            self._buckets.setdefault(band_key, set()).add(key)
+
+    def query(self, text: str, tag: Hashable = None) -> Optional[str]:
+        """Return the key of the most similar stored question above threshold, with the same tag."""
+        sig = self.signature(text)
+        candidates = set()
+        for band_key in self._band_keys(sig):
+            candidates |= self._buckets.get(band_key, set())
+        best, best_sim = None, self.threshold
+        for key in candidates:
+            if self._tags[key] != tag:
+                continue
+            sim = float(np.mean(self._signatures[key] == sig))
+            if sim >= best_sim:
+                best, best_sim = key, sim
+        return best
+
+
+class AnswerCache:
+    PREFIX = "answer:"
+
+    def __init__(
+            self,
+            ttl_seconds: int = settings.ANSWER_CACHE_TTL,
+            local_size: int = settings.ANSWER_CACHE_LOCAL_SIZE,
+            near_duplicates: bool = settings.ANSWER_CACHE_NEAR_DUP,
+            near_threshold: float = settings.ANSWER_CACHE_NEAR_THRESHOLD,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.local_size = local_size
+        self.near_duplicates = near_duplicates
+        self.near_threshold = near_threshold
+        self._local: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._near: Dict[Tuple[str, int], MinHashIndex] = {}
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        # Moving average of generation time, used to estimate latency saved per hit
+        self._avg_generation = 0.0
+
+    def _key(self, company_id: str, kb_version: int, normalized: str) -> str:
+        digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+        return f"{self.PREFIX}{company_id}:{kb_version}:{digest}"
+
+    def _local_get(self, key: str) -> Optional[str]:
+        item = self._local.get(key)
+        if item is None:
+            return None
+        reply, expires_at = item
+        if expires_at < time.monotonic():
+            del self._local[key]
+            return None
+        self._local.move_to_end(key)
+        return reply
+
+    def _local_put(self, key: str, reply: str) -> None:
+        self._local[key] = (reply, time.monotonic() + self.ttl_seconds)
+        self._local.move_to_end(key)
+        while len(self._local) > self.local_size:
+            self._local.popitem(last=False)
+
+    async def _lookup(self, key: str) -> Optional[str]:
+        reply = self._local_get(key)
+        if reply is None:
+            reply = await redis_client.get(key)
+            if reply is not None:
+                self._local_put(key, reply)
+        return reply
+
+    async def get(self, company_id: str, kb_version: int, query: str) -> Optional[str]:
+        normalized = normalize_query(query)
+        if not normalized:
+            return None
+
+        reply = await self._lookup(self._key(company_id, kb_version, normalized))
+        if reply is None and self.near_duplicates:
+            index = self._near.get((company_id, kb_version))
+            similar_key = index.query(normalized, identifiers(query)) if index else None
+            if similar_key:
+                reply = await self._lookup(similar_key)
+                if reply is not None:
+                    self.near_hits += 1
+
+        if reply is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.saved_seconds += self._avg_generation
+        logger.bind(company_id=company_id).info("Answer cache hit")
+        return reply
+
+    async def put(self, company_id: str, kb_version: int, query: str, reply: str, generation_seconds: float = 0.0) -> None:
+        normalized = normalize_query(query)
+        if not normalized:
+            return
+        if generation_seconds:
+            self._avg_generation += 0.1 * (generation_seconds - self._avg_generation) if self._avg_generation else generation_seconds
+
+        key = self._key(company_id, kb_version, normalized)
+        await redis_client.set(key, reply, ex=self.ttl_seconds)
+        self._local_put(key, reply)
+        if self.near_duplicates:
+            index = self._near.get((company_id, kb_version))
+            if index is None:
+                index = self._near[(company_id, kb_version)] = MinHashIndex(threshold=self.near_threshold)
+            index.add(key, normalized, identifiers(query))
+
+    def invalidate(self, company_id: str) -> None:
+        """Drop in-process entries for a company (Redis entries are orphaned by the version bump)."""
+        prefix = f"{self.PREFIX}{company_id}:"
+        for key in [k for k in self._local if k.startswith(prefix)]:
+            del self._local[key]
+        for near_key in [k for k in self._near if k[0] == company_id]:
+            del self._near[near_key]
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "latency_saved_seconds": round(self.saved_seconds, 3),
+        }
+
+
+answer_cache = AnswerCache()
@@ -1,11 +1,186 @@
+import asyncio
+import time
+import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
-from app.core.redis_client import redis_client
+from typing import Dict, List, Tuple
+from app.core.redis_client import hash_tag, redis_client, redis_pubsub_client
 from app.core.newrelic_logger import logger
+from app.utils.kb_retriever import kb_retriever
+from app.utils.answer_cache import answer_cache
+from app.utils.prompt_assembler import CompiledPrefix, prompt_assembler
+
+# Make an upload live: swap the staging list in (or drop the live list for an
+# empty upload) and bump the version, atomically. All keys share the company's
+# hash tag, so this also runs on Redis Cluster (redis-py refuses RENAME in a
+# cluster pipeline, so a MULTI block can't do it there).
+# KEYS[1] staging list, KEYS[2] live list, KEYS[3] version; ARGV[1] "1" if the upload has entries
+COMMIT_SCRIPT = """
+if ARGV[1] == '1' then
+    redis.call('RENAME', KEYS[1], KEYS[2])
+    redis.call('PERSIST', KEYS[2])
+else
+    redis.call('DEL', KEYS[2])
+end
+return redis.call('INCR', KEYS[3])
+"""
+
+# Release a company's commit lock if we still hold it (it may have expired and been taken)
+# KEYS[1] lock; ARGV[1] holder
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+# Index builds in flight in this worker, by (company, version): concurrent cold
+# lookups (and warm-up's preload) wait for one build instead of each running it
+_index_builds: Dict[Tuple[str, int], asyncio.Future] = {}
+
+class KBIngest:
+    """
+    One KB upload in progress. Batches are appended to a private staging list
+    in Redis (one pipelined round trip per batch) and to chunk documents in
+    MongoDB; nothing is visible to readers until commit() swaps the staging
+    list in with RENAME and bumps the version in the same script.
+    Abandoned uploads expire (STAGING_TTL) or are removed by abort().
+
+    Commits of one company run one at a time (a Redis lock, across workers),
+    so MongoDB and Redis always end up pointing at the same upload.
+
+    Once MongoDB points at the upload it is `committed`: abort() leaves it
+    alone, and the replaced upload's chunks are removed only after the new
+    version is live and announced, on a best-effort basis.
+    """
+
+    STAGING_TTL = 3600
+    COMMIT_LOCK_TTL = 60     # seconds; the lock of a committer that died expires
+    COMMIT_LOCK_WAIT = 30    # seconds to wait for another upload's commit
+
+    def __init__(self, manager: "CompanyKBManager", company_id: str):
+        self.manager = manager
+        self.company_id = company_id
+        self.upload_id = uuid.uuid4().hex
+        # Same hash tag as the live key, so the RENAME in commit() stays within one cluster slot
+        self.staging_key = f"{manager.redis_key(company_id)}:upload:{self.upload_id}"
+        self.count = 0
+        self.batches = 0
+        self.committed = False
+
+    async def add(self, entries: List[str]) -> None:
+        if not entries:
+            return
+        seq = self.batches
+        self.batches += 1
+
+        async def write_redis():
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.rpush(self.staging_key, *entries)
+                pipe.expire(self.staging_key, self.STAGING_TTL)
+                await pipe.execute()
+
+        await asyncio.gather(
+            write_redis(),
+            self.manager.chunks.insert_one({
+                "_id": f"{self.upload_id}:{seq}",
+                "company_id": self.company_id,
+                "upload_id": self.upload_id,
+                "seq": seq,
+                "entries": entries,
+            }),
+        )
+        self.count += len(entries)
+
+    @asynccontextmanager
+    async def _commit_lock(self):
+        key = self.manager.commit_lock_key(self.company_id)
+        deadline = time.monotonic() + self.COMMIT_LOCK_WAIT
+        delay = 0.01
+        while not await redis_client.set(key, self.upload_id, nx=True, px=self.COMMIT_LOCK_TTL * 1000):
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Another KB upload for {self.company_id} is still committing")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+        try:
+            yield
+        finally:
+            await redis_client.register_script(RELEASE_LOCK_SCRIPT)(keys=[key], args=[self.upload_id])
+
+    async def commit(self) -> int:
+        """Make this upload the live KB. Returns the new version."""
+        async with self._commit_lock():
+            return await self._commit()
+
+    async def _commit(self) -> int:
+        log = logger.bind(company_id=self.company_id)
+        now = datetime.now(timezone.utc)
+
+        # MongoDB is the source of truth: point it at the new chunks first
+        previous = await self.manager.collection.find_one_and_update(
+            {"_id": self.company_id},
+            {
+                "$set": {"upload_id": self.upload_id, "entry_count": self.count, "updated_at": now},
+                "$unset": {"kb_text": ""},
+            },
+            projection = {"upload_id": 1},
+            upsert = True
+        )
+        # From here on the chunks are referenced; nothing below may delete them
+        self.committed = True
+        log.info("Company KB uploaded succesfully")
+
+        # Swap the Redis list and bump the version atomically
+        version = await redis_client.register_script(COMMIT_SCRIPT)(
+            keys=[self.staging_key, self.manager.redis_key(self.company_id), self.manager.version_key(self.company_id)],
+            args=["1" if self.count else "0"],
+        )
+        log.info(f"Company KB v{version} live in Redis ({self.count} entries)")
+
+        # Tell every worker to drop its cached copy (one that misses it catches up on its next version check)
+        try:
+            await redis_pubsub_client.publish(self.manager.INVALIDATION_CHANNEL, f"{version}:{self.company_id}")
+        except Exception as e:
+            log.warning(f"Failed to publish KB v{version} invalidation: {e}")
+
+        # Cleanup: only the replaced upload's chunks (a concurrent upload may still be writing its own)
+        if previous and previous.get("upload_id"):
+            try:
+                await self.manager.chunks.delete_many({"upload_id": previous["upload_id"]})
+            except Exception as e:
+                log.warning(f"Failed to delete the replaced KB upload's chunks: {e}")
+        return version
+
+    async def abort(self) -> None:
+        log = logger.bind(company_id=self.company_id)
+        if self.committed:
+            # MongoDB already serves this upload; its chunks must stay
+            log.warning(f"Not aborting KB upload {self.upload_id}: already committed")
+            return
+        await redis_client.delete(self.staging_key)
+        await self.manager.chunks.delete_many({"upload_id": self.upload_id})
+        log.warning(f"Aborted KB upload after {self.count} entries")
+
 
 class CompanyKBManager:
     """Manage Company wide KB stored in MongoDB and optionally Redis for session use"""
     COLLECTION = "company_kb"
+    CHUNK_COLLECTION = "company_kb_chunks"
     REDIS_PREFIX = "kb:company:"
+    VERSION_PREFIX = "kb:version:"
+    COMMIT_LOCK_PREFIX = "kb:commit_lock:"
+    INVALIDATION_CHANNEL = "kb:invalidate"
+    INGEST_BATCH = 5000
+
+    @classmethod
+    def redis_key(cls, company_id: str) -> str:
+        return f"{cls.REDIS_PREFIX}{hash_tag(company_id)}"
+
+    @classmethod
+    def version_key(cls, company_id: str) -> str:
+        return f"{cls.VERSION_PREFIX}{hash_tag(company_id)}"
+
+    @classmethod
+    def commit_lock_key(cls, company_id: str) -> str:
+        return f"{cls.COMMIT_LOCK_PREFIX}{hash_tag(company_id)}"
 
     @property
     def collection(self):
@@ -14,41 +189,146 @@ class CompanyKBManager:
             raise RuntimeError("MongoDB collection not initialized yet")
         return db[self.COLLECTION]
 
-    async def upload_kb(self, company_id: str, kb_entries: str) -> None:
-        """Save or update company KB in mongoDB"""
-        now = datetime.now(timezone.utc)
-        kb_text = "\n".join(kb_entries)
+    @property
+    def chunks(self):
+        from app.core.mongodb_client import db
+        if db is None:
+            raise RuntimeError("MongoDB collection not initialized yet")
+        return db[self.CHUNK_COLLECTION]
 
-        await self.collection.update_one(
-            {"_id": company_id},
-            {"$set": {"kb_text": kb_text, "updated_at": now}},
-            upsert = True
-        )
-        logger.bind(company_id=company_id).info("Company KB uploaded succesfully")
+    def start_ingest(self, company_id: str) -> KBIngest:
+        return KBIngest(self, company_id)
 
-        # Redis cache
-        redis_key = f"{self.REDIS_PREFIX}{company_id}"
-        await redis_client.delete(redis_key)
-        if kb_entries:
-            await redis_client.rpush(redis_key, *kb_entries)
-        logger.bind(company_id=company_id).info("Company KB uploaded to Redis for session use.")
+    async def upload_kb(self, company_id: str, kb_entries: List[str] | str) -> None:
+        """Replace the company KB (MongoDB + Redis) and build this worker's index for it."""
+        if isinstance(kb_entries, str):
+            kb_entries = [line.strip() for line in kb_entries.split("\n") if line.strip()]
 
-    async def get_kb(self, company_id: str) -> str|None:
-        """Fetch KB text for a company from MongoDB
+        ingest = self.start_ingest(company_id)
+        try:
+            for start in range(0, len(kb_entries), self.INGEST_BATCH):
+                await ingest.add(kb_entries[start:start + self.INGEST_BATCH])
+            version = await ingest.commit()
+        except Exception:
+            await ingest.abort()
+            raise
+
+        await asyncio.to_thread(kb_retriever.build, company_id, kb_entries, version)
+
+    async def get_version(self, company_id: str) -> int:
+        version = await redis_client.get(self.version_key(company_id))
+        return int(version) if version else 0
+
+    async def get_kb_entries(self, company_id: str) -> List[str]:
+        """Fetch KB entries for a company.
         Priority: Redis cache -> MongoDB fallback"""
 
-        redis_key = f"{self.REDIS_PREFIX}{company_id}"
+        redis_key = self.redis_key(company_id)
         entries = await redis_client.lrange(redis_key, 0, -1)
         if entries:
-            kb_text = "\n".join([e.decode("utf-8") if isinstance(e, bytes) else e for e in entries])
             logger.bind(company_id=company_id).info("Fetched company KB from Redis")
-            return kb_text
-        
+            return [e.decode("utf-8") if isinstance(e, bytes) else e for e in entries]
+
         # Fallback to MongoDB
         doc = await self.collection.find_one({"_id": company_id})
-        if doc:
-            kb_text = doc.get("kb_text")
+        if doc and doc.get("upload_id"):
+            entries = []
+            cursor = self.chunks.find({"company_id": company_id, "upload_id": doc["upload_id"]}).sort("seq", 1)
+            async for chunk in cursor:
+                entries.extend(chunk["entries"])
+            logger.bind(company_id=company_id).info("Fetched company KB")
+            return entries
+        if doc and doc.get("kb_text"):
+            # Written before chunked uploads
             logger.bind(company_id=company_id).info("Fetched company KB")
-            return kb_text
-        
-        return None
\ No newline at end of file
+            return [line for line in doc["kb_text"].split("\n") if line.strip()]
+
+        return []
+
+    async def get_kb(self, company_id: str) -> str|None:
+        """Fetch KB text for a company
+        Priority: in-process cache -> Redis -> MongoDB fallback"""
+
+        await self.load_index(company_id)
+        index = kb_retriever.peek(company_id)
+        if index is not None and len(index):
+            return "\n".join(index.entries)
+        return None
+
+    async def load_index(self, company_id: str, counted: bool = True) -> int:
+        """
+        Make sure this worker has a retrieval index for the current KB version.
+        Costs one small GET when cached; the KB itself is only read on a miss,
+        and concurrent misses for the same version share one build.
+        Pass counted=False when the caller already counted its cache lookup.
+        Returns the entry count.
+        """
+        version = await self.get_version(company_id)
+        index = (kb_retriever.get if counted else kb_retriever.peek)(company_id, version)
+        if index is None:
+            index = await self._build_index(company_id, version)
+        return len(index)
+
+    async def _build_index(self, company_id: str, version: int):
+        key = (company_id, version)
+        build = _index_builds.get(key)
+        if build is None:
+            async def run():
+                entries = await self.get_kb_entries(company_id)
+                return await asyncio.to_thread(kb_retriever.build, company_id, entries, version)
+
+            build = _index_builds[key] = asyncio.ensure_future(run())
+            build.add_done_callback(lambda _: _index_builds.pop(key, None))
+        # A waiter that is cancelled (disconnect) leaves the build running for the others
+        return await asyncio.shield(build)
+
+    def current_version(self, company_id: str) -> int:
+        """KB version of this worker's loaded index (0 if none is loaded)."""
+        index = kb_retriever.peek(company_id)
+        return index.version if index is not None else 0
+
+    async def get_relevant_kb(self, company_id: str, query: str) -> List[str]:
+        """Return the KB entries most relevant to `query`, within the configured token budget."""
+        if kb_retriever.peek(company_id) is None:
+            # Dropped by an invalidation (or expired) mid-session
+            await self.load_index(company_id, counted=False)
+        return kb_retriever.search(company_id, query)
+
+    def is_loaded(self, company_id: str) -> bool:
+        """Whether this worker holds the company's KB index. This is the turn's
+        counted KB cache lookup; the rest of the turn peeks."""
+        return kb_retriever.get(company_id) is not None
+
+    async def prompt_prefix(self, company_id: str) -> CompiledPrefix:
+        """Precompiled prompt prefix for the company's current KB version
+        (loaded first if this worker does not hold it)."""
+        if kb_retriever.peek(company_id) is None:
+            await self.load_index(company_id)
+        return prompt_assembler.prefix(company_id)
+
+    async def listen_for_invalidations(self) -> None:
+        """Drop cached KBs when any process uploads a new version. Runs for the app lifetime."""
+        while True:
+            try:
+                await self._listen()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Messages missed while disconnected are covered by the version check in load_index
+                logger.warning(f"KB invalidation listener disconnected: {e}, resubscribing")
+                await asyncio.sleep(1)
+
+    async def _listen(self) -> None:
+        pubsub = redis_pubsub_client.pubsub()
+        await pubsub.subscribe(self.INVALIDATION_CHANNEL)
+        try:
+            async for msg in pubsub.listen():
+                if msg.get("type") != "message":
+                    continue
+                data = msg["data"].decode("utf-8") if isinstance(msg["data"], bytes) else msg["data"]
+                version, _, company_id = data.partition(":")
+                answer_cache.invalidate(company_id)
+                if kb_retriever.drop(company_id, int(version)):
+                    logger.bind(company_id=company_id).info(f"Dropped cached KB older than v{version}")
+        finally:
+            await pubsub.aclose()
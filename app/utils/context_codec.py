@@ -0,0 +1,78 @@
+"""
+Encoding of chat messages stored in the Redis context lists.
+
+v1 (legacy): a JSON string whose content is itself a JSON object with an ISO
+timestamp, i.e. '"{\\"role\\": \\"user\\", \\"message\\": ..., \\"timestamp\\": \\"2025-...\\"}"'.
+v2: a version byte followed by a msgpack map with one-letter keys, the role as
+a small int and the timestamp as epoch milliseconds:
+    b"\\x02" + msgpack({"r": 0, "m": "...", "t": 1735689600000})
+
+decode() reads both, so workers on different versions can share Redis during a
+rolling deploy. Set CONTEXT_ENCODING=json to keep writing v1 until every worker
+runs a reader that understands v2, then switch to msgpack.
+
+Decoded messages are dicts {"role", "message", "timestamp"}; the timestamp is
+epoch ms for v2 and an ISO string for v1, use message_time() to read it.
+"""
+
+import json
+import time
+from datetime import datetime, timezone
+from typing import Dict, Union
+
+import msgpack
+
+V2 = b"\x02"
+
+ROLE_CODES = {"user": 0, "bot": 1, "system": 2}
+ROLE_NAMES = {code: role for role, code in ROLE_CODES.items()}
+
+_packb = msgpack.Packer(use_bin_type=True).pack
+
+
+def new_message(role: str, message: str) -> Dict:
+    return {"role": role, "message": message, "timestamp": int(time.time() * 1000)}
+
+
+def encode(item: Dict, fmt: str = "msgpack") -> bytes:
+    """Encode a message dict from new_message()."""
+    if fmt == "json":
+        ts = message_time(item).isoformat()
+        payload = json.dumps({"role": item["role"], "message": item["message"], "timestamp": ts})
+        return json.dumps(payload).encode("utf-8")
+    role = item["role"]
+    return V2 + _packb({"r": ROLE_CODES.get(role, role), "m": item["message"], "t": item["timestamp"]})
+
+
+def decode(raw: Union[bytes, str]) -> Dict:
+    """Decode a stored message in any known format. Raises ValueError if unreadable."""
+    if isinstance(raw, str):
+        raw = raw.encode("utf-8")
+    if raw[:1] == V2:
+        try:
+            d = msgpack.unpackb(raw[1:], raw=False)
+            role = d["r"]
+            return {"role": ROLE_NAMES.get(role, role), "message": d["m"], "timestamp": d["t"]}
+        except Exception as e:
+            raise ValueError(f"Malformed v2 context message: {e}") from e
+
+    item = json.loads(raw)
+    # v1 is double-encoded; tolerate single-encoded JSON objects too
+    if isinstance(item, str):
+        item = json.loads(item)
+    if not isinstance(item, dict):
+        raise ValueError("Malformed v1 context message")
+    return item
+
+
+def message_time(item: Dict) -> datetime:
+    """Timestamp of a decoded message as an aware datetime (now if missing or invalid)."""
+    ts = item.get("timestamp")
+    try:
+        if isinstance(ts, (int, float)):
+            return datetime.fromtimestamp(ts / 1000, tz=timezone.utc)
+        if ts:
+            return datetime.fromisoformat(ts)
+    except Exception:
+        pass
+    return datetime.now(timezone.utc)
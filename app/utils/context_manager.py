@@ -1,9 +1,36 @@
-import json
-from typing import Dict, List
+import asyncio
+from typing import Dict, List, Optional
 #from loguru import logger
-from datetime import datetime, timezone
+from app.core.config import settings
 from app.core.newrelic_logger import logger
-from app.core.redis_client import redis_client
+from app.core.redis_client import hash_tag, redis_binary_client, redis_client
+from app.utils import context_codec
+from app.utils.company_kb_manager import CompanyKBManager
+from app.utils.session_manager import SessionLeaseLost, SessionManager
+
+# Append messages, refresh context + session TTLs and optionally read the history back,
+# all in one round trip. Returns {session_alive, context_length[, history]}.
+# With a lease key, nothing is written unless ARGV[3] still owns it ({-1, 0}).
+# KEYS[1] context key, KEYS[2] session key, KEYS[3] optional lease key
+# ARGV[1] ttl, ARGV[2] "1" to return the history, ARGV[3] lease owner, ARGV[4..] encoded messages
+COMMIT_TURN_SCRIPT = """
+if KEYS[3] and redis.call('GET', KEYS[3]) ~= ARGV[3] then
+    return {-1, 0}
+end
+local n = #ARGV
+local length
+if n > 3 then
+    length = redis.call('RPUSH', KEYS[1], unpack(ARGV, 4, n))
+else
+    length = redis.call('LLEN', KEYS[1])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+local alive = redis.call('EXPIRE', KEYS[2], ARGV[1])
+if ARGV[2] == '1' then
+    return {alive, length, redis.call('LRANGE', KEYS[1], 0, -1)}
+end
+return {alive, length}
+"""
 
 class ContextManager:
     """Manages conversation context (chat history) for each session."""
@@ -12,28 +39,77 @@ class ContextManager:
     KB_PREFIX = "kb:"   
     EXPIRY_SECONDS = 300
 
+    def __init__(self):
+        # Context values are msgpack (see context_codec), so they go through the bytes client
+        self._commit_turn = redis_binary_client.register_script(COMMIT_TURN_SCRIPT)
+        # Turns refresh the session's TTL too; it must not drop below what the lease renewal set
+        self.turn_ttl = SessionManager.key_ttl(settings.SESSION_LEASE_SECONDS + settings.SESSION_RESUME_GRACE)
+
+    @staticmethod
+    def _encode(item: Dict) -> bytes:
+        return context_codec.encode(item, settings.CONTEXT_ENCODING)
+
+    def _decode(self, session_id: str, msgs: list) -> List[Dict]:
+        history = []
+        for m in msgs:
+            try:
+                history.append(context_codec.decode(m))
+            except Exception:
+                logger.bind(session_id=session_id).warning("Malformed message in context, skipping")
+        return history
+
     async def add_message(self, session_id: str, role: str, message: str) -> None:
         """
         Add a message to the session context.
         Role can be 'user' or 'bot'.
         """
 
-        key = f"{self.CONTEXT_PREFIX}{session_id}"
-        msg_payload = json.dumps({
-            "role": role, 
-            "message": message, 
-            "timestamp": datetime.now(timezone.utc).isoformat()
-        })
-
-        await redis_client.rpush(key, json.dumps(msg_payload))
-        await redis_client.expire(key, self.EXPIRY_SECONDS)
+        key = self.context_key(session_id)
+        async with redis_binary_client.pipeline(transaction=True) as pipe:
+            pipe.rpush(key, self._encode(context_codec.new_message(role, message)))
+            pipe.expire(key, self.EXPIRY_SECONDS)
+            await pipe.execute()
 
         log = logger.bind(session_id=session_id, role=role)
         log.info(f"Added message to context.")
+
+    async def commit_turn(self, session_id: str, item: Dict, owner: Optional[str] = None) -> int:
+        """
+        Append a message (built with context_codec.new_message) and refresh both
+        the context and session TTLs in one round trip (server-side Lua).
+        With an owner nothing is written unless it still holds the session
+        lease; otherwise SessionLeaseLost is raised.
+        Returns the context length after the append.
+        """
+
+        keys = [self.context_key(session_id), SessionManager.session_key(session_id)]
+        if owner:
+            keys.append(SessionManager.lease_key(session_id))
+        result = await self._commit_turn(
+            keys=keys,
+            args=[self.turn_ttl, "0", owner or "", self._encode(item)],
+        )
+
+        if result[0] == -1:
+            raise SessionLeaseLost(session_id)
+        if not result[0]:
+            logger.bind(session_id=session_id, role=item["role"]).warning("Committed turn for a non-existing session")
+        return int(result[1])
+
+    @classmethod
+    def context_key(cls, session_id: str) -> str:
+        return f"{cls.CONTEXT_PREFIX}{hash_tag(session_id)}"
+
+    @classmethod
+    def kb_key(cls, session_id: str) -> str:
+        return f"{cls.KB_PREFIX}{hash_tag(session_id)}"
+
+    def session_history(self, session_id: str, owner: Optional[str] = None) -> "SessionHistory":
+        return SessionHistory(self, session_id, owner)
     
     async def add_kb_entry(self, session_id: str, entry: str) -> None:
         """Add a KB snippet to the session"""
-        key = f"{self.KB_PREFIX}{session_id}"
+        key = self.kb_key(session_id)
         await redis_client.rpush(key, entry)
         await redis_client.expire(key, self.EXPIRY_SECONDS)
 
@@ -47,25 +123,18 @@ class ContextManager:
         If company ID is provided prepend compony KB to history
         """
 
-        key = f"{self.CONTEXT_PREFIX}{session_id}"
-        msgs = await redis_client.lrange(key, 0, -1)
-        history = []
-
-        for m in msgs:
-            if isinstance(m, bytes):
-                m = m.decode("utf-8")
-            try:
-                history.append(json.loads(m))
-            except Exception:
-                logger.bind(session_id=session_id).warning("Malformed message in context, skipping")
+        key = self.context_key(session_id)
+        msgs = await redis_binary_client.lrange(key, 0, -1)
+        history = self._decode(session_id, msgs)
 
         if company_id:
-            kb_key = f"{self.KB_PREFIX}:company:{company_id}"
+            kb_key = CompanyKBManager.redis_key(company_id)
             kb_entries = await redis_client.lrange(kb_key, 0, -1)
-            for kb in kb_entries:
-                if isinstance(kb, bytes):
-                    kb = kb.decode("utf-8")
-                history.insert(0, {"role": "system", "message": kb})
+            # One list build, in KB order (prepending one by one was O(n^2) and reversed it)
+            history = [
+                {"role": "system", "message": kb.decode("utf-8") if isinstance(kb, bytes) else kb}
+                for kb in kb_entries
+            ] + history
 
         """kb_key = f"{self.KB_PREFIX}{session_id}"
         kb_entries = await redis_client.lrange(kb_key, 0, -1)
@@ -84,10 +153,8 @@ class ContextManager:
         Returns True if deleted, False otherwise.
         """
 
-        keys = [f"{self.CONTEXT_PREFIX}{session_id}", f"{self.KB_PREFIX}{session_id}"]
-        result = 0
-        for key in keys:
-            result += await redis_client.delete(key)
+        keys = [self.context_key(session_id), self.kb_key(session_id)]
+        result = await redis_client.delete(*keys)
 
         log = logger.bind(session_id=session_id)
         if result:
@@ -95,4 +162,91 @@ class ContextManager:
         else:
             log.warning(f"Tried to clear non-existing history for session.")
         
-        return bool(result)
\ No newline at end of file
+        return bool(result)
+
+
+class SessionHistory:
+    """
+    Connection-local copy of one session's context.
+
+    Appends are written through to Redis (commit_turn script, one round trip)
+    and mirrored locally, so a turn never reads the history back. The script
+    returns the list length after the push; if it doesn't match the local copy
+    (another writer, expiry, a failed write) the history is reloaded once.
+    load() is also used when resuming an existing session.
+
+    stage() mirrors a message right away and writes it in the background, so
+    the caller can go on with the new history while the write is in flight.
+    Staged writes run one at a time in the order they were staged (a bot reply
+    is never written before the user message it answers); flush() waits for
+    them all.
+
+    With an owner, appends only go through while that owner holds the
+    session lease; otherwise SessionLeaseLost is raised.
+    """
+
+    def __init__(self, manager: ContextManager, session_id: str, owner: Optional[str] = None):
+        self.manager = manager
+        self.session_id = session_id
+        self.owner = owner
+        self.messages: List = []
+        self.reloads = 0
+        self.lease_lost = False
+        self._writing: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    async def load(self) -> List:
+        key = self.manager.context_key(self.session_id)
+        msgs = await redis_binary_client.lrange(key, 0, -1)
+        self.messages = self.manager._decode(self.session_id, msgs)
+        self.reloads += 1
+        return self.messages
+
+    def stage(self, role: str, message: str) -> asyncio.Task:
+        """
+        Append the message locally now and write it through after any earlier
+        staged writes. The returned task raises what append() would.
+        """
+        item = context_codec.new_message(role, message)
+        self.messages.append(item)
+        self._writing = asyncio.ensure_future(self._write(item, self._writing))
+        return self._writing
+
+    async def append(self, role: str, message: str) -> List:
+        """Write the message through to Redis and return the up-to-date history."""
+        await self.stage(role, message)
+        return self.messages
+
+    async def flush(self) -> None:
+        """Wait for staged writes; their errors are left to whoever awaits their tasks."""
+        if self._writing is not None:
+            await asyncio.gather(self._writing, return_exceptions=True)
+
+    def _position(self, item: Dict) -> int:
+        """Local list length up to and including item (0 if a reload dropped it); it is near the end."""
+        for i in range(len(self.messages) - 1, -1, -1):
+            if self.messages[i] is item:
+                return i + 1
+        return 0
+
+    async def _write(self, item: Dict, previous: Optional[asyncio.Task]) -> None:
+        if previous is not None:
+            # Only the order matters here; a failure surfaced through that write's own task
+            await asyncio.gather(previous, return_exceptions=True)
+        try:
+            length = await self.manager.commit_turn(self.session_id, item, self.owner)
+        except SessionLeaseLost:
+            self.lease_lost = True
+            raise
+
+        log = logger.bind(session_id=self.session_id, role=item["role"])
+        position = self._position(item)
+        if length != position:
+            log.warning(f"Context diverged (redis={length}, local={position}), reloading")
+            # Messages staged after this one (even during the reload) are not in Redis yet; keep them
+            staged = self.messages
+            await self.load()
+            if position:
+                self.messages.extend(staged[position:])
@@ -0,0 +1,222 @@
+"""
+Token-budgeted context window for a session.
+
+The newest messages are kept verbatim up to CONTEXT_TOKEN_BUDGET. When the
+window overflows, the oldest messages are folded into a rolling summary: the
+summarizer only sees the previous summary plus the newly folded messages, so
+the summary is updated incrementally rather than regenerated. The summary and
+the number of folded messages live in Redis next to the session context, so
+any worker can continue the session. On the chat path the fold runs in the
+background; turns keep using the previous summary until the new one lands.
+"""
+
+import asyncio
+import json
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Protocol
+
+from openai import RateLimitError
+
+from app.core.config import settings
+from app.core.metrics import timed
+from app.core.newrelic_logger import logger, sampled
+from app.core.redis_client import hash_tag, redis_client
+from app.utils.kb_retriever import estimate_tokens
+from app.utils.openai_limiter import openai_limiter
+
+
+def _parse(raw_item) -> dict:
+    return json.loads(raw_item) if isinstance(raw_item, str) else raw_item
+
+
+class Summarizer(Protocol):
+    backend: str  # metrics label for the summarize call
+
+    async def summarize(self, previous_summary: str, messages: List[dict]) -> str:
+        ...
+
+
+class TruncatingSummarizer:
+    """Local summarizer for tests/offline runs: appends the folded messages and keeps the tail."""
+
+    backend = "local"
+
+    def __init__(self, max_chars: int = 1000):
+        self.max_chars = max_chars
+
+    async def summarize(self, previous_summary: str, messages: List[dict]) -> str:
+        lines = [f"{m.get('role', 'user')}: {m.get('message', '')}" for m in messages]
+        summary = "\n".join(filter(None, [previous_summary, *lines]))
+        return summary[-self.max_chars:]
+
+
+class OpenAISummarizer:
+    """
+    Folds messages into the running summary with one short LLM call. The call
+    goes through the shared OpenAI limiter like every other one, and gives up
+    after CONTEXT_SUMMARY_TIMEOUT seconds, queueing included.
+    """
+
+    PROMPT = (
+        "You maintain a running summary of a customer support chat. "
+        "Update the summary with the new messages. Keep facts the customer gave "
+        "(names, order numbers, issues) and open questions. Reply with the summary only, "
+        "in under 150 words."
+    )
+    MAX_TOKENS = 250
+    backend = "openai"
+
+    def __init__(self, client=None, model: Optional[str] = None, limiter=openai_limiter, timeout: float = settings.CONTEXT_SUMMARY_TIMEOUT):
+        if client is None:
+            from app.utils.openai_client import client
+        self.client = client
+        self.model = model or settings.OPENAI_MODEL or "gpt-4.1-mini"
+        self.limiter = limiter
+        self.timeout = timeout
+
+    async def summarize(self, previous_summary: str, messages: List[dict]) -> str:
+        transcript = "\n".join(f"{m.get('role', 'user')}: {m.get('message', '')}" for m in messages)
+        prompt = [
+            {"role": "system", "content": self.PROMPT},
+            {"role": "user", "content": f"Current summary:\n{previous_summary or '(empty)'}\n\nNew messages:\n{transcript}"},
+        ]
+        return await asyncio.wait_for(self._complete(prompt), self.timeout)
+
+    async def _complete(self, prompt: List[dict]) -> str:
+        from app.utils.openai_client import OpenAIClient
+
+        est_tokens = sum(estimate_tokens(m["content"]) for m in prompt) + self.MAX_TOKENS
+        async with self.limiter.slot(est_tokens) as outcome:
+            try:
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=prompt,
+                    max_tokens=self.MAX_TOKENS,
+                    temperature=0.2,
+                )
+            except RateLimitError as e:
+                # Pauses every caller; this fold is skipped and retried on a later turn
+                outcome["rate_limited"] = True
+                outcome["retry_after"] = OpenAIClient._retry_after(e)
+                raise
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                outcome["used_tokens"] = usage.total_tokens
+        return response.choices[0].message.content.strip()
+
+
+@dataclass
+class ContextWindow:
+    messages: List = field(default_factory=list)
+    summary: Optional[str] = None
+    metrics: Dict[str, int] = field(default_factory=dict)
+
+
+class ContextPolicy:
+    SUMMARY_PREFIX = "context_summary:"
+    EXPIRY_SECONDS = 300
+
+    def __init__(
+            self,
+            budget_tokens: int = settings.CONTEXT_TOKEN_BUDGET,
+            summarizer: Optional[Summarizer] = None,
+            fold_target: float = 0.75,
+    ):
+        """
+        budget_tokens: max tokens of verbatim history sent with each call.
+        fold_target: when over budget, fold until the window is at this fraction
+        of the budget, so summarization runs every few turns rather than every turn.
+        """
+        self.budget_tokens = budget_tokens
+        self.fold_target = fold_target
+        if summarizer is None:
+            summarizer = OpenAISummarizer() if settings.CONTEXT_SUMMARIZER == "openai" else TruncatingSummarizer()
+        self.summarizer = summarizer
+        self._folding: set = set()  # sessions with a background fold in flight
+
+    @classmethod
+    def summary_key(cls, session_id: str) -> str:
+        return f"{cls.SUMMARY_PREFIX}{hash_tag(session_id)}"
+
+    async def apply(
+            self,
+            session_id: str,
+            history: List,
+            company: str = "unknown",
+            background: Optional[Callable[[Awaitable], None]] = None,
+    ) -> ContextWindow:
+        """
+        history: full session history as returned by ContextManager.get_history.
+        Returns the verbatim tail within budget plus the rolling summary.
+        background: schedules the fold off the caller's path (the chat loop passes
+        in_background); this turn then keeps the previous summary and only the
+        messages that fit the budget. Without it the fold is awaited here.
+        The summary read is timed as context_window (redis), a fold as
+        context_summary under the summarizer's backend.
+        """
+        key = self.summary_key(session_id)
+        with timed("context_window", "redis", company):
+            state = await redis_client.hgetall(key)
+        summary = state.get("summary", "")
+        folded = min(int(state.get("folded", 0)), len(history))
+
+        items = [_parse(m) for m in history]
+        costs = [estimate_tokens(i.get("message", "")) for i in items]
+        tokens_before = sum(costs)
+
+        tail_start = folded
+        tail_tokens = sum(costs[tail_start:])
+        if tail_tokens > self.budget_tokens:
+            target = self.budget_tokens * self.fold_target
+            new_start, fit_start, fit_tokens = tail_start, None, 0
+            # Always keep the newest message verbatim
+            while new_start < len(items) - 1 and tail_tokens > target:
+                tail_tokens -= costs[new_start]
+                new_start += 1
+                if fit_start is None and tail_tokens <= self.budget_tokens:
+                    fit_start, fit_tokens = new_start, tail_tokens
+
+            if background is not None:
+                if session_id not in self._folding:
+                    self._folding.add(session_id)
+                    background(self._fold(session_id, summary, items[tail_start:new_start], new_start, company))
+                # Until the fold lands, drop what does not fit
+                if fit_start is not None:
+                    tail_start, tail_tokens = fit_start, fit_tokens
+                else:
+                    tail_start = new_start
+            else:
+                try:
+                    with timed("context_summary", self.summarizer.backend, company):
+                        summary = await self._fold(session_id, summary, items[tail_start:new_start], new_start, company)
+                except Exception as e:
+                    # Keep the old summary; this turn just drops what does not fit
+                    logger.bind(session_id=session_id).warning(f"Context summarization failed: {e}")
+                tail_start = new_start
+
+        tokens_after = tail_tokens + (estimate_tokens(summary) if summary else 0)
+        metrics = {
+            "prompt_tokens_before": tokens_before,
+            "prompt_tokens_after": tokens_after,
+            "messages_verbatim": len(items) - tail_start,
+            "messages_folded": tail_start,
+        }
+        if sampled("context_window"):
+            logger.bind(session_id=session_id, **metrics).info("Applied context window")
+        return ContextWindow(messages=history[tail_start:], summary=summary or None, metrics=metrics)
+
+    async def _fold(self, session_id: str, summary: str, items: List[dict], new_start: int, company: str) -> str:
+        """Fold items into the summary and save it with the new fold position."""
+        try:
+            summary = await self.summarizer.summarize(summary, items)
+            with timed("context_summary_save", "redis", company):
+                key = self.summary_key(session_id)
+                await redis_client.hset(key, mapping={"summary": summary, "folded": new_start})
+                await redis_client.expire(key, self.EXPIRY_SECONDS)
+            logger.bind(session_id=session_id).info(f"Folded {len(items)} messages into context summary")
+            return summary
+        finally:
+            self._folding.discard(session_id)
+
+    async def clear(self, session_id: str) -> None:
+        await redis_client.delete(self.summary_key(session_id))
@@ -0,0 +1,329 @@
+"""
+Incremental rollups over conversation transcripts for the admin dashboard.
+
+ConversationAnalytics.run() reads the `conversations` collection in
+(created_at, conversation_id) order starting after a watermark persisted in
+`analytics_state`, a chunk at a time (metadata only, never message bodies),
+and folds each chunk into two rollup collections:
+
+    analytics_daily        one doc per company and day (UTC, by start_time):
+                           sessions, messages, turns, duration sum/max, a
+                           duration histogram and the peak concurrency
+    analytics_concurrency  one doc per company and day: sessions active in
+                           each minute of the day, used to derive the peak
+
+Per chunk the aggregation is vectorized (numpy/pandas group-bys over column
+arrays), so memory is bounded by ANALYTICS_CHUNK_SIZE regardless of history
+size. All rollup fields are additive, so chunks and runs just $inc into them;
+each update is guarded by the chunk's id, so replaying a chunk after a crash
+between the rollup writes and the watermark update does not count it twice.
+
+created_at is stamped when a session is finalized, but the write-behind
+writer may insert it a little later. Runs therefore stop ANALYTICS_LAG_SECONDS
+short of now, so documents still in flight are picked up by the next run.
+Concurrency docs are only needed while a day can still change and are pruned
+after ANALYTICS_CONCURRENCY_DAYS.
+"""
+
+import hashlib
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.core.config import settings
+from app.core.newrelic_logger import logger
+
+# Upper edges (seconds) of the duration histogram buckets; the last bucket is open-ended
+DURATION_BUCKETS = (30, 60, 120, 300, 600, 1800, 3600)
+HISTOGRAM_SIZE = len(DURATION_BUCKETS) + 1
+
+MINUTES_PER_DAY = 1440
+# Longer sessions only count towards concurrency for their first day
+MAX_SESSION_MINUTES = MINUTES_PER_DAY
+# company code * KEY_STRIDE + epoch minute, packed into one int64 for np.unique
+KEY_STRIDE = 1 << 32
+
+UNKNOWN_COMPANY = "unknown"
+# Chunk ids kept per rollup doc for replay detection
+APPLIED_KEEP = 50
+
+ROLLUP_PROJECTION = {
+    "_id": 0,
+    "conversation_id": 1,
+    "company_id": 1,
+    "start_time": 1,
+    "end_time": 1,
+    "created_at": 1,
+    # Older documents predate the stored count
+    "message_count": {"$ifNull": ["$message_count", {"$size": {"$ifNull": ["$messages", []]}}]},
+}
+SCAN_SORT = {"created_at": 1, "conversation_id": 1}
+
+
+def _utc(value: datetime) -> datetime:
+    # Motor returns naive UTC datetimes unless the client is tz_aware
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _day(day_number: int) -> str:
+    return str(np.datetime64(int(day_number), "D"))
+
+
+def frame_from_docs(docs: List[Dict]) -> pd.DataFrame:
+    """Column frame for aggregate_chunk() from projected conversation documents."""
+    frame = pd.DataFrame.from_records(docs, columns=["company_id", "start_time", "end_time", "message_count"])
+    frame["start_time"] = pd.to_datetime(frame["start_time"], utc=True)
+    frame["end_time"] = pd.to_datetime(frame["end_time"], utc=True)
+    return frame
+
+
+def aggregate_chunk(frame: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Roll up one chunk of conversations.
+    frame: company_id, start_time, end_time (tz-aware), message_count.
+    Returns (daily, active):
+      daily  - company_id, day, sessions, messages, turns, duration_sum,
+               duration_max, hist_0..hist_N
+      active - company_id, day, minute (of day), sessions
+    """
+    codes, companies = pd.factorize(frame["company_id"].fillna(UNKNOWN_COMPANY))
+    start_ns = frame["start_time"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+    end_ns = frame["end_time"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+    end_ns = np.maximum(end_ns, start_ns)
+    messages = frame["message_count"].fillna(0).to_numpy(dtype=np.int64)
+
+    duration = (end_ns - start_ns) / 1e9
+    start_min = start_ns // 60_000_000_000
+    end_min = end_ns // 60_000_000_000
+    day = start_min // MINUTES_PER_DAY
+
+    by_day = pd.DataFrame({
+        "company": codes,
+        "day": day,
+        "messages": messages,
+        # A turn is one user message and its reply
+        "turns": (messages + 1) // 2,
+        "duration": duration,
+        "bucket": np.searchsorted(DURATION_BUCKETS, duration, side="left"),
+    })
+    groups = by_day.groupby(["company", "day"], sort=False)
+    daily = groups.agg(
+        sessions=("turns", "size"),
+        messages=("messages", "sum"),
+        turns=("turns", "sum"),
+        duration_sum=("duration", "sum"),
+        duration_max=("duration", "max"),
+    )
+    hist = (
+        by_day.groupby(["company", "day", "bucket"], sort=False).size()
+        .unstack("bucket", fill_value=0)
+        .reindex(columns=range(HISTOGRAM_SIZE), fill_value=0)
+    )
+    hist.columns = [f"hist_{i}" for i in hist.columns]
+    daily = daily.join(hist).reset_index()
+    daily["company_id"] = companies[daily.pop("company").to_numpy()]
+    daily["day"] = daily["day"].map(_day)
+
+    # Every minute a session overlaps counts it as active in that minute
+    span = np.minimum(end_min - start_min + 1, MAX_SESSION_MINUTES)
+    first = np.repeat(np.cumsum(span) - span, span)
+    minutes = np.repeat(start_min, span) + (np.arange(first.size) - first)
+    keys, counts = np.unique(np.repeat(codes.astype(np.int64), span) * KEY_STRIDE + minutes, return_counts=True)
+    minute = keys % KEY_STRIDE
+    active = pd.DataFrame({
+        "company_id": companies[keys // KEY_STRIDE],
+        "day": minute // MINUTES_PER_DAY,
+        "minute": minute % MINUTES_PER_DAY,
+        "sessions": counts,
+    })
+    active["day"] = active["day"].map(_day)
+    return daily, active
+
+
+def histogram_quantile(hist: pd.DataFrame, q: float) -> pd.Series:
+    """
+    Approximate duration quantile per row from hist_* columns: the upper edge
+    (seconds) of the bucket holding the q-th session; inf for the open bucket.
+    """
+    counts = hist[[f"hist_{i}" for i in range(HISTOGRAM_SIZE)]].to_numpy()
+    cumulative = counts.cumsum(axis=1)
+    target = np.ceil(cumulative[:, -1] * q)
+    bucket = (cumulative < target[:, None]).sum(axis=1)
+    edges = np.array(DURATION_BUCKETS + (np.inf,))
+    return pd.Series(np.where(cumulative[:, -1] > 0, edges[bucket], np.nan), index=hist.index)
+
+
+def _ignore_replayed(e: BulkWriteError) -> None:
+    # The applied-chunk guard turns a replayed upsert into a duplicate key error
+    others = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+    if others:
+        raise e
+
+
+class ConversationAnalytics:
+    SOURCE = "conversations"
+    STATE = "analytics_state"
+    DAILY = "analytics_daily"
+    CONCURRENCY = "analytics_concurrency"
+    STATE_ID = "conversations"
+
+    def __init__(
+            self,
+            chunk_size: int = settings.ANALYTICS_CHUNK_SIZE,
+            lag_seconds: float = settings.ANALYTICS_LAG_SECONDS,
+            concurrency_days: int = settings.ANALYTICS_CONCURRENCY_DAYS,
+    ):
+        self.chunk_size = chunk_size
+        self.lag_seconds = lag_seconds
+        self.concurrency_days = concurrency_days
+
+    def _collection(self, name: str):
+        from app.core.mongodb_client import db
+        if db is None:
+            raise RuntimeError("MongoDB not initialized yet")
+        return db[name]
+
+    async def watermark(self) -> Optional[Dict]:
+        """{"created_at", "conversation_id"} of the last conversation rolled up, or None."""
+        return await self._collection(self.STATE).find_one({"_id": self.STATE_ID}, {"_id": 0})
+
+    async def reset(self) -> None:
+        """Drop all rollups and the watermark; the next run starts from scratch."""
+        await self._collection(self.STATE).delete_many({"_id": self.STATE_ID})
+        await self._collection(self.DAILY).delete_many({})
+        await self._collection(self.CONCURRENCY).delete_many({})
+
+    async def run(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Roll up every conversation created since the watermark. Returns counts."""
+        until = (now or datetime.now(timezone.utc)) - timedelta(seconds=self.lag_seconds)
+        state = await self.watermark()
+        source = self._collection(self.SOURCE)
+        processed = 0
+        chunks = 0
+        while True:
+            query = {"created_at": {"$lt": until}}
+            if state:
+                after = state["created_at"]
+                query = {"$and": [query, {"$or": [
+                    {"created_at": {"$gt": after}},
+                    {"created_at": after, "conversation_id": {"$gt": state["conversation_id"]}},
+                ]}]}
+            docs = await source.aggregate([
+                {"$match": query},
+                {"$sort": SCAN_SORT},
+                {"$limit": self.chunk_size},
+                {"$project": ROLLUP_PROJECTION},
+            ]).to_list(None)
+            if not docs:
+                break
+
+            last = docs[-1]
+            chunk_id = hashlib.sha1(
+                f"{state and _utc(state['created_at']).isoformat()}|{state and state['conversation_id']}|"
+                f"{last['conversation_id']}".encode()
+            ).hexdigest()[:16]
+            daily, active = aggregate_chunk(frame_from_docs(docs))
+            await self._apply(chunk_id, daily, active)
+
+            state = {"created_at": last["created_at"], "conversation_id": last["conversation_id"]}
+            await self._collection(self.STATE).update_one(
+                {"_id": self.STATE_ID},
+                {"$set": {**state, "updated_at": datetime.now(timezone.utc)}},
+                upsert=True,
+            )
+            processed += len(docs)
+            chunks += 1
+            logger.info(f"Analytics rolled up {len(docs)} conversations into {len(daily)} company-days")
+
+        cutoff = _day((until - timedelta(days=self.concurrency_days)).timestamp() // 86400)
+        pruned = await self._collection(self.CONCURRENCY).delete_many({"day": {"$lt": cutoff}})
+        return {"conversations": processed, "chunks": chunks, "pruned_concurrency_days": pruned.deleted_count}
+
+    async def _apply(self, chunk_id: str, daily: pd.DataFrame, active: pd.DataFrame) -> None:
+        now = datetime.now(timezone.utc)
+        applied = {"$push": {"applied": {"$each": [chunk_id], "$slice": -APPLIED_KEEP}}}
+
+        updates = []
+        for row in daily.to_dict("records"):
+            _id = f"{row['company_id']}:{row['day']}"
+            inc = {
+                "sessions": int(row["sessions"]),
+                "messages": int(row["messages"]),
+                "turns": int(row["turns"]),
+                "duration_sum": float(row["duration_sum"]),
+                **{f"hist.{i}": int(row[f"hist_{i}"]) for i in range(HISTOGRAM_SIZE) if row[f"hist_{i}"]},
+            }
+            updates.append(UpdateOne(
+                {"_id": _id, "applied": {"$ne": chunk_id}},
+                {
+                    "$set": {"company_id": row["company_id"], "day": row["day"], "updated_at": now},
+                    "$inc": inc,
+                    "$max": {"duration_max": float(row["duration_max"])},
+                    **applied,
+                },
+                upsert=True,
+            ))
+        await self._bulk(self.DAILY, updates)
+
+        updates = []
+        touched = []
+        for (company_id, day), minutes in active.groupby(["company_id", "day"], sort=False):
+            _id = f"{company_id}:{day}"
+            touched.append(_id)
+            inc = dict(zip((f"m.{m}" for m in minutes["minute"].tolist()), minutes["sessions"].tolist()))
+            updates.append(UpdateOne(
+                {"_id": _id, "applied": {"$ne": chunk_id}},
+                {"$set": {"company_id": company_id, "day": day}, "$inc": inc, **applied},
+                upsert=True,
+            ))
+        await self._bulk(self.CONCURRENCY, updates)
+
+        # Peaks are recomputed from the per-minute counts, so this part is idempotent
+        updates = []
+        async for doc in self._collection(self.CONCURRENCY).find({"_id": {"$in": touched}}, {"m": 1}):
+            minute, peak = max(doc.get("m", {}).items(), key=lambda kv: kv[1], default=("0", 0))
+            updates.append(UpdateOne(
+                {"_id": doc["_id"]},
+                {"$set": {"peak_concurrency": int(peak), "peak_minute": int(minute)}},
+            ))
+        await self._bulk(self.DAILY, updates)
+
+    async def _bulk(self, name: str, updates: List[UpdateOne]) -> None:
+        if not updates:
+            return
+        try:
+            await self._collection(name).bulk_write(updates, ordered=False)
+        except BulkWriteError as e:
+            _ignore_replayed(e)
+
+    async def daily_frame(self, company_id: Optional[str] = None, days: int = 30) -> pd.DataFrame:
+        """Daily rollups for the dashboard, newest first, with derived averages and percentiles."""
+        since = _day((datetime.now(timezone.utc) - timedelta(days=days)).timestamp() // 86400)
+        query = {"day": {"$gte": since}}
+        if company_id:
+            query["company_id"] = company_id
+        docs = await self._collection(self.DAILY).find(query, {"_id": 0, "applied": 0, "updated_at": 0}).to_list(None)
+        if not docs:
+            return pd.DataFrame()
+
+        frame = pd.DataFrame.from_records(docs)
+        hist = pd.DataFrame(frame.pop("hist").map(lambda h: h or {}).tolist(), index=frame.index)
+        hist = hist.rename(columns=lambda i: f"hist_{i}").reindex(
+            columns=[f"hist_{i}" for i in range(HISTOGRAM_SIZE)], fill_value=0
+        ).fillna(0)
+        frame["avg_turns"] = frame["turns"] / frame["sessions"]
+        frame["avg_duration_s"] = frame["duration_sum"] / frame["sessions"]
+        frame["p50_duration_s"] = histogram_quantile(hist, 0.5)
+        frame["p95_duration_s"] = histogram_quantile(hist, 0.95)
+        columns = [
+            "day", "company_id", "sessions", "turns", "messages", "avg_turns", "avg_duration_s",
+            "p50_duration_s", "p95_duration_s", "duration_max", "peak_concurrency", "peak_minute",
+        ]
+        return frame.reindex(columns=columns).sort_values(["day", "company_id"], ascending=[False, True]).reset_index(drop=True)
+
+
+conversation_analytics = ConversationAnalytics()
@@ -0,0 +1,254 @@
+"""
+Cold storage for old conversation transcripts.
+
+tier_conversations() moves conversations older than ARCHIVE_AFTER_DAYS out of
+MongoDB into compressed Parquet files on local disk, partitioned Hive-style by
+company and month of created_at:
+
+    <ARCHIVE_PATH>/company=<id>/month=YYYY-MM/part-<uuid>.parquet
+
+Each run writes one new file per partition (rows sorted by conversation_id, in
+small row groups so a single-conversation read only decodes one group). Only
+after a file is fsynced is the Mongo document replaced by a stub: the same
+metadata (ids, times, message_count) with archived=True and archive_path, and
+no messages. Listings and the keyset API are unaffected; ConversationManager
+hydrates messages from the archive when a full transcript is requested.
+
+If a run dies between writing a file and stubbing its documents, the next run
+archives them again into another file; the stub always points at the copy that
+was recorded, so the orphaned copy only costs disk space.
+"""
+
+import asyncio
+import os
+import threading
+import uuid
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from app.core.config import settings
+from app.core.newrelic_logger import logger
+
+MESSAGE_TYPE = pa.struct([
+    ("role", pa.string()),
+    ("message", pa.string()),
+    ("timestamp", pa.timestamp("ms", tz="UTC")),
+])
+
+SCHEMA = pa.schema([
+    ("conversation_id", pa.string()),
+    ("customer_id", pa.string()),
+    ("session_id", pa.string()),
+    ("company_id", pa.string()),
+    ("phone_number", pa.string()),
+    ("start_time", pa.timestamp("ms", tz="UTC")),
+    ("end_time", pa.timestamp("ms", tz="UTC")),
+    ("created_at", pa.timestamp("ms", tz="UTC")),
+    ("message_count", pa.int32()),
+    ("messages", pa.list_(MESSAGE_TYPE)),
+])
+
+ROW_GROUP_SIZE = 1000
+
+# Directory partitions; named apart from the company_id column stored in the files
+PARTITIONING_SCHEMA = pa.schema([("company", pa.string()), ("month", pa.string())])
+
+
+def _partition_value(value: Optional[str]) -> str:
+    # Keep partition directory names filesystem-safe
+    value = value or "unknown"
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in value)
+
+
+class ConversationArchive:
+    def __init__(
+            self,
+            root: str = settings.ARCHIVE_PATH,
+            compression: str = settings.ARCHIVE_COMPRESSION,
+            cache_files: int = 4,
+    ):
+        self.root = root
+        self.compression = compression
+        # Recently read files (archive_path -> {conversation_id: messages}); exports
+        # walk conversations in created_at order, so they hit the same file repeatedly
+        self._files: "OrderedDict[str, Dict[str, List[Dict]]]" = OrderedDict()
+        # Reads run in worker threads (asyncio.to_thread); the lock guards _files, not the file I/O
+        self._files_lock = threading.Lock()
+        self.cache_files = cache_files
+
+    def partition_dir(self, doc: Dict) -> str:
+        created_at = doc["created_at"]
+        return os.path.join(
+            f"company={_partition_value(doc.get('company_id'))}",
+            f"month={created_at:%Y-%m}",
+        )
+
+    def write(self, docs: List[Dict]) -> Dict[str, str]:
+        """
+        Write conversation documents to new Parquet files, one per partition.
+        Returns {conversation_id: archive_path} (paths relative to root).
+        """
+        by_partition = defaultdict(list)
+        for doc in docs:
+            by_partition[self.partition_dir(doc)].append(doc)
+
+        written = {}
+        for partition, rows in by_partition.items():
+            rows.sort(key=lambda d: d["conversation_id"])
+            rel_path = os.path.join(partition, f"part-{uuid.uuid4().hex}.parquet")
+            path = os.path.join(self.root, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            records = []
+            for row in rows:
+                record = {name: row.get(name) for name in SCHEMA.names}
+                if record["message_count"] is None:
+                    record["message_count"] = len(record["messages"] or [])
+                records.append(record)
+            table = pa.Table.from_pylist(records, schema=SCHEMA)
+            tmp_path = path + ".tmp"
+            pq.write_table(table, tmp_path, compression=self.compression, row_group_size=ROW_GROUP_SIZE)
+            with open(tmp_path, "rb") as f:
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+
+            for row in rows:
+                written[row["conversation_id"]] = rel_path
+        return written
+
+    def read_messages(self, archive_path: str, conversation_id: str, whole_file: bool = False) -> Optional[List[Dict]]:
+        """
+        Messages of one archived conversation, or None if it isn't in that file.
+        A single read only decodes the row group whose conversation_id range
+        matches; whole_file=True loads and caches the file for sequential reads.
+        """
+        with self._files_lock:
+            conversations = self._files.get(archive_path)
+            if conversations is not None:
+                self._files.move_to_end(archive_path)
+        if conversations is None and not whole_file:
+            table = pq.read_table(
+                os.path.join(self.root, archive_path),
+                columns=["messages"],
+                filters=[("conversation_id", "=", conversation_id)],
+            )
+            return table.column("messages")[0].as_py() if table.num_rows else None
+        if conversations is None:
+            table = pq.read_table(
+                os.path.join(self.root, archive_path),
+                columns=["conversation_id", "messages"],
+            )
+            conversations = dict(zip(
+                table.column("conversation_id").to_pylist(),
+                table.column("messages").to_pylist(),
+            ))
+            with self._files_lock:
+                self._files[archive_path] = conversations
+                while len(self._files) > self.cache_files:
+                    self._files.popitem(last=False)
+        return conversations.get(conversation_id)
+
+    def read_many(self, archive_path: str, conversation_ids: List[str]) -> Dict[str, List[Dict]]:
+        """Messages of several conversations in one file, in a single read: {conversation_id: messages}."""
+        with self._files_lock:
+            conversations = self._files.get(archive_path)
+        if conversations is not None:
+            return {cid: conversations[cid] for cid in conversation_ids if cid in conversations}
+        table = pq.read_table(
+            os.path.join(self.root, archive_path),
+            columns=["conversation_id", "messages"],
+            filters=[("conversation_id", "in", list(conversation_ids))],
+        )
+        return dict(zip(table.column("conversation_id").to_pylist(), table.column("messages").to_pylist()))
+
+    async def hydrate(self, doc: Dict, whole_file: bool = False) -> Dict:
+        """Fill in messages for an archived stub (no-op for hot documents)."""
+        if not doc.get("archived") or "messages" in doc:
+            return doc
+        messages = await asyncio.to_thread(self.read_messages, doc["archive_path"], doc["conversation_id"], whole_file)
+        if messages is None:
+            logger.bind(conversation_id=doc["conversation_id"]).error(f"Archived conversation missing from {doc['archive_path']}")
+            messages = []
+        doc["messages"] = messages
+        return doc
+
+    async def hydrate_many(self, docs: List[Dict]) -> List[Dict]:
+        """hydrate() for a page of documents: each archive file is read once for all its stubs."""
+        by_path = defaultdict(list)
+        for doc in docs:
+            if doc.get("archived") and "messages" not in doc:
+                by_path[doc["archive_path"]].append(doc)
+        if not by_path:
+            return docs
+
+        paths = list(by_path)
+        found = await asyncio.gather(*(
+            asyncio.to_thread(self.read_many, path, [doc["conversation_id"] for doc in by_path[path]])
+            for path in paths
+        ))
+        for path, messages_by_id in zip(paths, found):
+            for doc in by_path[path]:
+                messages = messages_by_id.get(doc["conversation_id"])
+                if messages is None:
+                    logger.bind(conversation_id=doc["conversation_id"]).error(f"Archived conversation missing from {path}")
+                    messages = []
+                doc["messages"] = messages
+        return docs
+
+
+conversation_archive = ConversationArchive()
+
+
+async def tier_conversations(
+        collection,
+        archive: ConversationArchive = conversation_archive,
+        older_than_days: float = settings.ARCHIVE_AFTER_DAYS,
+        batch_size: int = 5000,
+        now: Optional[datetime] = None,
+) -> Dict[str, int]:
+    """
+    Archive every conversation created more than `older_than_days` ago and
+    replace it with a stub. Safe to re-run; processes `batch_size` documents
+    per Parquet write. Returns counts.
+    """
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=older_than_days)
+    query = {"created_at": {"$lt": cutoff}, "archived": {"$ne": True}}
+    archived = 0
+    files = 0
+    while True:
+        docs = await collection.find(query, {"_id": 0}).sort("created_at", 1).limit(batch_size).to_list(batch_size)
+        if not docs:
+            break
+        written = await asyncio.to_thread(archive.write, docs)
+
+        by_path = defaultdict(list)
+        for conversation_id, path in written.items():
+            by_path[path].append(conversation_id)
+        for path, ids in by_path.items():
+            await collection.update_many(
+                {"conversation_id": {"$in": ids}},
+                {"$set": {"archived": True, "archive_path": path}, "$unset": {"messages": ""}},
+            )
+        archived += len(docs)
+        files += len(by_path)
+        logger.info(f"Archived {len(docs)} conversations into {len(by_path)} files")
+
+    return {"archived": archived, "files": files}
+
+
+def archive_size(root: str = settings.ARCHIVE_PATH) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(root):
+        total += sum(os.path.getsize(os.path.join(dirpath, f)) for f in filenames if f.endswith(".parquet"))
+    return total
+
+
+def iter_archive(root: str = settings.ARCHIVE_PATH, columns: Optional[Iterable[str]] = None, filter=None):
+    """Scan the whole archive (or a partition filter) as Arrow record batches."""
+    import pyarrow.dataset as ds
+    dataset = ds.dataset(root, format="parquet", partitioning=ds.partitioning(PARTITIONING_SCHEMA, flavor="hive"))
+    return dataset.to_batches(columns=list(columns) if columns else None, filter=filter)
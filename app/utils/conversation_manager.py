@@ -4,17 +4,27 @@ ConversationManager - handle storing and retrieving conversation transcripts.
 This module is the single place where conversation documents are created/queried.
 """
 
+import base64
+import json
 import uuid
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import AsyncIterator, List, Dict, Optional, Tuple
 
 from app.core.mongodb_client import db
 from app.models.conversation import Conversation, MessageItem
 from app.core.newrelic_logger import logger
+from app.utils.conversation_archive import conversation_archive
+from app.utils.conversation_writer import conversation_writer
 
 class ConversationManager:
     COLLECTION = "conversations"
 
+    # Listing projection: metadata only, no message bodies
+    META_PROJECTION = {"_id": 0, "messages": 0}
+    FULL_PROJECTION = {"_id": 0}
+    # Keyset order; conversation_id breaks ties between equal created_at
+    LIST_SORT = [("created_at", -1), ("conversation_id", -1)]
+
     @property
     def collection(self):
         from app.core.mongodb_client import db
@@ -34,6 +44,8 @@ class ConversationManager:
     ) -> str:
         """
         Save a conversation transcript into MongoDB.
+        When the write-behind writer is running the document is spooled and
+        batched instead of inserted inline.
         Returns conversation_id.
         """
         conversation_id = str(uuid.uuid4())
@@ -46,27 +58,114 @@ class ConversationManager:
             company_id=company_id,
             phone_number=phone_number,
             messages=msg_items,
+            message_count=len(msg_items),
             start_time=start_time,
             end_time=end_time,
             # created_at will be set by model default
         )
 
         doc = conv.model_dump()
-        await self.collection.insert_one(doc)
-
-        logger.bind(
+        log = logger.bind(
             company_id=company_id,
             customer_id=customer_id, 
             session_id=session_id, 
             conversation_id=conversation_id
-        ).info("Saved conversation transcript.")
+        )
+        if conversation_writer.running:
+            await conversation_writer.submit(doc)
+            log.info("Queued conversation transcript.")
+        else:
+            await self.collection.insert_one(doc)
+            log.info("Saved conversation transcript.")
         
         return conversation_id
-    
-async def get_conversation_for_customer(self, customer_id: str, limit: int=50) -> List[Dict]:
-    """Return most recent conversation for a customer."""
-    cursor = self.collection.find({"customer_id": customer_id}).sort("created_at", -1).limit(limit)
-    results = []
-    async for doc in cursor:
-        results.append(doc)
-    return results
\ No newline at end of file
+
+    @staticmethod
+    def encode_cursor(doc: Dict) -> str:
+        raw = json.dumps([doc["created_at"].isoformat(), doc["conversation_id"]])
+        return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+        try:
+            created_at, conversation_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            return datetime.fromisoformat(created_at), conversation_id
+        except Exception:
+            raise ValueError("Invalid cursor")
+
+    @staticmethod
+    def _filter(customer_id: Optional[str], company_id: Optional[str]) -> Dict:
+        query = {}
+        if customer_id:
+            query["customer_id"] = customer_id
+        if company_id:
+            query["company_id"] = company_id
+        if not query:
+            raise ValueError("customer_id or company_id is required")
+        return query
+
+    async def list_conversations(
+            self,
+            customer_id: Optional[str] = None,
+            company_id: Optional[str] = None,
+            limit: int = 50,
+            cursor: Optional[str] = None,
+            include_messages: bool = False,
+    ) -> Tuple[List[Dict], Optional[str]]:
+        """
+        One page of a customer's (or company's) conversations, newest first.
+        Keyset pagination on (created_at, conversation_id): each page is an index
+        range scan however deep it is. Returns (items, next_cursor); next_cursor
+        is None on the last page.
+        """
+        query = self._filter(customer_id, company_id)
+        if cursor:
+            created_at, conversation_id = self.decode_cursor(cursor)
+            query["$or"] = [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "conversation_id": {"$lt": conversation_id}},
+            ]
+        projection = self.FULL_PROJECTION if include_messages else self.META_PROJECTION
+        # One extra row tells whether there is a next page
+        docs = await self.collection.find(query, projection).sort(self.LIST_SORT).limit(limit + 1).to_list(limit + 1)
+        next_cursor = self.encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+        docs = docs[:limit]
+        if include_messages:
+            docs = await conversation_archive.hydrate_many(docs)
+        return docs, next_cursor
+
+    async def get_conversation(self, conversation_id: str) -> Optional[Dict]:
+        """Full transcript; archived conversations are read back from the Parquet archive."""
+        doc = await self.collection.find_one({"conversation_id": conversation_id}, self.FULL_PROJECTION)
+        if doc is None:
+            return None
+        return await conversation_archive.hydrate(doc)
+
+    async def export_conversations(
+            self,
+            customer_id: Optional[str] = None,
+            company_id: Optional[str] = None,
+            since: Optional[datetime] = None,
+            until: Optional[datetime] = None,
+            include_messages: bool = True,
+            batch_size: int = 500,
+    ) -> AsyncIterator[Dict]:
+        """Stream every matching conversation (newest first) without loading them all."""
+        query = self._filter(customer_id, company_id)
+        if since or until:
+            query["created_at"] = {}
+            if since:
+                query["created_at"]["$gte"] = since
+            if until:
+                query["created_at"]["$lt"] = until
+        projection = self.FULL_PROJECTION if include_messages else self.META_PROJECTION
+        cursor = self.collection.find(query, projection).sort(self.LIST_SORT).batch_size(batch_size)
+        async for doc in cursor:
+            if include_messages:
+                doc = await conversation_archive.hydrate(doc, whole_file=True)
+            yield doc
+
+    async def get_conversation_for_customer(self, customer_id: str, limit: int=50) -> List[Dict]:
+        """Return the most recent conversations for a customer (metadata only)."""
+        items, _ = await self.list_conversations(customer_id=customer_id, limit=limit)
+        return items
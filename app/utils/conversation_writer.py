@@ -0,0 +1,371 @@
+"""
+Write-behind persistence for conversation transcripts.
+
+save_conversation hands documents to ConversationWriter instead of awaiting
+an insert_one per session. A background dispatcher groups them into
+insert_many batches (by size or age) and runs a bounded number of batches
+concurrently, so a mass disconnect turns into a few bulk writes. A batch that
+still fails after its retries goes back on the queue after a backoff.
+
+Every queued document is first appended to this worker's own spool file,
+<CONVERSATION_SPOOL_DIR>/<host>-<pid>.jsonl, held under an exclusive lock,
+and an ack line is written once its batch is committed. The spool is
+compacted every `compact_every` acknowledged documents and on shutdown
+(removed if nothing is left). On startup a worker adopts the spool files
+whose lock is free, i.e. whose worker is gone, and replays the
+unacknowledged documents, so transcripts survive a crash; replays that were
+in fact already inserted are skipped via the unique conversation_id index.
+"""
+
+import asyncio
+import base64
+import glob
+import os
+import socket
+from typing import Callable, Dict, List, Optional
+
+import bson
+from bson import json_util
+from bson.codec_options import CodecOptions
+from pymongo.errors import BulkWriteError
+
+from app.core.config import settings
+from app.core.newrelic_logger import logger
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks (Windows): only this worker's own spool name is ever adopted
+    fcntl = None
+
+DUPLICATE_KEY = 11000
+SPOOL_CODEC = CodecOptions(tz_aware=True)
+
+
+def encode_record(record: Dict) -> str:
+    """One spool line: base64 BSON, about 10x cheaper to write than extended JSON."""
+    return base64.b64encode(bson.encode(record)).decode("ascii") + "\n"
+
+
+def decode_record(line: str) -> Dict:
+    if line.startswith("{"):
+        # Extended JSON lines written before the BSON spool format
+        return json_util.loads(line)
+    return bson.decode(base64.b64decode(line, validate=True), codec_options=SPOOL_CODEC)
+
+
+class ConversationWriter:
+    def __init__(
+            self,
+            spool_dir: str = settings.CONVERSATION_SPOOL_DIR,
+            batch_size: int = settings.CONVERSATION_BATCH_SIZE,
+            max_batch_age: float = settings.CONVERSATION_BATCH_AGE,
+            max_concurrency: int = settings.CONVERSATION_WRITE_CONCURRENCY,
+            max_retries: int = 3,
+            max_backoff: float = 60,
+            compact_every: int = 1000,
+    ):
+        self.spool_dir = spool_dir
+        # Set in start(): the pid must be the serving process's, not an importing parent's
+        self.spool_path: Optional[str] = None
+        self.batch_size = batch_size
+        self.max_batch_age = max_batch_age
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self.compact_every = compact_every
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._queue: Optional[asyncio.Queue] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._batches: set = set()
+        self._requeues: set = set()
+        self._compaction: Optional[asyncio.Task] = None
+        self._compacting: Optional[List[str]] = None
+        self._spool = None
+        # Spooled documents not acknowledged yet, by conversation_id; what a compaction keeps
+        self._pending: Dict[str, Dict] = {}
+        self._acked_since_compact = 0
+        self._failures = 0
+        self._collection: Optional[Callable] = None
+        self._closing = False
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.compactions = 0
+
+    @property
+    def running(self) -> bool:
+        return self._dispatcher is not None
+
+    async def start(self, collection: Callable) -> int:
+        """
+        Take this worker's spool, adopt the spools of dead workers and start the dispatcher.
+        collection: zero-arg callable returning the Motor collection to write into.
+        Returns the number of replayed documents.
+        """
+        self._collection = collection
+        self._closing = False
+
+        pending = await asyncio.to_thread(self._open_spool)
+        self._queue = asyncio.Queue()
+        for doc in pending:
+            self._queue.put_nowait(doc)
+        if pending:
+            logger.info(f"Replaying {len(pending)} spooled conversation transcripts")
+
+        self._dispatcher = asyncio.create_task(self._run())
+        return len(pending)
+
+    async def submit(self, doc: Dict) -> None:
+        """Spool the document and queue it for the next batch."""
+        if self._queue is None:
+            raise RuntimeError("ConversationWriter not started")
+        self._pending[doc["conversation_id"]] = doc
+        self._append({"put": doc})
+        self._queue.put_nowait(doc)
+
+    async def close(self, timeout: float = 10) -> None:
+        """
+        Flush everything still queued, wait for the batches in flight, then stop.
+        Anything left over stays in the spool for the next start (of any worker).
+        """
+        if self._dispatcher is None:
+            return
+        self._closing = True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Conversation writer closed with {self._queue.qsize()} transcripts unflushed (kept in spool)")
+        self._dispatcher.cancel()
+        self._dispatcher = None
+        for task in list(self._requeues):
+            task.cancel()
+
+        # Batches must not ack into a closed spool; unfinished ones are cancelled and stay spooled
+        if self._batches:
+            await asyncio.wait(set(self._batches), timeout=max(deadline - loop.time(), 0.1))
+        leftover = list(self._batches) + list(self._requeues)
+        for task in leftover:
+            task.cancel()
+        await asyncio.gather(*leftover, return_exceptions=True)
+        if self._compaction is not None:
+            await asyncio.gather(self._compaction, return_exceptions=True)
+
+        await asyncio.to_thread(self._close_spool)
+        logger.info(f"Conversation writer stopped: {self.stats()}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "in_flight_batches": len(self._batches),
+            "spooled": len(self._pending),
+            "written": self.written,
+            "failed": self.failed,
+            "batches": self.batches,
+            "compactions": self.compactions,
+        }
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_batch_age
+            while len(batch) < self.batch_size:
+                if self._closing and self._queue.empty():
+                    break
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            await self._slots.acquire()
+            task = asyncio.create_task(self._write(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _write(self, batch: List[Dict]) -> None:
+        try:
+            for attempt in range(self.max_retries):
+                try:
+                    await self._collection().insert_many(batch, ordered=False)
+                    break
+                except BulkWriteError as e:
+                    # Replayed documents that were already inserted are fine
+                    if all(err.get("code") == DUPLICATE_KEY for err in e.details.get("writeErrors", [])):
+                        break
+                    error = e
+                except Exception as e:
+                    error = e
+                if attempt + 1 < self.max_retries:
+                    await asyncio.sleep(2 ** attempt)
+            else:
+                self.failed += len(batch)
+                self._failures += 1
+                delay = min(self.max_backoff, 2 ** (self.max_retries + self._failures - 1))
+                logger.error(f"Failed to persist {len(batch)} conversations, retrying in {delay}s (kept in spool): {error}")
+                task = asyncio.create_task(self._requeue(batch, delay))
+                self._requeues.add(task)
+                task.add_done_callback(self._requeues.discard)
+                return
+
+            self._failures = 0
+            self.written += len(batch)
+            self.batches += 1
+            ids = [d["conversation_id"] for d in batch]
+            for conversation_id in ids:
+                self._pending.pop(conversation_id, None)
+            self._append({"ack": ids})
+            self._acked_since_compact += len(batch)
+            if self._acked_since_compact >= self.compact_every and self._compaction is None:
+                self._compaction = asyncio.create_task(self._compact())
+        finally:
+            self._slots.release()
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _requeue(self, batch: List[Dict], delay: float) -> None:
+        await asyncio.sleep(delay)
+        for doc in batch:
+            self._queue.put_nowait(doc)
+
+    def _append(self, record: Dict) -> None:
+        line = encode_record(record)
+        self._spool.write(line)
+        self._spool.flush()
+        if self._compacting is not None:
+            self._compacting.append(line)
+
+    async def _compact(self) -> None:
+        """Rewrite the spool with only the unacknowledged documents, off the event loop."""
+        self._acked_since_compact = 0
+        # Lines appended while the copy is written go into it too before the swap
+        self._compacting = []
+        try:
+            tmp = await asyncio.to_thread(self._write_tmp, list(self._pending.values()))
+            for line in self._compacting:
+                tmp.write(line)
+            self._swap(tmp)
+            self.compactions += 1
+        except Exception as e:
+            logger.error(f"Conversation spool compaction failed: {e}")
+        finally:
+            self._compacting = None
+            self._compaction = None
+
+    def _open_spool(self) -> List[Dict]:
+        """Take this worker's spool and adopt those of dead workers. Returns the documents to replay."""
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self.spool_path = os.path.join(self.spool_dir, f"{socket.gethostname()}-{os.getpid()}.jsonl")
+        self._pending = {}
+        adopted = []
+        try:
+            for path in sorted(glob.glob(os.path.join(self.spool_dir, "*.jsonl*"))):
+                if fcntl is None and path != self.spool_path:
+                    continue
+                if path == f"{self.spool_path}.tmp":
+                    # Left by a crashed process that had our pid; _write_tmp overwrites it
+                    continue
+                f = self._claim(path)
+                if f is None:
+                    continue
+                adopted.append(f)
+                # A .tmp is an interrupted compaction: a subset of the spool next to it
+                if path.endswith(".jsonl"):
+                    self._pending.update(self._read(f))
+
+            # Our own spool now holds everything adopted, so the old files can go
+            self._swap(self._write_tmp(list(self._pending.values())))
+            for f in adopted:
+                if f.name != self.spool_path:
+                    try:
+                        os.unlink(f.name)
+                    except FileNotFoundError:
+                        pass
+        finally:
+            for f in adopted:
+                f.close()
+        if len(adopted) > 1:
+            logger.info(f"Adopted {len(adopted)} conversation spool files in {self.spool_dir}")
+        return list(self._pending.values())
+
+    def _close_spool(self) -> None:
+        if self._pending:
+            self._swap(self._write_tmp(list(self._pending.values())))
+            self._spool.close()
+        else:
+            os.unlink(self.spool_path)
+            self._spool.close()
+        self._spool = None
+
+    def _claim(self, path: str):
+        """Open and lock a spool file, or None if its worker still holds it."""
+        try:
+            f = open(path, encoding="utf-8")
+        except FileNotFoundError:
+            return None
+        if not self._lock(f) or not self._same_file(f, path):
+            f.close()
+            return None
+        return f
+
+    def _write_tmp(self, docs: List[Dict]):
+        tmp = open(f"{self.spool_path}.tmp", "w", encoding="utf-8")
+        self._lock(tmp)
+        for doc in docs:
+            tmp.write(encode_record({"put": doc}))
+        tmp.flush()
+        os.fsync(tmp.fileno())
+        return tmp
+
+    def _swap(self, tmp) -> None:
+        """Make the locked copy the spool. The lock moves with the file, so no other worker can adopt it meanwhile."""
+        tmp.flush()
+        old, self._spool = self._spool, tmp
+        if old is not None and fcntl is None:
+            # Windows cannot replace a file that is still open
+            old.close()
+            old = None
+        os.replace(tmp.name, self.spool_path)
+        if old is not None:
+            old.close()
+
+    @staticmethod
+    def _lock(f) -> bool:
+        if fcntl is None:
+            return True
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    @staticmethod
+    def _same_file(f, path: str) -> bool:
+        # The path may have been replaced by a compaction between open() and the lock
+        try:
+            return os.fstat(f.fileno()).st_ino == os.stat(path).st_ino
+        except FileNotFoundError:
+            return False
+
+    @staticmethod
+    def _read(f) -> Dict[str, Dict]:
+        pending: Dict[str, Dict] = {}
+        for line in f:
+            try:
+                record = decode_record(line.strip())
+            except Exception:
+                # Torn last line after a crash
+                continue
+            if "put" in record:
+                pending[record["put"]["conversation_id"]] = record["put"]
+            else:
+                for conversation_id in record.get("ack", []):
+                    pending.pop(conversation_id, None)
+        return pending
+
+
+conversation_writer = ConversationWriter()
@@ -1,49 +1,79 @@
 import uuid
 #from loguru import logger
 from app.core.newrelic_logger import logger
+from collections import OrderedDict
 from typing import Optional
-from app.models.customer import Customer
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from app.core.config import settings
+from app.models.customer import normalize_phone_number
 
 class CustomerManager:
     COLLECTION = "customers"
 
+    def __init__(self, cache_size: int = settings.CUSTOMER_CACHE_SIZE):
+        # Process-local phone -> customer_id map; customer ids never change once created
+        self._id_cache: "OrderedDict[str, str]" = OrderedDict()
+        self._cache_size = cache_size
+
     @property
     def collection(self):   
         from app.core.mongodb_client import db
         if db is None:
             raise RuntimeError("MongoDB not initialized yet")
         return db[self.COLLECTION]
+
+    def _remember(self, phone_number: str, customer_id: str) -> None:
+        if self._cache_size <= 0:
+            return
+        self._id_cache[phone_number] = customer_id
+        self._id_cache.move_to_end(phone_number)
+        if len(self._id_cache) > self._cache_size:
+            self._id_cache.popitem(last=False)
       
     async def get_or_create_customer(self, phone_number: str) -> str:
         """
-        Validate phone number via Pydantic model and ensure a persistent customer record.
+        Validate phone number and ensure a persistent customer record.
+        Uses a single atomic upsert, so concurrent sign-ins for the same number
+        resolve to the same customer.
         Returns the customer_id (string).
-        Raises ValidationError if phone is invalid.
+        Raises ValueError if phone is invalid.
         """
 
-        # Validate and normalize phone number with Customer model (temporary id used)
-        temp_id = str(uuid.uuid4())
-        validated = Customer(_id=temp_id, phone_number=phone_number)
-        normalized_phone =  validated.phone_number
+        normalized_phone = normalize_phone_number(phone_number)
 
-        customer = await self.collection.find_one({"phone_number": normalized_phone})
-        if customer:
-            log = logger.bind(customer_id=customer["_id"], phone_number=phone_number)
+        customer_id = self._id_cache.get(normalized_phone)
+        if customer_id:
+            self._id_cache.move_to_end(normalized_phone)
+            logger.bind(customer_id=customer_id, phone_number=normalized_phone).info("Found cached customer.")
+            return customer_id
+
+        new_id = str(uuid.uuid4())
+        try:
+            customer = await self.collection.find_one_and_update(
+                {"phone_number": normalized_phone},
+                {"$setOnInsert": {
+                    "_id": new_id,
+                    "name": None,
+                    "email": None,
+                    "address": None
+                }},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+                projection={"_id": 1},
+            )
+        except DuplicateKeyError:
+            # Lost an upsert race on the unique phone_number index; the other insert won
+            customer = await self.collection.find_one({"phone_number": normalized_phone}, {"_id": 1})
+
+        customer_id = customer["_id"]
+        self._remember(normalized_phone, customer_id)
+
+        log = logger.bind(customer_id=customer_id, phone_number=normalized_phone)
+        if customer_id == new_id:
+            log.info(f"Created new customer.")
+        else:
             log.info(f"Found existing customer.")
-            return customer["_id"]
-        
-        # Create new customer
-        customer_id = str(uuid.uuid4())
-        new_customer = {
-            "_id": customer_id, 
-            "phone_number": phone_number, 
-            "name": None, 
-            "email": None, 
-            "address": None
-        }
-        await self.collection.insert_one(new_customer)
-        log = logger.bind(customer_id=customer_id, phone_number=phone_number)
-        log.info(f"Created new customer.")
         return customer_id
     
     async def get_customer(self, phone_number: str) -> Optional[dict]:
@@ -0,0 +1,135 @@
+"""
+Offline stand-in for AsyncOpenAI.
+
+Implements just the surface OpenAIClient uses (client.chat.completions.create,
+streaming and non-streaming) so the chat path can run without network access.
+Enable it with OPENAI_FAKE=1 or pass FakeAsyncOpenAI() to OpenAIClient.
+"""
+
+import asyncio
+import math
+import random
+import time
+from collections import deque
+from types import SimpleNamespace
+
+import httpx
+from openai import RateLimitError
+
+
+def rate_limit_error(retry_after: float | None = None) -> RateLimitError:
+    headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+    request = httpx.Request("POST", "https://fake-openai.local/v1/chat/completions")
+    response = httpx.Response(429, headers=headers, request=request)
+    return RateLimitError("Rate limit reached (fake)", response=response, body=None)
+
+
+class FakeStream:
+    """Async iterator of chat.completion.chunk-like objects."""
+
+    def __init__(self, deltas: list[str], first_token_delay: float, token_delay: float):
+        self._deltas = deltas
+        self._first_token_delay = first_token_delay
+        self._token_delay = token_delay
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for i, delta in enumerate(self._deltas):
+            await asyncio.sleep(self._first_token_delay if i == 0 else self._token_delay)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))])
+
+
+class FakeCompletions:
+    def __init__(self, parent: "FakeAsyncOpenAI"):
+        self._parent = parent
+
+    async def create(self, model: str, messages: list[dict], stream: bool = False, **kwargs):
+        parent = self._parent
+        parent.calls += 1
+        if parent.over_limit():
+            parent.rate_limited += 1
+            raise rate_limit_error(parent.retry_after)
+        if parent.fail_first > 0:
+            parent.fail_first -= 1
+            raise parent.error_factory()
+
+        reply = parent.reply_fn(messages)
+        if stream:
+            words = reply.split(" ")
+            deltas = [w if i == 0 else " " + w for i, w in enumerate(words)]
+            return FakeStream(deltas, parent.sample_latency(), parent.token_delay)
+
+        await asyncio.sleep(parent.sample_latency() + parent.token_delay * len(reply.split(" ")))
+        parent.completed += 1
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))])
+
+
+class FakeAsyncOpenAI:
+    """
+    latency: mean seconds before the first token.
+    distribution: "uniform" (latency +/- jitter), "lognormal" (median latency,
+    sigma=jitter, for realistic long tails) or "exponential" (mean latency).
+    fail_first: number of calls that raise error_factory() before succeeding.
+    rate_limit: simulated provider quota, max requests per rate_window seconds
+    (0 = unlimited); calls over it get a 429 RateLimitError with retry_after.
+    """
+
+    def __init__(
+            self,
+            latency: float = 0.05,
+            jitter: float = 0.0,
+            distribution: str = "uniform",
+            token_delay: float = 0.005,
+            reply_fn=None,
+            fail_first: int = 0,
+            error_factory=None,
+            rate_limit: int = 0,
+            rate_window: float = 60.0,
+            retry_after: float | None = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.distribution = distribution
+        self.token_delay = token_delay
+        self.reply_fn = reply_fn or self._echo
+        self.fail_first = fail_first
+        self.error_factory = error_factory or (lambda: RuntimeError("fake OpenAI failure"))
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.retry_after = retry_after
+        self._recent = deque()
+        self.calls = 0
+        self.completed = 0
+        self.rate_limited = 0
+        self.chat = SimpleNamespace(completions=FakeCompletions(self))
+        # Warm-up calls models.list() to open connections; nothing to open here
+        self.models = SimpleNamespace(list=self._list_models)
+
+    async def _list_models(self):
+        await asyncio.sleep(0)
+        return SimpleNamespace(data=[SimpleNamespace(id="fake")])
+
+    @staticmethod
+    def _echo(messages: list[dict]) -> str:
+        last = messages[-1]["content"] if messages else ""
+        return f"You said: {last}"
+
+    def over_limit(self) -> bool:
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        while self._recent and self._recent[0] <= now - self.rate_window:
+            self._recent.popleft()
+        if len(self._recent) >= self.rate_limit:
+            return True
+        self._recent.append(now)
+        return False
+
+    def sample_latency(self) -> float:
+        if self.distribution == "lognormal":
+            return random.lognormvariate(math.log(self.latency), self.jitter) if self.latency > 0 else 0.0
+        if self.distribution == "exponential":
+            return random.expovariate(1 / self.latency) if self.latency > 0 else 0.0
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
@@ -0,0 +1,80 @@
+"""
+Size-bounded LRU/TTL cache for per-company KB data, local to one worker.
+
+Entries are stored with the KB version they were built from; a lookup for a
+different version is a miss. upload_kb bumps the version and publishes it on
+KB_INVALIDATION_CHANNEL so every worker drops the stale entry right away,
+and the TTL bounds staleness if a pub/sub message is ever missed.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import settings
+
+
+class KBCache:
+    def __init__(self, max_entries: int = settings.KB_CACHE_SIZE, ttl_seconds: float = settings.KB_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[str, Tuple[int, Any, float]]" = OrderedDict()
+        # Index builds put() from worker threads (asyncio.to_thread) while the loop reads
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, company_id: str, version: Optional[int] = None) -> Any:
+        """Return the cached value for the company, or None, counting a hit or miss.
+        If `version` is given, entries built from another version are a miss."""
+        value = self.peek(company_id, version)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def peek(self, company_id: str, version: Optional[int] = None) -> Any:
+        """Like get() but not counted; for follow-up lookups within a turn that already called get()."""
+        with self._lock:
+            item = self._data.get(company_id)
+            if item is None:
+                return None
+            cached_version, value, expires_at = item
+            if expires_at < time.monotonic() or (version is not None and cached_version != version):
+                del self._data[company_id]
+                return None
+            self._data.move_to_end(company_id)
+            return value
+
+    def put(self, company_id: str, version: int, value: Any) -> None:
+        with self._lock:
+            self._data[company_id] = (version, value, time.monotonic() + self.ttl_seconds)
+            self._data.move_to_end(company_id)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, company_id: str, version: Optional[int] = None) -> bool:
+        """Drop the company's entry (only if older than `version`, when given)."""
+        with self._lock:
+            item = self._data.get(company_id)
+            if item is None or (version is not None and item[0] >= version):
+                return False
+            del self._data[company_id]
+            self.invalidations += 1
+            return True
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
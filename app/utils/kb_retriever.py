@@ -0,0 +1,150 @@
+"""
+Lexical (BM25) retrieval over company KB entries.
+
+An index is built once per company when the KB is uploaded (or lazily on the
+first session that needs it) and each user turn only pulls the top-k entries
+that fit in a token budget, instead of sending the whole KB with every call.
+"""
+
+import re
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.newrelic_logger import logger
+from app.utils.kb_cache import KBCache
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap LLM token estimate (~4 characters per token)."""
+    return max(1, len(text) // 4)
+
+
+class KBIndex:
+    """
+    BM25 index over a list of KB entries.
+
+    Postings are stored CSR-style (term -> slice of doc ids / weights) with the
+    BM25 term weight precomputed at build time, so scoring a query is a handful
+    of vectorized NumPy adds over the matching postings.
+    """
+
+    def __init__(self, entries: List[str], k1: float = 1.5, b: float = 0.75, version: int = 0):
+        self.entries = entries
+        self.version = version
+        self.entry_tokens = np.array([estimate_tokens(e) for e in entries], dtype=np.int32)
+        self.vocab: Dict[str, int] = {}
+
+        term_ids, doc_ids, tfs = [], [], []
+        doc_len = np.zeros(len(entries), dtype=np.float32)
+        for doc_id, entry in enumerate(entries):
+            counts = Counter(tokenize(entry))
+            doc_len[doc_id] = sum(counts.values())
+            for term, tf in counts.items():
+                term_ids.append(self.vocab.setdefault(term, len(self.vocab)))
+                doc_ids.append(doc_id)
+                tfs.append(tf)
+
+        term_ids = np.array(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind="stable")
+        term_ids = term_ids[order]
+        self.doc_ids = np.array(doc_ids, dtype=np.int32)[order]
+        tfs = np.array(tfs, dtype=np.float32)[order]
+
+        # offsets[t]:offsets[t+1] is the postings slice of term t
+        df = np.bincount(term_ids, minlength=len(self.vocab))
+        self.offsets = np.concatenate(([0], np.cumsum(df)))
+
+        n_docs = max(len(entries), 1)
+        avgdl = float(doc_len.mean()) if len(entries) else 1.0
+        idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        norm = k1 * (1 - b + b * doc_len[self.doc_ids] / max(avgdl, 1e-9))
+        self.weights = idf[term_ids] * tfs * (k1 + 1) / (tfs + norm)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def score(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self.entries), dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            # doc ids are unique within one term's postings, so fancy-index add is safe
+            scores[self.doc_ids[start:end]] += self.weights[start:end]
+        return scores
+
+    def search(self, query: str, top_k: int, token_budget: int) -> List[str]:
+        """Return up to top_k entries, best first, whose combined size fits token_budget."""
+        if not self.entries:
+            return []
+        scores = self.score(query)
+        matched = np.flatnonzero(scores > 0)
+        if matched.size == 0:
+            return []
+        if matched.size > top_k:
+            matched = matched[np.argpartition(-scores[matched], top_k - 1)[:top_k]]
+        ranked = matched[np.argsort(-scores[matched], kind="stable")]
+
+        selected, used = [], 0
+        for doc_id in ranked:
+            cost = int(self.entry_tokens[doc_id])
+            if used + cost > token_budget:
+                continue
+            selected.append(self.entries[doc_id])
+            used += cost
+        return selected
+
+
+class KBRetriever:
+    """Holds one KBIndex per company for this worker, in a version-keyed LRU/TTL cache."""
+
+    def __init__(self):
+        self._indexes = KBCache()
+
+    def build(self, company_id: str, entries: List[str], version: int = 0) -> KBIndex:
+        started = time.perf_counter()
+        index = KBIndex(entries, version=version)
+        self._indexes.put(company_id, version, index)
+        logger.bind(company_id=company_id).info(
+            f"Built KB index v{version}: {len(entries)} entries, {len(index.vocab)} terms "
+            f"in {(time.perf_counter() - started) * 1000:.1f} ms"
+        )
+        return index
+
+    def get(self, company_id: str, version: Optional[int] = None) -> Optional[KBIndex]:
+        return self._indexes.get(company_id, version)
+
+    def peek(self, company_id: str, version: Optional[int] = None) -> Optional[KBIndex]:
+        return self._indexes.peek(company_id, version)
+
+    def drop(self, company_id: str, version: Optional[int] = None) -> bool:
+        return self._indexes.invalidate(company_id, version)
+
+    def stats(self) -> Dict[str, int]:
+        return self._indexes.stats()
+
+    def search(
+            self,
+            company_id: str,
+            query: str,
+            top_k: int = settings.KB_TOP_K,
+            token_budget: int = settings.KB_TOKEN_BUDGET,
+    ) -> List[str]:
+        index = self._indexes.peek(company_id)
+        if index is None:
+            return []
+        return index.search(query, top_k, token_budget)
+
+
+kb_retriever = KBRetriever()
@@ -1,66 +1,151 @@
-import os
-import json
-import asyncio
+import time
+from typing import AsyncIterator
 from openai import AsyncOpenAI, APIError, RateLimitError, APITimeoutError
 from app.core.config import settings
 from app.core.newrelic_logger import logger
+from app.utils.kb_retriever import estimate_tokens
+from app.utils.openai_limiter import openai_limiter
+from app.utils.prompt_assembler import CompiledPrefix, prompt_assembler
 
-client = AsyncOpenAI(api_key=settings.OPENAI_KEY)
+if settings.OPENAI_FAKE:
+    from app.utils.fake_openai import FakeAsyncOpenAI
+    client = FakeAsyncOpenAI()
+else:
+    client = AsyncOpenAI(api_key=settings.OPENAI_KEY)
 
 class OpenAIClient:
-    def __init__(self):
+    def __init__(self, client=client, limiter=openai_limiter):
         self.client = client
+        self.limiter = limiter
         self.model = settings.OPENAI_MODEL or "gpt-4.1-mini"
         self.max_tries = 3
+        self.max_tokens = 300
 
-    def _format_message(self, history: str) -> list[dict]:
+    def _estimate_tokens(self, messages: list[dict]) -> int:
+        """Prompt estimate plus the completion budget, for the tokens/min bucket."""
+        return sum(estimate_tokens(m["content"]) for m in messages) + self.max_tokens
+
+    @staticmethod
+    def _retry_after(e: RateLimitError) -> float | None:
+        try:
+            return float(e.response.headers.get("retry-after"))
+        except (AttributeError, TypeError, ValueError):
+            return None
+
+    def _format_message(
+            self,
+            history: list,
+            kb_snippets: list[str] | None = None,
+            summary: str | None = None,
+            prefix: CompiledPrefix | None = None,
+    ) -> list[dict]:
         """
         history: [{ "role": "user"/"bot", "message": "..." }]
-        Converts history to OpenAI format and gets response.
+        kb_snippets: company KB entries relevant to the current turn.
+        summary: rolling summary of older turns that no longer fit in the context window.
+        prefix: precompiled system prefix for the company's KB version (system prompt only if None).
         """
+        if prefix is None:
+            prefix = prompt_assembler.prefix(None)
+        return prompt_assembler.build(prefix, history, kb_snippets, summary)
 
-        messages =[
-            {"role": "system", "content": settings.SYSTEM_PROMPT or "You are a friendly support bot. Answer clearly and politely."}
-        ]
-        for raw_item in history:
-            if isinstance(raw_item, str):
-                item = json.loads(raw_item)
+    async def generate_response(
+            self,
+            history: list,
+            kb_snippets: list[str] | None = None,
+            summary: str | None = None,
+            prefix: CompiledPrefix | None = None,
+    ):
+        messages = self._format_message(history, kb_snippets, summary, prefix)
+        est_tokens = self._estimate_tokens(messages)
+        attempt = 0
+        while attempt < self.max_tries:
+            async with self.limiter.slot(est_tokens) as outcome:
+                try:
+                    response = await self.client.chat.completions.create(
+                        model="gpt-4.1-mini",
+                        messages = messages,
+                        max_tokens = self.max_tokens,
+                        temperature = 0.7
+                    )
+                    usage = getattr(response, "usage", None)
+                    if usage is not None:
+                        outcome["used_tokens"] = usage.total_tokens
+                    return response.choices[0].message.content
+                except RateLimitError as e:
+                    # Backoff is shared through the limiter instead of a per-coroutine sleep
+                    outcome["rate_limited"] = True
+                    outcome["retry_after"] = self._retry_after(e)
+                    logger.warning(f"OpenAI rate limit error: {e}, retrying")
+                except APITimeoutError as e:
+                    logger.warning(f"OpenAI timeout error: {e}, retrying")
+                except APIError as e:
+                    logger.error(f"OpenAI API error: {e}")
+                    raise
+            attempt+=1
 
-            role = "assistant" if item["role"]=="bot" else "user"
-            messages.append({"role": role, "content": item["message"]})
-        return messages
+        raise RuntimeError("OpenAI request failed after retries")
 
-    async def generate_response(self, history: str):
-        messages = self._format_message(history)
+    async def generate_streaming_response(
+            self,
+            history: list,
+            kb_snippets: list[str] | None = None,
+            summary: str | None = None,
+            metrics: dict | None = None,
+            prefix: CompiledPrefix | None = None,
+    ) -> AsyncIterator[str]:
+        """
+        Yield reply deltas as they arrive.
+        Retries only happen before the first token; once text has been yielded
+        a failure is raised to the caller, since the partial reply is already out.
+        If `metrics` is given it is filled with ttft and total generation time (seconds).
+        The limiter slot is held until the generator finishes or is closed, so
+        consume it with contextlib.aclosing.
+        """
+        messages = self._format_message(history, kb_snippets, summary, prefix)
+        est_tokens = self._estimate_tokens(messages)
+        started = time.perf_counter()
         attempt = 0
         while attempt < self.max_tries:
-            try:
-                """full_reply = ""
-                async with self.client.chat.completions.stream(
-                    model = "gpt-4.1-mini",
-                    messages = messages
-                ) as stream:
-                    async for event in stream:
-                        if event.type == "content.delta":
-                            yield event.delta
-                            full_reply+=event.delta
-                        elif event.type == "content.done":
-                            return"""
-                            
-                response = await self.client.chat.completions.create(
-                    model="gpt-4.1-mini",
-                    messages = messages,
-                    max_tokens = 300,
-                    temperature = 0.7
-                )
-                return response.choices[0].message.content
-            except (RateLimitError, APITimeoutError) as e:
-                wait = 2 ** attempt
-                logger.warning(f"OpenAIrate/timeout error: {e}, retrying in {wait}s")
-                await asyncio.sleep(wait)
-                attempt+=1
-            except APIError as e:
-                logger.error(f"OpenAI API error: {e}")
-                raise
+            first_token = False
+            async with self.limiter.slot(est_tokens) as outcome:
+                try:
+                    stream = await self.client.chat.completions.create(
+                        model="gpt-4.1-mini",
+                        messages = messages,
+                        max_tokens = self.max_tokens,
+                        temperature = 0.7,
+                        stream = True
+                    )
+                    async for chunk in stream:
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if not delta:
+                            continue
+                        if not first_token:
+                            first_token = True
+                            if metrics is not None:
+                                metrics["ttft"] = time.perf_counter() - started
+                        yield delta
+
+                    if metrics is not None:
+                        metrics["total"] = time.perf_counter() - started
+                        metrics["attempts"] = attempt + 1
+                    return
+                except RateLimitError as e:
+                    if first_token:
+                        raise
+                    outcome["rate_limited"] = True
+                    outcome["retry_after"] = self._retry_after(e)
+                    logger.warning(f"OpenAI rate limit error: {e}, retrying")
+                except APITimeoutError as e:
+                    if first_token:
+                        raise
+                    logger.warning(f"OpenAI timeout error: {e}, retrying")
+                except APIError as e:
+                    logger.error(f"OpenAI API error: {e}")
+                    raise
+            attempt+=1
 
         raise RuntimeError("OpenAI request failed after retries")
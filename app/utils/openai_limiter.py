@@ -0,0 +1,193 @@
+"""
+Shared client-side admission control for OpenAI calls.
+
+Every call goes through one OpenAILimiter per worker:
+- token buckets for requests/min and tokens/min keep us under the provider quota
+- an AIMD in-flight limit backs off multiplicatively on 429s (and slow
+  responses) and grows additively while calls are healthy
+- a 429 pauses admission for everyone (Retry-After or a jittered backoff),
+  instead of each coroutine sleeping and retrying in lockstep
+- waiters queue FIFO with a deadline; a turn that cannot be admitted in time
+  fails fast with OpenAIOverloaded rather than piling up
+"""
+
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from app.core.config import settings
+from app.core.newrelic_logger import logger
+
+
+class OpenAIOverloaded(RuntimeError):
+    """Raised when a call cannot be admitted before its deadline."""
+
+
+class TokenBucket:
+    """
+    Refills at per_minute/60 per second. The burst is capped at `burst_seconds`
+    of refill, since providers enforce per-minute quotas over shorter windows too.
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float = 1.0):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds) if per_minute > 0 else 0
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+    def consume(self, amount: float) -> None:
+        """Take `amount` (may go negative when correcting for actual usage)."""
+        if not self.unlimited:
+            self._refill()
+            self.tokens -= amount
+
+
+class OpenAILimiter:
+    def __init__(
+            self,
+            requests_per_minute: int = settings.OPENAI_RPM,
+            tokens_per_minute: int = settings.OPENAI_TPM,
+            initial_limit: int = settings.OPENAI_MAX_IN_FLIGHT,
+            min_limit: int = 1,
+            max_limit: int = settings.OPENAI_MAX_IN_FLIGHT * 4,
+            target_latency: float = settings.OPENAI_TARGET_LATENCY,
+            queue_timeout: float = settings.OPENAI_QUEUE_TIMEOUT,
+            max_queue: int = settings.OPENAI_MAX_QUEUE,
+            base_backoff: float = 1.0,
+    ):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.base_backoff = base_backoff
+
+        self.in_flight = 0
+        self.queued = 0
+        self.paused_until = 0.0
+        self._gate = asyncio.Lock()        # FIFO admission order
+        self._slots = asyncio.Condition()  # in-flight limit
+
+        self.admitted = 0
+        self.rejected = 0
+        self.rate_limited = 0
+
+    async def acquire(self, est_tokens: int, timeout: Optional[float] = None) -> None:
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise OpenAIOverloaded(f"OpenAI queue full ({self.queued} waiting)")
+
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._admit(est_tokens), timeout or self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise OpenAIOverloaded("Timed out waiting for OpenAI capacity")
+        finally:
+            self.queued -= 1
+
+    async def _admit(self, est_tokens: int) -> None:
+        async with self._gate:
+            async with self._slots:
+                await self._slots.wait_for(lambda: self.in_flight < int(self.limit))
+                self.in_flight += 1
+            try:
+                while True:
+                    delay = max(
+                        self.paused_until - time.monotonic(),
+                        self.requests.wait_time(1),
+                        self.tokens.wait_time(est_tokens),
+                    )
+                    if delay <= 0:
+                        break
+                    await asyncio.sleep(delay)
+            except BaseException:
+                await self._free_slot()
+                raise
+            self.requests.consume(1)
+            self.tokens.consume(est_tokens)
+            self.admitted += 1
+
+    async def _free_slot(self) -> None:
+        async with self._slots:
+            self.in_flight -= 1
+            self._slots.notify_all()
+
+    async def release(
+            self,
+            latency: float,
+            rate_limited: bool = False,
+            retry_after: Optional[float] = None,
+            est_tokens: int = 0,
+            used_tokens: Optional[int] = None,
+    ) -> None:
+        if used_tokens is not None:
+            # Correct the token bucket with what the call actually cost
+            self.tokens.consume(used_tokens - est_tokens)
+
+        if rate_limited:
+            self.rate_limited += 1
+            self.limit = max(self.min_limit, self.limit / 2)
+            pause = retry_after if retry_after else self.base_backoff * random.uniform(0.5, 1.5)
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+            logger.warning(f"OpenAI rate limited: in-flight limit -> {int(self.limit)}, pausing {pause:.2f}s")
+        elif latency > self.target_latency:
+            self.limit = max(self.min_limit, self.limit * 0.9)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+        await self._free_slot()
+
+    @asynccontextmanager
+    async def slot(self, est_tokens: int, timeout: Optional[float] = None):
+        """
+        Hold one admitted call. The body should set `outcome["rate_limited"]`,
+        `outcome["retry_after"]` and `outcome["used_tokens"]` when known.
+        """
+        await self.acquire(est_tokens, timeout)
+        outcome: Dict = {}
+        started = time.monotonic()
+        try:
+            yield outcome
+        finally:
+            await self.release(
+                time.monotonic() - started,
+                rate_limited=outcome.get("rate_limited", False),
+                retry_after=outcome.get("retry_after"),
+                est_tokens=est_tokens,
+                used_tokens=outcome.get("used_tokens"),
+            )
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "rate_limited": self.rate_limited,
+        }
+
+
+openai_limiter = OpenAILimiter()
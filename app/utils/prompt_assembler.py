@@ -0,0 +1,111 @@
+"""
+Prompt assembly with a precompiled, byte-stable prefix.
+
+The prefix (system prompt, plus the whole company KB when it is small enough
+to inline) is compiled once per company and KB version and reused for every
+turn of every session. It depends only on the settings and the KB entries in
+upload order, so every worker produces the same bytes for the same version.
+
+Per turn only the suffix is appended, ordered from most to least stable:
+rolling summary, conversation history, then the KB snippets retrieved for the
+current question just before the latest user message. Turn N+1 therefore
+repeats turn N's messages up to its last answer, which lets the provider's
+prompt cache serve most of the prompt.
+"""
+
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from app.core.config import settings
+from app.utils.kb_cache import KBCache
+from app.utils.kb_retriever import estimate_tokens, kb_retriever
+
+DEFAULT_SYSTEM_PROMPT = "You are a friendly support bot. Answer clearly and politely."
+
+
+@dataclass(frozen=True)
+class CompiledPrefix:
+    company_id: Optional[str]
+    version: int
+    messages: Tuple[dict, ...]
+    tokens: int
+    # The full KB is in the prefix, so per-turn retrieval can be skipped
+    kb_inline: bool
+    digest: str
+
+
+class PromptAssembler:
+    def __init__(
+            self,
+            system_prompt: Optional[str] = None,
+            inline_kb_tokens: int = settings.KB_INLINE_TOKENS,
+            max_entries: int = settings.KB_CACHE_SIZE,
+    ):
+        self.system_prompt = system_prompt or settings.SYSTEM_PROMPT or DEFAULT_SYSTEM_PROMPT
+        self.inline_kb_tokens = inline_kb_tokens
+        self._cache = KBCache(max_entries=max_entries)
+        self.compiled = 0
+
+    def compile(self, company_id: Optional[str], version: int, entries: List[str], kb_tokens: Optional[int] = None) -> CompiledPrefix:
+        """Build the prefix for one KB version (uncached)."""
+        content = self.system_prompt
+        if kb_tokens is None:
+            kb_tokens = sum(estimate_tokens(e) for e in entries)
+        kb_inline = bool(entries) and kb_tokens <= self.inline_kb_tokens
+        if kb_inline:
+            content += "\n\nCompany knowledge base:\n" + "\n".join(entries)
+        messages = ({"role": "system", "content": content},)
+        digest = hashlib.sha256(json.dumps(messages, ensure_ascii=False, separators=(",", ":")).encode("utf-8")).hexdigest()
+        self.compiled += 1
+        return CompiledPrefix(company_id, version, messages, estimate_tokens(content), kb_inline, digest)
+
+    def prefix(self, company_id: Optional[str]) -> CompiledPrefix:
+        """Compiled prefix for the KB version currently loaded on this worker."""
+        index = kb_retriever.peek(company_id) if company_id else None
+        version = index.version if index is not None else 0
+        key = company_id or ""
+        compiled = self._cache.get(key, version)
+        if compiled is None:
+            if index is not None:
+                compiled = self.compile(company_id, version, index.entries, int(index.entry_tokens.sum()))
+            else:
+                compiled = self.compile(company_id, version, [])
+            self._cache.put(key, version, compiled)
+        return compiled
+
+    @staticmethod
+    def build(
+            prefix: CompiledPrefix,
+            history: List[dict],
+            kb_snippets: Optional[List[str]] = None,
+            summary: Optional[str] = None,
+    ) -> List[dict]:
+        """
+        prefix + summary + history, with the turn's KB snippets inserted before the
+        last user message. history: [{"role": "user"/"bot", "message": "..."}]
+        """
+        messages = list(prefix.messages)
+        if summary:
+            messages.append({"role": "system", "content": "Summary of the earlier conversation:\n" + summary})
+        for item in history:
+            if isinstance(item, str):
+                item = json.loads(item)
+            messages.append({
+                "role": "assistant" if item["role"] == "bot" else "user",
+                "content": item["message"],
+            })
+        if kb_snippets:
+            kb_message = {"role": "system", "content": "Relevant company knowledge base entries:\n" + "\n".join(kb_snippets)}
+            if len(messages) > len(prefix.messages) and messages[-1]["role"] == "user":
+                messages.insert(len(messages) - 1, kb_message)
+            else:
+                messages.append(kb_message)
+        return messages
+
+    def stats(self):
+        return {"compiled": self.compiled, **self._cache.stats()}
+
+
+prompt_assembler = PromptAssembler()
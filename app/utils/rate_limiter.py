@@ -0,0 +1,150 @@
+"""
+Load shedding for /ws/chat.
+
+- AdmissionControl caps the sessions one worker serves at once. Past the cap a
+  new connection is refused straight away with a "busy, retry in N s" frame
+  (jittered so a reconnect storm spreads out) instead of every session on the
+  worker getting slower.
+- RateLimiter is a token bucket per customer and per company kept in Redis, so
+  the limits hold across workers. One Lua call checks and takes from both
+  buckets, and only takes when both have a token; a throttled message is not
+  processed at all. When both limits apply, the customer bucket is keyed per
+  company and customer and tagged with the company id, so the script touches
+  a single cluster slot; with the company limit off customers are tagged by
+  their own id and spread over the cluster.
+"""
+
+import math
+import random
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.redis_client import hash_tag, redis_client
+
+# Take ARGV[1] tokens from every bucket, or from none if any is short.
+# KEYS[i] bucket hash {tokens, ts}; ARGV[2i] refill per ms, ARGV[2i+1] burst
+# Returns {1, 0, 0} when taken, else {0, ms until enough tokens, index of the limiting key}
+TAKE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local cost = tonumber(ARGV[1])
+local levels = {}
+local wait, limiting = 0, 0
+for i = 1, #KEYS do
+    local rate, burst = tonumber(ARGV[i * 2]), tonumber(ARGV[i * 2 + 1])
+    local state = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    levels[i] = tokens
+    if tokens < cost then
+        local needed = math.ceil((cost - tokens) / rate)
+        if needed > wait then wait, limiting = needed, i end
+    end
+end
+if wait > 0 then return {0, wait, limiting} end
+for i = 1, #KEYS do
+    local rate, burst = tonumber(ARGV[i * 2]), tonumber(ARGV[i * 2 + 1])
+    redis.call('HSET', KEYS[i], 'tokens', tostring(levels[i] - cost), 'ts', now)
+    redis.call('PEXPIRE', KEYS[i], math.ceil(burst / rate) + 1000)
+end
+return {1, 0, 0}
+"""
+
+
+class AdmissionControl:
+    def __init__(
+            self,
+            max_sessions: int = settings.MAX_SESSIONS_PER_WORKER,
+            retry_after: float = settings.ADMISSION_RETRY_AFTER,
+    ):
+        # 0 disables the cap
+        self.max_sessions = max_sessions
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    def try_admit(self) -> bool:
+        if self.max_sessions and self.in_flight >= self.max_sessions:
+            self.rejected += 1
+            return False
+        self.in_flight += 1
+        self.admitted += 1
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+
+    def retry_hint(self) -> int:
+        """Seconds a refused client should wait, jittered to spread reconnects."""
+        return math.ceil(self.retry_after * random.uniform(1, 2))
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "max_sessions": self.max_sessions,
+            "in_flight": self.in_flight,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+
+class RateLimiter:
+    PREFIX = "ratelimit:"
+
+    def __init__(
+            self,
+            customer_per_minute: float = settings.CUSTOMER_MESSAGES_PER_MINUTE,
+            customer_burst: float = settings.CUSTOMER_MESSAGE_BURST,
+            company_per_minute: float = settings.COMPANY_MESSAGES_PER_MINUTE,
+            company_burst: float = settings.COMPANY_MESSAGE_BURST,
+    ):
+        # scope -> (refill per ms, burst); a rate of 0 disables that scope
+        self.limits = {
+            "customer": (customer_per_minute / 60000, max(1.0, customer_burst)),
+            "company": (company_per_minute / 60000, max(1.0, company_burst)),
+        }
+        self._take = redis_client.register_script(TAKE_SCRIPT)
+        self.allowed = 0
+        self.throttled = 0
+
+    def bucket_key(self, scope: str, value: str, company_id: Optional[str] = None) -> str:
+        """With company_id, a customer bucket shares the company bucket's hash tag."""
+        if scope == "customer" and company_id:
+            return f"{self.PREFIX}{scope}:{hash_tag(company_id)}:{value}"
+        return f"{self.PREFIX}{scope}:{hash_tag(value)}"
+
+    async def take(self, customer_id: Optional[str], company_id: Optional[str]) -> Tuple[Optional[str], float]:
+        """
+        Spend one message from the customer's and the company's buckets.
+        Returns (None, 0) if allowed, else (throttled scope, seconds to wait).
+        """
+        scopes: List[str] = []
+        values: List[str] = []
+        args: List[float] = [1]
+        for scope, value in (("customer", customer_id), ("company", company_id)):
+            rate, burst = self.limits[scope]
+            if rate <= 0 or not value:
+                continue
+            scopes.append(scope)
+            values.append(value)
+            args.extend((rate, burst))
+        if not scopes:
+            return None, 0.0
+
+        tied_to = company_id if "company" in scopes else None
+        keys = [self.bucket_key(scope, value, tied_to) for scope, value in zip(scopes, values)]
+
+        taken, wait_ms, limiting = await self._take(keys=keys, args=args)
+        if int(taken):
+            self.allowed += 1
+            return None, 0.0
+        self.throttled += 1
+        return scopes[int(limiting) - 1], int(wait_ms) / 1000
+
+    def stats(self) -> Dict[str, int]:
+        return {"allowed": self.allowed, "throttled": self.throttled}
+
+
+admission_control = AdmissionControl()
+rate_limiter = RateLimiter()
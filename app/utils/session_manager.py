@@ -1,32 +1,160 @@
+import hashlib
+import math
+import os
+import secrets
+import socket
+import time
 import uuid
 #from loguru import logger
+from app.core.config import settings
 from app.core.newrelic_logger import logger
-from typing import Optional
-from app.core.redis_client import redis_client
+from typing import Dict, List, Optional
+from app.core.redis_client import hash_tag, redis_client
+
+# Identifies this process in lease values (host:pid)
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+REAPER_OWNER_PREFIX = "reaper:"
+
+# Resume with a session token: check it, refuse sessions being reaped, take the
+# lease (a live owner elsewhere loses it) and push the reap deadline out.
+# KEYS[1] session, KEYS[2] lease
+# ARGV[1] token hash, ARGV[2] owner, ARGV[3] lease ms, ARGV[4] deadline
+RESUME_SCRIPT = """
+local token = redis.call('HGET', KEYS[1], 'token_hash')
+if not token then return 'expired' end
+if token ~= ARGV[1] then return 'invalid' end
+local holder = redis.call('GET', KEYS[2])
+if holder and string.sub(holder, 1, 7) == 'reaper:' then return 'expired' end
+redis.call('SET', KEYS[2], ARGV[2], 'PX', ARGV[3])
+redis.call('HSET', KEYS[1], 'reap_at', ARGV[4])
+return 'ok'
+"""
+
+# Renew (ARGV[2] > 0) or release (ARGV[2] == 0) a lease we own, move the reap
+# deadline and refresh the TTL of the session's keys so they outlive it.
+# KEYS[1] lease, KEYS[2] session, KEYS[3..] other keys to keep alive
+# ARGV[1] owner, ARGV[2] lease ms, ARGV[3] key ttl, ARGV[4] deadline
+TOUCH_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then return 0 end
+if ARGV[2] == '0' then
+    redis.call('DEL', KEYS[1])
+else
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+if redis.call('EXISTS', KEYS[2]) == 1 then redis.call('HSET', KEYS[2], 'reap_at', ARGV[4]) end
+for i = 2, #KEYS do redis.call('EXPIRE', KEYS[i], ARGV[3]) end
+return 1
+"""
+
+# Claim a session whose deadline passed and which nobody holds, so exactly one
+# worker persists it. A session whose keys already expired is claimed too, so
+# the caller can clean up after it.
+# KEYS[1] lease, KEYS[2] session
+# ARGV[1] reaper owner, ARGV[2] lease ms, ARGV[3] now
+# Returns 1 when claimed, 0 while leased, else the (later) deadline as a string
+CLAIM_SCRIPT = """
+local deadline = redis.call('HGET', KEYS[2], 'reap_at')
+if deadline and tonumber(deadline) > tonumber(ARGV[3]) then return deadline end
+if redis.call('EXISTS', KEYS[1]) == 1 then return 0 end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+return 1
+"""
+
+
+class SessionLeaseLost(RuntimeError):
+    """The session was resumed on another connection; this one must stop driving it."""
+
+
+def new_owner() -> str:
+    return f"{WORKER_ID}:{uuid.uuid4().hex}"
+
+
+def _hash_token(secret: str) -> str:
+    return hashlib.sha256(secret.encode("utf-8")).hexdigest()
+
 
 class SessionManager:
-    """Manages customer chat sessions stored in Redis."""
+    """
+    Manages customer chat sessions stored in Redis.
+
+    A connected socket holds the session's lease (LEASE_PREFIX, a short PX key
+    renewed while connected). The session hash's reap_at field is the time
+    after which the session may be reaped; it is pushed forward on every
+    renewal, and set to now + SESSION_RESUME_GRACE when a resumable client
+    disconnects. A client that reconnects with its token within the grace
+    period takes the lease back; otherwise SessionReaper claims the session and
+    persists the transcript.
+
+    Every key of a session carries the session id as a hash tag, so the
+    scripts only touch one cluster slot. DEADLINES_KEY, a zset of session ids
+    scored by reap_at, is how the reaper finds due sessions; it is updated
+    after each script and is only an index: claim_expired() checks reap_at
+    itself and corrects the score of a session that is not due yet.
+    """
 
     SESSION_PREFIX = "session:"
+    LEASE_PREFIX = "session_lease:"
+    DEADLINES_KEY = "session:deadlines"
     EXPIRY_SECONDS = 300    # 5 minutes
-    
-    async def create_session(self, customer_id: str|None = None) -> dict:
+    REAP_MARGIN_SECONDS = 60    # after the deadline, for the reaper to claim and persist the session
+
+    def __init__(self):
+        self._resume = redis_client.register_script(RESUME_SCRIPT)
+        self._touch_lease = redis_client.register_script(TOUCH_LEASE_SCRIPT)
+        self._claim = redis_client.register_script(CLAIM_SCRIPT)
+        self.lease_ms = int(settings.SESSION_LEASE_SECONDS * 1000)
+
+    @classmethod
+    def session_key(cls, session_id: str) -> str:
+        return f"{cls.SESSION_PREFIX}{hash_tag(session_id)}"
+
+    @classmethod
+    def lease_key(cls, session_id: str) -> str:
+        return f"{cls.LEASE_PREFIX}{hash_tag(session_id)}"
+
+    def _deadline(self, grace: float) -> float:
+        return time.time() + grace
+
+    @classmethod
+    def key_ttl(cls, grace: float) -> int:
+        """TTL for a session's keys: EXPIRY_SECONDS, or longer so they outlive a reap deadline `grace` away."""
+        return max(cls.EXPIRY_SECONDS, math.ceil(grace + settings.SESSION_REAPER_INTERVAL + cls.REAP_MARGIN_SECONDS))
+
+    async def create_session(
+            self,
+            customer_id: str|None = None,
+            metadata: Optional[Dict[str, str]] = None,
+            owner: Optional[str] = None,
+    ) -> dict:
         """
         Create a new session for the given customer_id.
-        Returns session metadata as a dict.
+        metadata is stored on the session hash (needed to persist the session
+        if it is reaped by another worker). With an owner the lease is taken
+        in the same transaction.
+        Returns session metadata as a dict, including the resume token.
         """
 
         try:
             session_id = str(uuid.uuid4())
-            key = f"{self.SESSION_PREFIX}{session_id}"
+            key = self.session_key(session_id)
+            secret = secrets.token_urlsafe(24)
+            mapping = {"customer_id": customer_id, "token_hash": _hash_token(secret), **(metadata or {})}
+            grace = self.lease_ms / 1000 + settings.SESSION_RESUME_GRACE
+            deadline = self._deadline(grace) if owner else None
 
-            await redis_client.hset(key, mapping={"customer_id": customer_id})
-            await redis_client.expire(key, self.EXPIRY_SECONDS)
+            async with redis_client.pipeline(transaction=True) as pipe:
+                pipe.hset(key, mapping={k: v for k, v in {**mapping, "reap_at": deadline}.items() if v is not None})
+                pipe.expire(key, self.key_ttl(grace) if owner else self.EXPIRY_SECONDS)
+                if owner:
+                    pipe.set(self.lease_key(session_id), owner, px=self.lease_ms)
+                await pipe.execute()
+            if owner:
+                await self._index(session_id, deadline)
 
             log = logger.bind(session_id=session_id, customer_id=customer_id)
             log.info("Created new session")
 
-            return {"session_id": session_id, "customer_id": customer_id}
+            return {"session_id": session_id, "customer_id": customer_id, "token": f"{session_id}.{secret}"}
         except Exception as e:
             logger.bind(customer_id=customer_id).error(f"Failed to create session: {e}")
             raise
@@ -35,7 +163,7 @@ class SessionManager:
     async def get_customer_id(self, session_id: str) -> str|None:
         """Retrieve the customer_id for a given session_id."""
         
-        key = f"{self.SESSION_PREFIX}{session_id}"
+        key = self.session_key(session_id)
         try:
             customer_id = await redis_client.hget(key, "customer_id")
             if customer_id:
@@ -47,13 +175,89 @@ class SessionManager:
             logger.bind(session_id=session_id).error(f"Failed to get customer id: {e}")
             return None
     
+    async def get_session(self, session_id: str) -> Dict[str, str]:
+        """Session hash (customer_id, company_id, ...), empty if expired."""
+        return await redis_client.hgetall(self.session_key(session_id))
+
+    async def resume_session(self, token: str, owner: str) -> tuple[str, Optional[str]]:
+        """
+        Take over a session from its resume token.
+        Returns ("ok", session_id), or ("invalid" | "expired", session_id or None).
+        """
+        session_id, _, secret = token.partition(".")
+        if not session_id or not secret:
+            return "invalid", None
+        deadline = self._deadline(self.lease_ms / 1000 + settings.SESSION_RESUME_GRACE)
+        status = await self._resume(
+            keys=[self.session_key(session_id), self.lease_key(session_id)],
+            args=[_hash_token(secret), owner, self.lease_ms, deadline],
+        )
+        if status == "ok":
+            await self._index(session_id, deadline)
+        logger.bind(session_id=session_id).info(f"Resume attempt: {status}")
+        return status, session_id
+
+    async def renew_lease(self, session_id: str, owner: str, keep_alive: List[str] = ()) -> bool:
+        """Extend our lease; False if it was taken over or expired."""
+        grace = self.lease_ms / 1000 + settings.SESSION_RESUME_GRACE
+        deadline = self._deadline(grace)
+        renewed = bool(await self._touch_lease(
+            keys=[self.lease_key(session_id), self.session_key(session_id), *keep_alive],
+            args=[owner, self.lease_ms, self.key_ttl(grace), deadline],
+        ))
+        if renewed:
+            await self._index(session_id, deadline)
+        return renewed
+
+    async def detach(self, session_id: str, owner: str, keep_alive: List[str] = ()) -> bool:
+        """
+        Release our lease on disconnect and leave the session resumable for
+        SESSION_RESUME_GRACE seconds. The session and keep_alive keys get a
+        fresh TTL so they outlive the grace period and the reaper's run after it.
+        """
+        deadline = self._deadline(settings.SESSION_RESUME_GRACE)
+        released = bool(await self._touch_lease(
+            keys=[self.lease_key(session_id), self.session_key(session_id), *keep_alive],
+            args=[owner, 0, self.key_ttl(settings.SESSION_RESUME_GRACE), deadline],
+        ))
+        if released:
+            await self._index(session_id, deadline)
+        logger.bind(session_id=session_id).info("Detached session" if released else "Detach skipped, lease not held")
+        return released
+
+    async def _index(self, session_id: str, deadline: float) -> None:
+        """Record the reap deadline in DEADLINES_KEY (a separate slot, so not part of the scripts)."""
+        await redis_client.zadd(self.DEADLINES_KEY, {session_id: deadline})
+
+    async def due_sessions(self, limit: int = 100) -> List[str]:
+        """Sessions whose indexed reap deadline has passed (they may still be leased, or not due after all)."""
+        return await redis_client.zrangebyscore(self.DEADLINES_KEY, "-inf", time.time(), start=0, num=limit)
+
+    async def claim_expired(self, session_id: str, owner: str, lease_seconds: float = 60) -> bool:
+        """Atomically claim a due, unleased session for reaping."""
+        result = await self._claim(
+            keys=[self.lease_key(session_id), self.session_key(session_id)],
+            args=[owner, int(lease_seconds * 1000), time.time()],
+        )
+        if isinstance(result, int):
+            if result:
+                await redis_client.zrem(self.DEADLINES_KEY, session_id)
+            return bool(result)
+        # The index was behind (a renewal's update lost or overtaken): move it to the real deadline
+        await self._index(session_id, float(result))
+        return False
+
     async def end_session(self, session_id: str) -> bool:
-        """End a session and remove it from Redis."""
+        """End a session and remove it (with its lease and deadline) from Redis."""
 
-        key = f"{self.SESSION_PREFIX}{session_id}"
+        key = self.session_key(session_id)
 
         try:
-            result = await redis_client.delete(key)
+            async with redis_client.pipeline(transaction=True) as pipe:
+                pipe.delete(key)
+                pipe.delete(self.lease_key(session_id))
+                result = (await pipe.execute())[0]
+            await redis_client.zrem(self.DEADLINES_KEY, session_id)
             log = logger.bind(session_id=session_id)
 
             if result:
@@ -68,7 +272,7 @@ class SessionManager:
     async def refresh_session(self, session_id: str) -> bool:
         """Refresh TTL of an active session."""
 
-        key = f"{self.SESSION_PREFIX}{session_id}"
+        key = self.session_key(session_id)
 
         try:
             result = await redis_client.expire(key, self.EXPIRY_SECONDS)
@@ -0,0 +1,127 @@
+"""
+Persistence and cleanup of finished chat sessions.
+
+finalize() saves the transcript and removes the session's Redis state. The
+websocket calls it directly when a session ends on the server side (inactivity
+timeout, non-resumable client). Resumable clients that disconnect are only
+detached; SessionReaper.run() (one task per worker, started in main.lifespan)
+periodically claims sessions whose resume grace expired without a reconnect,
+or whose owner stopped renewing its lease (a crashed worker), and finalizes
+them from what is in Redis. The claim is atomic, so each session is persisted
+by exactly one worker.
+"""
+
+import asyncio
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from app.core.config import settings
+from app.core.metrics import company_label, timed
+from app.core.newrelic_logger import logger
+from app.utils.context_codec import message_time
+from app.utils.context_manager import ContextManager
+from app.utils.context_policy import ContextPolicy
+from app.utils.conversation_manager import ConversationManager
+from app.utils.session_manager import REAPER_OWNER_PREFIX, WORKER_ID, SessionManager
+
+
+class SessionReaper:
+    def __init__(self, interval: float = settings.SESSION_REAPER_INTERVAL):
+        self.interval = interval
+        self.owner = f"{REAPER_OWNER_PREFIX}{WORKER_ID}"
+        self.sessions = SessionManager()
+        self.context = ContextManager()
+        self.policy = ContextPolicy()
+        self.conversations = ConversationManager()
+        self.reaped = 0
+        self.failed = 0
+
+    def keep_alive_keys(self, session_id: str) -> List[str]:
+        """Keys besides the session hash that must live as long as the session."""
+        return [self.context.context_key(session_id), ContextPolicy.summary_key(session_id)]
+
+    async def finalize(
+            self,
+            session_id: str,
+            meta: Dict[str, str],
+            messages: List[Dict],
+            end_time: Optional[datetime] = None,
+    ) -> Optional[str]:
+        """
+        Persist the transcript and delete the session's Redis keys.
+        meta: company_id, customer_id, phone_number, start_time (ISO).
+        Returns the conversation_id, or None if persisting failed.
+        """
+        company_id = meta.get("company_id")
+        company = company_label(company_id)
+        log = logger.bind(session_id=session_id, customer_id=meta.get("customer_id"))
+        conversation_id = None
+        try:
+            end_time = end_time or datetime.now(timezone.utc)
+            start = meta.get("start_time")
+            start_time = datetime.fromisoformat(start) if start else end_time
+            messages_for_save = []
+            for item in messages:
+                messages_for_save.append({
+                    "role": item.get("role", "user"),
+                    "message": item.get("message", ""),
+                    "timestamp": message_time(item)
+                })
+
+            with timed("transcript_save", "mongo", company):
+                conversation_id = await self.conversations.save_conversation(
+                    company_id=company_id,
+                    customer_id=meta.get("customer_id"),
+                    session_id=session_id,
+                    phone_number=meta.get("phone_number"),
+                    messages=messages_for_save,
+                    start_time=start_time,
+                    end_time=end_time,
+                )
+            log.bind(conversation_id=conversation_id).info("Conversation persisted")
+        except Exception as e:
+            log.error(f"Failed to persist conversation: {e}")
+
+        with timed("session_end", "redis", company):
+            await self.sessions.end_session(session_id)
+            await self.context.clear_history(session_id)
+            await self.policy.clear(session_id)
+        return conversation_id
+
+    async def reap_once(self) -> int:
+        """Finalize every due session this worker manages to claim. Returns how many."""
+        reaped = 0
+        for session_id in await self.sessions.due_sessions():
+            if not await self.sessions.claim_expired(session_id, self.owner):
+                continue
+            try:
+                meta = await self.sessions.get_session(session_id)
+                if not meta:
+                    # Keys expired before we got to it; nothing left to persist
+                    logger.bind(session_id=session_id).warning("Reaped session had already expired from Redis")
+                    await self.sessions.end_session(session_id)
+                    continue
+                messages = await self.context.session_history(session_id).load()
+                await self.finalize(session_id, meta, messages)
+                reaped += 1
+                self.reaped += 1
+            except Exception as e:
+                self.failed += 1
+                logger.bind(session_id=session_id).error(f"Failed to reap session: {e}")
+        return reaped
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.reap_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Session reaper pass failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> Dict[str, int]:
+        return {"reaped": self.reaped, "failed": self.failed}
+
+
+session_reaper = SessionReaper()
@@ -0,0 +1,178 @@
+"""
+Warm-up after a deploy, and the readiness/health checks built on it.
+
+Warmup.run() is started as a background task by main.lifespan once MongoDB
+is initialized. It:
+- opens WARMUP_REDIS_CONNECTIONS connections in each Redis client's pool and
+  MONGO_MIN_POOL_SIZE in Motor's (concurrent PINGs; each in-flight command
+  needs its own pooled connection)
+- loads the retrieval index and compiled prompt prefix of the
+  WARMUP_KB_COMPANIES most active companies (by sessions over the last week in
+  the analytics rollups, else any companies with a KB)
+- opens WARMUP_LLM_CONNECTIONS keep-alive connections to the LLM endpoint
+  with a cheap models.list() call (the fake client in tests just answers)
+
+/ready reports 503 until the run finished and the Redis and Mongo steps
+succeeded (failed ones are retried every WARMUP_RETRY_INTERVAL), and while
+either is unreachable. KB and LLM failures are logged and reported but do not
+hold a worker out of rotation. /health pings Redis and Mongo on every call.
+"""
+
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import app.core.mongodb_client as mongo_client
+import app.core.redis_client as redis_module
+from app.core.config import settings
+from app.core.newrelic_logger import logger
+from app.utils.company_kb_manager import CompanyKBManager
+
+# Steps a worker cannot serve without
+REQUIRED_STEPS = ("redis", "mongo")
+
+
+async def ping_redis() -> None:
+    await redis_module.redis_client.ping()
+
+
+async def ping_mongo() -> None:
+    if mongo_client.db is None:
+        raise RuntimeError("MongoDB not initialized yet")
+    await mongo_client.db.command("ping")
+
+
+async def dependency_status(timeout: float = settings.HEALTH_CHECK_TIMEOUT) -> Dict[str, str]:
+    """{"redis": "ok" | error, "mongo": "ok" | error}, checked concurrently."""
+    async def check(ping) -> str:
+        try:
+            await asyncio.wait_for(ping(), timeout)
+            return "ok"
+        except asyncio.TimeoutError:
+            return f"timed out after {timeout}s"
+        except Exception as e:
+            return f"error: {e}"
+
+    redis_status, mongo_status = await asyncio.gather(check(ping_redis), check(ping_mongo))
+    return {"redis": redis_status, "mongo": mongo_status}
+
+
+class Warmup:
+    def __init__(
+            self,
+            redis_connections: int = settings.WARMUP_REDIS_CONNECTIONS,
+            mongo_connections: int = settings.MONGO_MIN_POOL_SIZE,
+            kb_companies: int = settings.WARMUP_KB_COMPANIES,
+            llm_connections: int = settings.WARMUP_LLM_CONNECTIONS,
+            timeout: float = settings.WARMUP_TIMEOUT,
+            retry_interval: float = settings.WARMUP_RETRY_INTERVAL,
+    ):
+        self.redis_connections = redis_connections
+        self.mongo_connections = mongo_connections
+        self.kb_companies = kb_companies
+        self.llm_connections = llm_connections
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.kb_manager = CompanyKBManager()
+        self.done = False
+        # step -> {"seconds": ..., "error": ...}
+        self.steps: Dict[str, Dict] = {}
+        self.seconds: Optional[float] = None
+        self.companies: List[str] = []
+
+    @property
+    def ready(self) -> bool:
+        return self.done and all(
+            step in self.steps and "error" not in self.steps[step] for step in REQUIRED_STEPS
+        )
+
+    async def _step(self, name: str, coro) -> None:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(coro, self.timeout)
+            self.steps[name] = {"seconds": round(time.perf_counter() - started, 3)}
+        except Exception as e:
+            self.steps[name] = {"seconds": round(time.perf_counter() - started, 3), "error": str(e) or type(e).__name__}
+            logger.warning(f"Warm-up step {name} failed: {e!r}")
+
+    async def prime_redis(self) -> None:
+        for client in (redis_module.redis_client, redis_module.redis_binary_client):
+            await asyncio.gather(*(client.ping() for _ in range(self.redis_connections)))
+
+    async def prime_mongo(self) -> None:
+        await asyncio.gather(*(ping_mongo() for _ in range(max(1, self.mongo_connections))))
+
+    async def active_companies(self) -> List[str]:
+        """Companies with the most sessions over the last 7 days, else any with a KB."""
+        # Imported here: the analytics module pulls in pandas, which the app otherwise doesn't need at startup
+        from app.utils.conversation_analytics import ConversationAnalytics
+        since = (datetime.now(timezone.utc) - timedelta(days=7)).strftime("%Y-%m-%d")
+        rollups = mongo_client.db[ConversationAnalytics.DAILY]
+        companies = [
+            doc["_id"] async for doc in rollups.aggregate([
+                {"$match": {"day": {"$gte": since}}},
+                {"$group": {"_id": "$company_id", "sessions": {"$sum": "$sessions"}}},
+                {"$sort": {"sessions": -1}},
+                {"$limit": self.kb_companies},
+            ])
+        ]
+        if not companies:
+            companies = [doc["_id"] async for doc in self.kb_manager.collection.find({}, {"_id": 1}).limit(self.kb_companies)]
+        return companies
+
+    async def preload_kbs(self) -> None:
+        if self.kb_companies <= 0:
+            return
+        self.companies = await self.active_companies()
+        for company_id in self.companies:
+            # One at a time: index builds run in threads and compete with live traffic
+            await self.kb_manager.prompt_prefix(company_id)
+
+    async def prime_llm(self, client) -> None:
+        models = getattr(client, "models", None)
+        if models is None or self.llm_connections <= 0:
+            return
+        await asyncio.gather(*(models.list() for _ in range(self.llm_connections)))
+
+    async def run(self, llm_client=None) -> None:
+        started = time.perf_counter()
+        await asyncio.gather(
+            self._step("redis", self.prime_redis()),
+            self._step("mongo", self.prime_mongo()),
+            self._step("llm", self.prime_llm(llm_client)),
+        )
+        await self._step("kb", self.preload_kbs())
+        self.seconds = round(time.perf_counter() - started, 3)
+        self.done = True
+        log = logger.bind(warmup_seconds=self.seconds)
+        if self.ready:
+            log.info(f"Warm-up done in {self.seconds}s, {len(self.companies)} KBs preloaded")
+            return
+
+        log.error(f"Warm-up finished without required dependencies: {self.steps}")
+        while not self.ready:
+            await asyncio.sleep(self.retry_interval)
+            await asyncio.gather(*(
+                self._step(name, getattr(self, f"prime_{name}")())
+                for name in REQUIRED_STEPS if "error" in self.steps[name]
+            ))
+        logger.info("Required dependencies reachable, worker ready")
+
+    def report(self) -> Dict:
+        return {
+            "ready": self.ready,
+            "done": self.done,
+            "seconds": self.seconds,
+            "steps": self.steps,
+            "kb_companies": self.companies,
+        }
+
+    def stats(self) -> Dict[str, float]:
+        stats = {"ready": int(self.ready), "seconds": self.seconds or 0}
+        for name, step in self.steps.items():
+            stats[f"{name}_seconds"] = step["seconds"]
+        return stats
+
+
+warmup = Warmup()
@@ -0,0 +1,58 @@
+"""
+Move old conversation transcripts from MongoDB to the Parquet archive.
+
+Run periodically (cron, a k8s CronJob, ...) from one place; each run archives
+everything created more than --older-than-days ago and leaves stubs in Mongo.
+Files go to ARCHIVE_PATH, which must be the same path the app reads from.
+See app/utils/conversation_archive.py for the layout and the read path.
+
+Usage:
+    python archive_conversations.py --older-than-days 90
+    python archive_conversations.py --dry-run     # just count what would move
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+
+def parse_args():
+    from app.core.config import settings
+    p = argparse.ArgumentParser(description="Archive old conversations to Parquet")
+    p.add_argument("--older-than-days", type=float, default=settings.ARCHIVE_AFTER_DAYS)
+    p.add_argument("--batch-size", type=int, default=5000)
+    p.add_argument("--dry-run", action="store_true")
+    return p.parse_args()
+
+
+async def main(args) -> dict:
+    import app.core.mongodb_client as mongo_client
+    from app.core.mongodb_init import init_mongodb
+    from app.core.config import settings
+    from app.utils.conversation_archive import archive_size, conversation_archive, tier_conversations
+    from app.utils.conversation_manager import ConversationManager
+
+    await init_mongodb()
+    collection = ConversationManager().collection
+    if args.dry_run:
+        cutoff = datetime.now(timezone.utc) - timedelta(days=args.older_than_days)
+        count = await collection.count_documents({"created_at": {"$lt": cutoff}, "archived": {"$ne": True}})
+        return {"would_archive": count}
+
+    started = time.perf_counter()
+    result = await tier_conversations(
+        collection,
+        archive=conversation_archive,
+        older_than_days=args.older_than_days,
+        batch_size=args.batch_size,
+    )
+    result["seconds"] = round(time.perf_counter() - started, 2)
+    result["archive_bytes"] = archive_size(settings.ARCHIVE_PATH)
+    await mongo_client.close_mongodb_connection()
+    return result
+
+
+if __name__ == "__main__":
+    print(json.dumps(asyncio.run(main(parse_args())), indent=2))
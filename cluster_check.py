@@ -0,0 +1,178 @@
+"""
+Check the Redis-backed session, KB and rate-limit paths against Redis Cluster.
+
+Every multi-key script must only touch keys in one hash slot, or the cluster
+refuses it with CROSSSLOT. This runs each of them on a real cluster
+(MongoDB and the LLM are the loadtest.py stand-ins) with short lease and grace
+periods, so a whole session lifecycle takes about a second:
+
+  session_one_slot  every key of a new session maps to the same slot (the
+                    session:deadlines index is separate by design)
+  history_append    SessionHistory appends (COMMIT_TURN_SCRIPT with the lease)
+  lease_takeover    a resume takes the lease; the old owner can't renew
+  reindex           a stale deadline index is corrected by claim_expired
+  detach_ttl        detach leaves the keys alive past the reap deadline
+  reap              the reaper claims the detached session and removes its keys
+  reap_expired      a session whose keys already expired leaves the index
+  rate_limit        customer and company buckets (CUSTOMER_MESSAGE_BURST=2)
+  kb_upload         concurrent uploads under the commit lock: distinct
+                    versions, the last commit live, the lock released
+  kb_invalidation   a commit's invalidation is published and reaches the
+                    kb:invalidate listener, which drops the cached index
+  redis_ping        /health's Redis check and warm-up's connection priming
+
+The check flushes the cluster first, so point it at a scratch cluster.
+Exits non-zero if any case fails.
+
+Usage:
+    for port in 7000 7001 7002; do mkdir -p /tmp/rc/$port && (cd /tmp/rc/$port && redis-server --port $port --cluster-enabled yes --daemonize yes); done
+    redis-cli --cluster create 127.0.0.1:7000 127.0.0.1:7001 127.0.0.1:7002 --cluster-replicas 0 --cluster-yes
+    python cluster_check.py --redis-url redis://127.0.0.1:7000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Session, KB and rate-limit scripts on Redis Cluster")
+    p.add_argument("--redis-url", default="redis://127.0.0.1:7000", help="any node of a scratch cluster")
+    args = p.parse_args()
+    # Fields loadtest.configure_env / install_stand_ins expect
+    args.redis_cluster = True
+    args.mongo_uri = None
+    args.redis_latency = 0.0
+    args.llm_latency, args.llm_jitter, args.llm_dist, args.llm_token_delay = 0.0, 0.0, "uniform", 0.0
+    args.stream, args.openai_rpm, args.max_sessions, args.customer_rpm = False, 0, None, None
+    args.verbose = False
+    return args
+
+
+async def main(args) -> dict:
+    from loadtest import install_stand_ins
+
+    install_stand_ins(args)
+    from redis.asyncio.cluster import RedisCluster
+
+    from app.core.redis_client import redis_client as r
+    from app.utils.company_kb_manager import CompanyKBManager
+    from app.utils.kb_retriever import kb_retriever
+    from app.utils.context_manager import ContextManager
+    from app.utils.rate_limiter import RateLimiter
+    from app.utils.session_manager import SessionManager, new_owner
+    from app.utils.session_reaper import SessionReaper
+    from app.utils.warmup import Warmup, dependency_status
+
+    if not isinstance(r, RedisCluster):
+        raise SystemExit("REDIS_CLUSTER=1 did not give a cluster client")
+    await r.flushall()
+
+    cases = {}
+
+    def case(name: str, ok: bool, **details):
+        cases[name] = {"ok": bool(ok), **details}
+
+    async def keys(pattern: str = "*"):
+        return sorted([k async for k in r.scan_iter(match=pattern)])
+
+    sessions, contexts, reaper = SessionManager(), ContextManager(), SessionReaper()
+    owner = new_owner()
+    created = await sessions.create_session("cust-1", {"company_id": "co-1", "start_time": "2026-01-01T00:00:00+00:00"}, owner=owner)
+    session_id = created["session_id"]
+    history = contexts.session_history(session_id, owner)
+    await history.append("user", "Hi")
+    await history.append("bot", "Hello")
+    # session:deadlines is the reaper's index, on its own slot by design
+    session_keys = await keys(f"*{session_id}*")
+    case("session_one_slot", len({r.keyslot(k) for k in session_keys}) == 1, keys=session_keys)
+    case("history_append", [m["message"] for m in await history.load()] == ["Hi", "Hello"], reloads=history.reloads)
+
+    renewed = await sessions.renew_lease(session_id, owner, reaper.keep_alive_keys(session_id))
+    new = new_owner()
+    status, _ = await sessions.resume_session(created["token"], new)
+    case("lease_takeover", renewed and status == "ok" and not await sessions.renew_lease(session_id, owner), resume=status)
+
+    await r.zadd(sessions.DEADLINES_KEY, {session_id: 1})
+    claimed = await sessions.claim_expired(session_id, "reaper:check")
+    case("reindex", not claimed and await r.zscore(sessions.DEADLINES_KEY, session_id) > time.time())
+
+    detached = await sessions.detach(session_id, new, reaper.keep_alive_keys(session_id))
+    ttl = await r.ttl(sessions.session_key(session_id))
+    case("detach_ttl", detached and ttl >= sessions.key_ttl(float(os.environ["SESSION_RESUME_GRACE"])) - 1, ttl=ttl)
+
+    await asyncio.sleep(float(os.environ["SESSION_RESUME_GRACE"]) + 0.1)
+    reaped = await reaper.reap_once()
+    left = await keys(f"*{session_id}*")
+    case("reap", reaped == 1 and not left, reaped=reaped, keys_left=left)
+
+    expired = (await sessions.create_session("cust-2", {"company_id": "co-1"}, owner=owner))["session_id"]
+    await r.delete(sessions.session_key(expired), sessions.lease_key(expired))
+    await r.zadd(sessions.DEADLINES_KEY, {expired: 1})
+    reaped = await reaper.reap_once()
+    case("reap_expired", await r.zscore(sessions.DEADLINES_KEY, expired) is None, reaped=reaped)
+
+    limiter = RateLimiter()
+    customer = [(await limiter.take("cust-1", "co-1"))[0] for _ in range(3)]
+    other = [(await limiter.take("cust-2", "co-1"))[0] for _ in range(2)]
+    case("rate_limit", customer == [None, None, "customer"] and other[0] is None, customer=customer, other_customer=other)
+
+    kb = CompanyKBManager()
+    ingests = [kb.start_ingest("co-1") for _ in range(3)]
+    for n, ingest in enumerate(ingests):
+        await ingest.add([f"Upload {n} entry {k}" for k in range(3)])
+    versions = sorted(await asyncio.gather(*(ingest.commit() for ingest in ingests)))
+    doc = await kb.collection.find_one({"_id": "co-1"})
+    live = await r.lrange(kb.redis_key("co-1"), 0, -1)
+    winner = next(n for n, ingest in enumerate(ingests) if ingest.upload_id == doc["upload_id"])
+    case(
+        "kb_upload",
+        versions == [1, 2, 3] and live == [f"Upload {winner} entry {k}" for k in range(3)]
+        and await r.exists(kb.commit_lock_key("co-1")) == 0,
+        versions=versions, kb_keys=await keys("kb:*"),
+    )
+
+    listener = asyncio.create_task(kb.listen_for_invalidations())
+    await kb.load_index("co-1")
+    cached = kb_retriever.peek("co-1") is not None
+    # Give the listener time to subscribe before the commit publishes
+    await asyncio.sleep(0.2)
+    ingest = kb.start_ingest("co-1")
+    await ingest.add(["Invalidation entry"])
+    version = await ingest.commit()
+    deadline = time.monotonic() + 2
+    while kb_retriever.peek("co-1") is not None and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    listener.cancel()
+    case("kb_invalidation", cached and kb_retriever.peek("co-1") is None, version=version)
+
+    health = await dependency_status()
+    await Warmup(kb_companies=0, llm_connections=0).prime_redis()
+    case("redis_ping", health["redis"] == "ok", health=health)
+
+    await r.flushall()
+    return {"redis_url": args.redis_url, "cases": cases}
+
+
+if __name__ == "__main__":
+    from loadtest import configure_env
+
+    args = parse_args()
+    # Short leases and grace so the lifecycle fits in a second; tight buckets for the rate-limit case
+    os.environ.update(
+        SESSION_LEASE_SECONDS="0.3", SESSION_RESUME_GRACE="0.2",
+        CUSTOMER_MESSAGES_PER_MINUTE="60", CUSTOMER_MESSAGE_BURST="2",
+        COMPANY_MESSAGES_PER_MINUTE="600", COMPANY_MESSAGE_BURST="3",
+    )
+    with tempfile.TemporaryDirectory() as spool_dir:
+        configure_env(args, spool_dir)
+        report = asyncio.run(main(args))
+    print(json.dumps(report, indent=2))
+    failed = [name for name, result in report["cases"].items() if not result["ok"]]
+    if failed:
+        print(f"Failed: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,124 @@
+"""
+Size, Redis memory and speed of the context message encodings
+(app/utils/context_codec.py): v1 double-encoded JSON vs v2 msgpack.
+
+Builds --messages synthetic chat messages (alternating user/bot, 20-400
+characters, current timestamps) and, per CONTEXT_ENCODING value, reports:
+
+  bytes_per_msg   encoded value size
+  encode_per_s    context_codec.encode throughput
+  decode_per_s    context_codec.decode throughput
+  redis           with a reachable --redis-url: the messages written as context
+                  lists of --per-session entries, MEMORY USAGE summed over the
+                  lists (and the used_memory delta), scaled to 1M messages
+
+The lists live under codec_bench:* keys and are deleted afterwards.
+
+Usage:
+    redis-server --port 6379 --daemonize yes
+    python codec_bench.py --messages 100000 --redis-url redis://localhost:6379
+"""
+
+import argparse
+import json
+import random
+import time
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Context codec size, Redis memory and throughput")
+    p.add_argument("--messages", type=int, default=100000)
+    p.add_argument("--per-session", type=int, default=20, help="messages per context list")
+    p.add_argument("--redis-url", default="redis://localhost:6379", help="'' to skip the Redis measurement")
+    p.add_argument("--seed", type=int, default=0)
+    return p.parse_args()
+
+
+WORDS = (
+    "order refund delivery tracking number address payment card invoice account password return "
+    "warranty damaged missing late size colour discount code store pickup shipping international "
+    "the a my your is was when can how what please thanks hello we you I it to for of and"
+).split()
+
+
+def synthetic_messages(count: int, seed: int):
+    from app.utils.context_codec import new_message
+
+    rng = random.Random(seed)
+    messages = []
+    for n in range(count):
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 70)))[:400]
+        messages.append(new_message("user" if n % 2 == 0 else "bot", text[0].upper() + text[1:] + "."))
+    return messages
+
+
+def throughput(fn, items) -> int:
+    started = time.perf_counter()
+    for item in items:
+        fn(item)
+    return round(len(items) / (time.perf_counter() - started))
+
+
+def redis_memory(client, fmt: str, encoded, per_session: int) -> dict:
+    prefix = f"codec_bench:{fmt}:"
+    client.delete(*client.keys(prefix + "*") or [prefix])
+    before = client.info("memory")["used_memory"]
+    keys = []
+    pipe = client.pipeline(transaction=False)
+    for start in range(0, len(encoded), per_session):
+        key = f"{prefix}{start // per_session}"
+        keys.append(key)
+        pipe.rpush(key, *encoded[start:start + per_session])
+        if len(keys) % 1000 == 0:
+            pipe.execute()
+    pipe.execute()
+    after = client.info("memory")["used_memory"]
+
+    usage = 0
+    for start in range(0, len(keys), 1000):
+        pipe = client.pipeline(transaction=False)
+        for key in keys[start:start + 1000]:
+            pipe.memory_usage(key, samples=0)
+        usage += sum(pipe.execute())
+    for start in range(0, len(keys), 1000):
+        client.delete(*keys[start:start + 1000])
+
+    scale = 1_000_000 / len(encoded)
+    return {
+        "memory_usage_bytes_per_msg": round(usage / len(encoded), 1),
+        "memory_usage_mb_per_1m_msgs": round(usage * scale / 2**20, 1),
+        "used_memory_mb_per_1m_msgs": round((after - before) * scale / 2**20, 1),
+    }
+
+
+def main(args) -> dict:
+    from app.utils import context_codec
+
+    messages = synthetic_messages(args.messages, args.seed)
+    client = None
+    if args.redis_url:
+        import redis
+        try:
+            client = redis.Redis.from_url(args.redis_url)
+            client.ping()
+        except redis.ConnectionError:
+            client = None
+
+    results = {}
+    for fmt in ("json", "msgpack"):
+        encoded = [context_codec.encode(m, fmt) for m in messages]
+        results[fmt] = {
+            "bytes_per_msg": round(sum(map(len, encoded)) / len(encoded), 1),
+            "encode_per_s": throughput(lambda m: context_codec.encode(m, fmt), messages),
+            "decode_per_s": throughput(context_codec.decode, encoded),
+        }
+        if client is not None:
+            results[fmt]["redis"] = redis_memory(client, fmt, encoded, args.per_session)
+    if client is not None:
+        saved = results["json"]["redis"]["memory_usage_mb_per_1m_msgs"] - results["msgpack"]["redis"]["memory_usage_mb_per_1m_msgs"]
+        results["msgpack_saves_mb_per_1m_msgs"] = round(saved, 1)
+    return {"config": vars(args), "redis_measured": client is not None, "results": results}
+
+
+if __name__ == "__main__":
+    print(json.dumps(main(parse_args()), indent=2))
@@ -0,0 +1,154 @@
+"""
+Per-turn CPU and Redis traffic of the session history as sessions grow.
+
+Replays --turns chat turns (a user message, then the bot reply) of one
+session at a time against a real Redis, through the context codec, and
+reports per window of --window turns:
+
+  cpu_us_per_turn        this process's CPU time per turn (encode, decode,
+                         redis-py); Redis runs in its own process
+  bytes_in_per_turn      bytes the server read per turn (commands and payloads)
+  bytes_out_per_turn     bytes the server sent back per turn
+  context_memory_bytes   MEMORY USAGE of the context list at the window's end
+
+for each way a turn can get its history:
+
+  reread   before the connection-local history: commit the user message,
+           LRANGE 0 -1 and decode the whole context, commit the reply
+  local    SessionHistory: both messages written through with commit_turn,
+           nothing read back
+
+each with CONTEXT_ENCODING json (v1) and msgpack (v2). Traffic comes from the
+server's total_net_input_bytes / total_net_output_bytes, less the INFO calls
+that read them, so point it at a Redis nothing else is using. The sessions
+live under their own keys and are deleted afterwards.
+
+Usage:
+    redis-server --port 6379 --daemonize yes
+    python history_bench.py --turns 400 --redis-url redis://localhost:6379
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Session history CPU and Redis bytes per turn")
+    p.add_argument("--turns", type=int, default=400)
+    p.add_argument("--window", type=int, default=50, help="turns per reported window")
+    p.add_argument("--sessions", type=int, default=3, help="sessions per mode and encoding, averaged")
+    p.add_argument("--redis-url", default="redis://localhost:6379")
+    p.add_argument("--seed", type=int, default=0)
+    return p.parse_args()
+
+
+class ServerBytes:
+    """Bytes the Redis server read and wrote, from INFO stats, minus the INFO round trip itself."""
+
+    def __init__(self, client):
+        self.client = client
+        first, second = self.read(), self.read()
+        self.overhead = (second[0] - first[0], second[1] - first[1])
+
+    def read(self):
+        stats = self.client.info("stats")
+        return stats["total_net_input_bytes"], stats["total_net_output_bytes"]
+
+    def since(self, start):
+        now = self.read()
+        return now[0] - start[0] - self.overhead[0], now[1] - start[1] - self.overhead[1]
+
+
+async def replay(mode: str, texts, args, meter: ServerBytes, memory_usage) -> list:
+    from app.core.redis_client import redis_client
+    from app.utils import context_codec
+    from app.utils.context_manager import ContextManager
+    from app.utils.session_manager import SessionManager
+
+    contexts = ContextManager()
+    session_id = f"history-bench-{uuid.uuid4().hex}"
+    # commit_turn refreshes the session key's TTL and warns if it is missing
+    await redis_client.set(SessionManager.session_key(session_id), "{}", ex=600)
+    history = contexts.session_history(session_id)
+
+    windows = []
+    for start in range(0, args.turns, args.window):
+        turns = range(start, min(start + args.window, args.turns))
+        traffic = meter.read()
+        cpu = time.process_time()
+        for turn in turns:
+            question, reply = texts[2 * turn], texts[2 * turn + 1]
+            if mode == "reread":
+                await contexts.commit_turn(session_id, context_codec.new_message("user", question))
+                await contexts.get_history(session_id)
+                await contexts.commit_turn(session_id, context_codec.new_message("bot", reply))
+            else:
+                await history.append("user", question)
+                await history.append("bot", reply)
+        cpu = time.process_time() - cpu
+        bytes_in, bytes_out = meter.since(traffic)
+        windows.append({
+            "turns": f"{turns.start + 1}-{turns.stop}",
+            "cpu_us_per_turn": cpu * 1e6 / len(turns),
+            "bytes_in_per_turn": bytes_in / len(turns),
+            "bytes_out_per_turn": bytes_out / len(turns),
+            "context_memory_bytes": memory_usage(ContextManager.context_key(session_id)),
+        })
+
+    await redis_client.delete(ContextManager.context_key(session_id), SessionManager.session_key(session_id))
+    return windows
+
+
+def average(runs: list) -> list:
+    rows = []
+    for windows in zip(*runs):
+        row = {"turns": windows[0]["turns"]}
+        for field in ("cpu_us_per_turn", "bytes_in_per_turn", "bytes_out_per_turn", "context_memory_bytes"):
+            row[field] = round(sum(w[field] for w in windows) / len(windows), 1)
+        rows.append(row)
+    return rows
+
+
+async def main(args) -> dict:
+    import redis
+    import app.core.newrelic_logger  # noqa: F401  adds the app's sinks, removed below
+    from loguru import logger
+    from app.core.config import settings
+    from codec_bench import synthetic_messages
+
+    logger.remove()
+    client = redis.Redis.from_url(args.redis_url)
+    meter = ServerBytes(client)
+    texts = [m["message"] for m in synthetic_messages(2 * args.turns, args.seed)]
+
+    results = {}
+    for fmt in ("json", "msgpack"):
+        settings.CONTEXT_ENCODING = fmt
+        for mode in ("reread", "local"):
+            runs = [await replay(mode, texts, args, meter, lambda key: client.memory_usage(key, samples=0)) for _ in range(args.sessions)]
+            results[f"{mode}/{fmt}"] = average(runs)
+
+    before, after = results["reread/json"][-1], results["local/msgpack"][-1]
+    return {
+        "config": vars(args),
+        "results": results,
+        # The last window: the longest sessions, where re-reading costs the most
+        "last_window": {
+            "before": "reread/json",
+            "after": "local/msgpack",
+            "cpu_ratio": round(before["cpu_us_per_turn"] / after["cpu_us_per_turn"], 1),
+            "bytes_out_ratio": round(before["bytes_out_per_turn"] / after["bytes_out_per_turn"], 1),
+            "memory_ratio": round(before["context_memory_bytes"] / after["context_memory_bytes"], 2),
+        },
+    }
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    os.environ["REDIS_URL"] = args.redis_url
+    os.environ["REDIS_CLUSTER"] = "0"
+    print(json.dumps(asyncio.run(main(args)), indent=2))
@@ -0,0 +1,143 @@
+"""
+Throughput of bulk KB ingestion (POST /kb/{company_id}/ingest) at scale.
+
+For each KB size, streams a generated body of --sizes entries (--entry-words
+words each, one entry per line) through main.app in-process, --chunk-kb at a
+time, like a large curl upload. The endpoint writes INGEST_BATCH-entry batches
+to the Redis staging list and the MongoDB chunk documents, then commits. Each
+size is uploaded twice, so the second upload also replaces the first one and
+cleans up its chunks, as a re-upload in production does. Reports per upload:
+
+  seconds              the whole request
+  entries_per_s, mb_per_s  ingest throughput over the body
+  commit_ms            KBIngest.commit (lock, MongoDB switch, Redis swap,
+                       publish, cleanup of the replaced chunks)
+  redis_list_mb        MEMORY USAGE of the live list (real Redis only)
+  max_rss_mb           peak RSS of the process so far; the body is never held whole
+
+MongoDB is the mongomock-motor stand-in unless --mongo-uri is given, and
+Redis is fakeredis unless --redis-url is; both stand-ins run in this process,
+so use real services for numbers that mean anything.
+
+Usage:
+    redis-server --port 6379 --daemonize yes
+    python ingest_bench.py --sizes 10000 100000 1000000 --redis-url redis://localhost:6379
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import tempfile
+import time
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Bulk KB ingestion throughput")
+    p.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    p.add_argument("--entry-words", type=int, default=25)
+    p.add_argument("--vocabulary", type=int, default=20000)
+    p.add_argument("--chunk-kb", type=int, default=64, help="request body chunk size")
+    p.add_argument("--company", default="ingest-bench-co")
+    p.add_argument("--redis-url", help="use a real Redis instead of fakeredis")
+    p.add_argument("--mongo-uri", help="use a real MongoDB instead of mongomock-motor")
+    args = p.parse_args()
+    # Fields loadtest.configure_env / install_stand_ins expect
+    args.redis_cluster = False
+    args.redis_latency = 0.0
+    args.llm_latency, args.llm_jitter, args.llm_dist, args.llm_token_delay = 0.0, 0.0, "uniform", 0.0
+    args.stream, args.openai_rpm, args.max_sessions, args.customer_rpm = False, 0, None, None
+    args.verbose = False
+    return args
+
+
+def body(size: int, args, sent: list):
+    """The upload body, generated chunk by chunk; sent[0] counts its bytes."""
+    import numpy as np
+
+    rng = np.random.default_rng(size)
+    words = np.array([f"w{i}" for i in range(args.vocabulary)])
+    per_chunk = max(1, args.chunk_kb * 1024 // (args.entry_words * 6))
+    for start in range(0, size, per_chunk):
+        n = min(per_chunk, size - start)
+        drawn = words[(rng.zipf(1.3, (n, args.entry_words)) - 1) % args.vocabulary]
+        chunk = "".join(f"Entry {start + i}: {' '.join(row)}\n" for i, row in enumerate(drawn)).encode("utf-8")
+        sent[0] += len(chunk)
+        yield chunk
+
+
+async def upload(client, size: int, args, commits: list) -> dict:
+    sent = [0]
+
+    async def stream():
+        for chunk in body(size, args, sent):
+            yield chunk
+
+    del commits[:]
+    started = time.perf_counter()
+    response = await client.post(
+        f"/kb/{args.company}/ingest", content=stream(), headers={"X-Admin-Key": os.environ["ADMIN_API_KEY"]},
+    )
+    seconds = time.perf_counter() - started
+    response.raise_for_status()
+    result = response.json()
+    return {
+        "entries": result["entries"],
+        "version": result["version"],
+        "body_mb": round(sent[0] / 2**20, 1),
+        "seconds": round(seconds, 2),
+        "entries_per_s": round(result["entries"] / seconds),
+        "mb_per_s": round(sent[0] / 2**20 / seconds, 1),
+        "commit_ms": round(commits[0] * 1000, 1),
+    }
+
+
+async def main(args) -> dict:
+    import httpx
+    from loadtest import install_stand_ins
+
+    app = install_stand_ins(args)
+    from app.core.redis_client import redis_client
+    from app.utils.company_kb_manager import CompanyKBManager, KBIngest
+
+    commits = []
+    commit = KBIngest.commit
+
+    async def timed_commit(ingest):
+        started = time.perf_counter()
+        try:
+            return await commit(ingest)
+        finally:
+            commits.append(time.perf_counter() - started)
+
+    KBIngest.commit = timed_commit
+
+    kb = CompanyKBManager()
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://ingest-bench", timeout=None) as client:
+        for size in args.sizes:
+            for upload_n in (1, 2):
+                result = {"upload": upload_n, **await upload(client, size, args, commits)}
+                if args.redis_url:
+                    result["redis_list_mb"] = round(await redis_client.memory_usage(kb.redis_key(args.company)) / 2**20, 1)
+                result["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+                result["chunk_docs"] = await kb.chunks.count_documents({"company_id": args.company})
+                results.append(result)
+
+    await redis_client.delete(kb.redis_key(args.company), kb.version_key(args.company))
+    await kb.chunks.delete_many({"company_id": args.company})
+    await kb.collection.delete_one({"_id": args.company})
+    return {"config": vars(args), "ingest_batch": kb.INGEST_BATCH, "results": results}
+
+
+if __name__ == "__main__":
+    from loadtest import configure_env
+
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as spool_dir:
+        configure_env(args, spool_dir)
+        os.environ.setdefault("ADMIN_API_KEY", "ingest-bench")
+        report = asyncio.run(main(args))
+    print(json.dumps(report, indent=2))
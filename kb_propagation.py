@@ -0,0 +1,161 @@
+"""
+Check that a KB upload reaches every worker.
+
+Starts --workers separate processes, each with its own in-process KB cache
+and the kb:invalidate listener main.py runs, all on one Redis (MongoDB is a
+per-process mongomock stand-in; workers load the KB from the Redis list).
+Each worker loads the company KB, then polls its cache; when the listener
+drops the entry it reloads and reports the version it now serves and the top
+retrieval hit. The parent uploads --updates new KB versions and reports, per
+worker, how long after the commit the stale entry was dropped and the new
+version served.
+
+--check exits non-zero unless every worker served every new version (and its
+marker entry) within --timeout seconds.
+
+Usage:
+    redis-server --port 6379 --daemonize yes
+    python kb_propagation.py --workers 4 --updates 5 --check
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="KB update propagation across worker processes")
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--updates", type=int, default=5)
+    p.add_argument("--entries", type=int, default=1000)
+    p.add_argument("--company", default="propagation-co")
+    p.add_argument("--redis-url", default=os.environ.get("REDIS_URL") or "redis://localhost:6379")
+    p.add_argument("--poll", type=float, default=0.001, help="seconds between a worker's cache checks")
+    p.add_argument("--timeout", type=float, default=5.0)
+    p.add_argument("--check", action="store_true")
+    p.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    return p.parse_args()
+
+
+def kb_entries(args, release: int):
+    return [f"Release {release} notes: the release marker for this knowledge base is {release}."] + [
+        f"Entry {n}: answer about topic {n % 97} and order policy {n % 13}." for n in range(args.entries - 1)
+    ]
+
+
+def use_stand_ins():
+    """Per-process MongoDB stand-in, and no log lines on stdout (it carries the reports)."""
+    import app.core.mongodb_client as mongo_module
+    import app.core.newrelic_logger  # noqa: F401  adds the app's sinks, removed below
+    from loguru import logger
+    from mongomock_motor import AsyncMongoMockClient
+
+    mongo_module.client = None
+    mongo_module.db = AsyncMongoMockClient()[os.environ["MONGODB_DB"]]
+    logger.remove()
+
+
+async def worker(args) -> None:
+    use_stand_ins()
+    from app.utils.company_kb_manager import CompanyKBManager
+    from app.utils.kb_retriever import kb_retriever
+
+    manager = CompanyKBManager()
+    listener = asyncio.create_task(manager.listen_for_invalidations())
+    await manager.load_index(args.company)
+    print(json.dumps({"pid": os.getpid(), "version": manager.current_version(args.company)}), flush=True)
+    try:
+        while True:
+            if kb_retriever.peek(args.company) is None:
+                dropped_at = time.time()
+                await manager.load_index(args.company)
+                hits = await manager.get_relevant_kb(args.company, "release marker")
+                print(json.dumps({
+                    "pid": os.getpid(),
+                    "dropped_at": dropped_at,
+                    "served_at": time.time(),
+                    "version": manager.current_version(args.company),
+                    "top_hit": hits[0] if hits else None,
+                }), flush=True)
+            await asyncio.sleep(args.poll)
+    finally:
+        listener.cancel()
+
+
+async def main(args) -> dict:
+    use_stand_ins()
+    from app.core.redis_client import redis_client
+    from app.utils.company_kb_manager import CompanyKBManager
+
+    manager = CompanyKBManager()
+    await manager.upload_kb(args.company, kb_entries(args, 0))
+
+    cmd = [sys.executable, os.path.abspath(__file__), "--worker"] + [
+        f"--{k.replace('_', '-')}={v}" for k, v in vars(args).items() if k in ("company", "poll", "redis_url")
+    ]
+    procs = [await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE) for _ in range(args.workers)]
+    try:
+        for proc in procs:
+            json.loads(await asyncio.wait_for(proc.stdout.readline(), 30))
+        # The listeners subscribe right after start-up; wait until all of them are in
+        while (await redis_client.pubsub_numsub(manager.INVALIDATION_CHANNEL))[0][1] < args.workers:
+            await asyncio.sleep(0.01)
+
+        updates = []
+        for release in range(1, args.updates + 1):
+            ingest = manager.start_ingest(args.company)
+            await ingest.add(kb_entries(args, release))
+            committed_at = time.time()
+            version = await ingest.commit()
+
+            async def report(proc):
+                # Stop at the first report for this version; an earlier reload (e.g. a TTL expiry) is skipped
+                while True:
+                    line = json.loads(await proc.stdout.readline())
+                    if line["version"] >= version:
+                        return line
+
+            workers, missing = [], 0
+            for proc in procs:
+                try:
+                    line = await asyncio.wait_for(report(proc), args.timeout)
+                except asyncio.TimeoutError:
+                    missing += 1
+                    continue
+                workers.append({
+                    "version": line["version"],
+                    "marker_found": f"Release {release} " in (line["top_hit"] or ""),
+                    "dropped_ms": round((line["dropped_at"] - committed_at) * 1000, 2),
+                    "served_ms": round((line["served_at"] - committed_at) * 1000, 2),
+                })
+            updates.append({
+                "version": version,
+                "workers_updated": sum(w["version"] == version and w["marker_found"] for w in workers),
+                "workers_missing": missing,
+                "max_dropped_ms": max((w["dropped_ms"] for w in workers), default=None),
+                "max_served_ms": max((w["served_ms"] for w in workers), default=None),
+            })
+    finally:
+        for proc in procs:
+            proc.terminate()
+            await proc.wait()
+
+    return {"config": {k: v for k, v in vars(args).items() if k != "worker"}, "updates": updates}
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    os.environ["REDIS_URL"] = args.redis_url
+    os.environ.setdefault("OPENAI_API_KEY", "kb-propagation")
+    os.environ.setdefault("MONGODB_DB", "chatbot_kb_propagation")
+    if args.worker:
+        asyncio.run(worker(args))
+        sys.exit(0)
+    report = asyncio.run(main(args))
+    print(json.dumps(report, indent=2))
+    if args.check and any(u["workers_updated"] < args.workers for u in report["updates"]):
+        print("Some workers did not serve the new KB version", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,74 @@
+"""
+Benchmark of per-turn KB retrieval (app/utils/kb_retriever.py).
+
+For each KB size builds a KBIndex over generated entries (--entry-words words
+drawn from a Zipf-distributed vocabulary, like real support articles) and runs
+--queries searches of --query-words words. Reports index build time, search
+latency percentiles and the KB tokens a prompt carries: the whole KB (what was
+sent before retrieval) vs the entries selected within KB_TOKEN_BUDGET.
+
+Usage:
+    python kbbench.py --sizes 100 1000 10000 100000
+"""
+
+import argparse
+import json
+import time
+
+
+def parse_args():
+    from app.core.config import settings
+    p = argparse.ArgumentParser(description="KB retrieval benchmark")
+    p.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    p.add_argument("--entry-words", type=int, default=25)
+    p.add_argument("--query-words", type=int, default=6)
+    p.add_argument("--queries", type=int, default=1000)
+    p.add_argument("--vocabulary", type=int, default=20000)
+    p.add_argument("--top-k", type=int, default=settings.KB_TOP_K)
+    p.add_argument("--token-budget", type=int, default=settings.KB_TOKEN_BUDGET)
+    return p.parse_args()
+
+
+def main(args) -> dict:
+    import numpy as np
+    from app.utils.kb_retriever import KBIndex, estimate_tokens
+
+    rng = np.random.default_rng(0)
+    words = np.array([f"w{i}" for i in range(args.vocabulary)])
+
+    def text(n_words: int) -> str:
+        return " ".join(words[(rng.zipf(1.3, n_words) - 1) % args.vocabulary])
+
+    results = []
+    for size in args.sizes:
+        entries = [text(args.entry_words) for _ in range(size)]
+        queries = [text(args.query_words) for _ in range(args.queries)]
+
+        started = time.perf_counter()
+        index = KBIndex(entries)
+        build = time.perf_counter() - started
+
+        latencies, selected_tokens = [], []
+        for query in queries:
+            t = time.perf_counter()
+            selected = index.search(query, args.top_k, args.token_budget)
+            latencies.append(time.perf_counter() - t)
+            selected_tokens.append(sum(estimate_tokens(e) for e in selected))
+
+        lat = np.array(latencies) * 1000
+        full = int(index.entry_tokens.sum())
+        results.append({
+            "entries": size,
+            "build_ms": round(build * 1000, 1),
+            "search_p50_ms": round(float(np.percentile(lat, 50)), 3),
+            "search_p99_ms": round(float(np.percentile(lat, 99)), 3),
+            "kb_tokens_full": full,
+            "kb_tokens_selected_mean": round(float(np.mean(selected_tokens)), 1),
+            "kb_tokens_selected_max": int(max(selected_tokens)),
+            "prompt_reduction": round(full / max(float(np.mean(selected_tokens)), 1), 1),
+        })
+    return {"config": vars(args), "results": results}
+
+
+if __name__ == "__main__":
+    print(json.dumps(main(parse_args()), indent=2))
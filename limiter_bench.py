@@ -0,0 +1,151 @@
+"""
+Goodput of OpenAI calls against a rate-limited provider under overload.
+
+A FakeAsyncOpenAI provider accepts --provider-rps requests per second,
+enforced over a sliding --provider-window (more get a 429), with
+--provider-latency per call. Requests arrive at --overload
+times that rate for --seconds, each from its own coroutine, through:
+
+  baseline  the previous client: call, and on a 429 sleep 2**attempt and
+            retry, up to 3 tries, with no coordination between callers
+  limiter   OpenAIClient.generate_response behind an OpenAILimiter with
+            OPENAI_RPM at --rpm-fraction of the provider's quota (RPM
+            buckets, AIMD in-flight limit, shared 429 pause,
+            OPENAI_QUEUE_TIMEOUT deadline)
+
+A request counts towards goodput if it succeeded within --deadline seconds
+of arriving (a user still waiting for the reply); goodput is per second of
+the whole run, including the tail after the last arrival. Reports goodput,
+outcome counts, how long failed requests took to fail, provider calls and
+429s, and latency percentiles of the successes. --check exits non-zero
+unless the limiter's goodput is at least --min-goodput of the provider's
+capacity and it made fewer provider calls than the baseline.
+
+Usage:
+    python limiter_bench.py --provider-rps 100 --overload 5 --seconds 20 --check
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="OpenAI limiter goodput under overload")
+    p.add_argument("--provider-rps", type=int, default=100)
+    p.add_argument("--provider-window", type=float, default=10.0, help="seconds the provider quota is enforced over")
+    p.add_argument("--provider-latency", type=float, default=0.05)
+    p.add_argument("--overload", type=float, default=5.0, help="offered load as a multiple of provider capacity")
+    p.add_argument("--seconds", type=float, default=20.0)
+    p.add_argument("--deadline", type=float, default=5.0, help="seconds a user waits for a reply")
+    p.add_argument("--rpm-fraction", type=float, default=0.9, help="limiter OPENAI_RPM as a share of the provider quota")
+    p.add_argument("--queue-timeout", type=float, default=3.0, help="OPENAI_QUEUE_TIMEOUT for the limiter")
+    p.add_argument("--min-goodput", type=float, default=0.8)
+    p.add_argument("--check", action="store_true")
+    return p.parse_args()
+
+
+async def baseline_call(client, messages) -> str:
+    """generate_response as it was before the limiter."""
+    from openai import RateLimitError
+
+    for attempt in range(3):
+        try:
+            response = await client.chat.completions.create(model="gpt-4.1-mini", messages=messages, max_tokens=300)
+            return response.choices[0].message.content
+        except RateLimitError:
+            await asyncio.sleep(2 ** attempt)
+    raise RuntimeError("OpenAI request failed after retries")
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    pick = lambda q: round(values[min(len(values) - 1, int(q * len(values)))], 3)
+    return {"p50_s": pick(0.5), "p99_s": pick(0.99), "max_s": round(values[-1], 3)}
+
+
+async def run(mode: str, args) -> dict:
+    from app.utils.fake_openai import FakeAsyncOpenAI
+    from app.utils.openai_client import OpenAIClient
+    from app.utils.openai_limiter import OpenAILimiter
+
+    provider = FakeAsyncOpenAI(
+        latency=args.provider_latency, token_delay=0,
+        rate_limit=int(args.provider_rps * args.provider_window),
+        rate_window=args.provider_window,
+    )
+    client = OpenAIClient(
+        client=provider,
+        limiter=OpenAILimiter(requests_per_minute=int(args.provider_rps * 60 * args.rpm_fraction), tokens_per_minute=0, queue_timeout=args.queue_timeout),
+    )
+    history = [{"role": "user", "message": "Where is my order?"}]
+    latencies, failures, outcomes = [], [], {}
+
+    async def request():
+        started = time.perf_counter()
+        try:
+            if mode == "baseline":
+                await baseline_call(provider, client._format_message(history))
+            else:
+                await client.generate_response(history)
+            latencies.append(time.perf_counter() - started)
+            outcome = "ok"
+        except Exception as e:
+            failures.append(time.perf_counter() - started)
+            outcome = type(e).__name__
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    offered = int(args.provider_rps * args.overload * args.seconds)
+    interval = args.seconds / offered
+    started = time.perf_counter()
+    tasks = []
+    for n in range(offered):
+        delay = started + n * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(request()))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    good = sum(1 for lat in latencies if lat <= args.deadline)
+    return {
+        "offered": offered,
+        "outcomes": outcomes,
+        "within_deadline": good,
+        "goodput_rps": round(good / elapsed, 1),
+        "goodput_vs_capacity": round(good / elapsed / args.provider_rps, 2),
+        "provider_calls": provider.calls,
+        "provider_429s": provider.rate_limited,
+        "latency": percentiles(latencies),
+        "time_to_failure": percentiles(failures),
+        "elapsed_s": round(elapsed, 2),
+    }
+
+
+async def main(args) -> dict:
+    import app.core.newrelic_logger  # noqa: F401  adds the app's sinks, removed below
+    from loguru import logger
+
+    logger.remove()
+    return {"config": vars(args), "results": {mode: await run(mode, args) for mode in ("baseline", "limiter")}}
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    os.environ.setdefault("OPENAI_API_KEY", "limiter-bench")
+    os.environ["OPENAI_FAKE"] = "1"
+    report = asyncio.run(main(args))
+    print(json.dumps(report, indent=2))
+    if args.check:
+        results = report["results"]
+        goodput = results["limiter"]["goodput_vs_capacity"]
+        calls, baseline_calls = results["limiter"]["provider_calls"], results["baseline"]["provider_calls"]
+        if goodput < args.min_goodput or calls >= baseline_calls:
+            print(f"Limiter goodput {goodput} of capacity (required {args.min_goodput}), "
+                  f"{calls} provider calls (baseline {baseline_calls})", file=sys.stderr)
+            sys.exit(1)
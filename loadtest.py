@@ -0,0 +1,321 @@
+"""
+End-to-end load test for /ws/chat.
+
+Runs main.app in-process under uvicorn and drives N concurrent simulated
+clients through the full company -> phone -> chat handshake and a number of
+chat turns. By default everything external is replaced with local stand-ins:
+fakeredis for Redis, mongomock-motor for MongoDB and FakeAsyncOpenAI (with a
+configurable latency distribution) for the LLM. Pass --redis-url / --mongo-uri
+to run against real local services instead.
+
+Reports p50/p95/p99 connection-setup and per-turn latency, turn throughput,
+connections refused by admission control, throttled messages and RSS growth
+per open connection, and writes them as JSON so runs can be
+compared between commits.
+
+Usage:
+    pip install fakeredis lupa mongomock-motor   # stand-in mode only
+    python loadtest.py --clients 200 --turns 5 --llm-latency 0.8 --llm-dist lognormal --llm-jitter 0.4
+    # past saturation, with and without the per-worker session cap:
+    python loadtest.py --clients 300 --openai-rpm 1200 --max-sessions 0
+    python loadtest.py --clients 300 --openai-rpm 1200 --max-sessions 15
+    # per-turn latency as Redis round trips get slower (e.g. a remote or busy Redis):
+    python loadtest.py --clients 50 --openai-rpm 0 --redis-latency 0.005
+    # against a local Redis Cluster (see README), with the company rate limit on:
+    COMPANY_MESSAGES_PER_MINUTE=100000 python loadtest.py --redis-url redis://127.0.0.1:7000 --redis-cluster
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+FAQ = [
+    "How do I get a refund?",
+    "What are your opening hours?",
+    "How long does shipping take?",
+    "How can I reset my password?",
+    "Do you ship internationally?",
+]
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Load test the /ws/chat endpoint")
+    p.add_argument("--clients", type=int, default=100, help="concurrent simulated clients")
+    p.add_argument("--turns", type=int, default=5, help="chat turns per session")
+    p.add_argument("--ramp", type=float, default=2.0, help="seconds over which clients connect")
+    p.add_argument("--think-time", type=float, default=0.2, help="mean pause between a reply and the next message")
+    p.add_argument("--faq-ratio", type=float, default=0.5, help="share of messages drawn from a small FAQ set")
+    p.add_argument("--company", default="loadtest-co")
+    p.add_argument("--kb-entries", type=int, default=1000)
+    p.add_argument("--llm-latency", type=float, default=0.5, help="mean/median seconds to first token")
+    p.add_argument("--llm-jitter", type=float, default=0.2)
+    p.add_argument("--llm-dist", choices=["uniform", "lognormal", "exponential"], default="uniform")
+    p.add_argument("--llm-token-delay", type=float, default=0.005)
+    p.add_argument("--stream", action="store_true", help="enable STREAM_RESPONSES")
+    p.add_argument("--openai-rpm", type=int, help="override OPENAI_RPM for the run (0 = unlimited)")
+    p.add_argument("--max-sessions", type=int, help="override MAX_SESSIONS_PER_WORKER (0 = no cap)")
+    p.add_argument("--customer-rpm", type=float, help="override CUSTOMER_MESSAGES_PER_MINUTE (0 = unlimited)")
+    p.add_argument("--redis-url", help="use a real Redis instead of fakeredis")
+    p.add_argument("--redis-cluster", action="store_true", help="--redis-url is a Redis Cluster node")
+    p.add_argument("--redis-latency", type=float, default=0.0, help="seconds added to every Redis round trip")
+    p.add_argument("--mongo-uri", help="use a real MongoDB instead of mongomock-motor")
+    p.add_argument("--out", default="loadtest_results.json")
+    p.add_argument("--verbose", action="store_true", help="keep app logging on (slow)")
+    return p.parse_args()
+
+
+def configure_env(args, spool_dir: str) -> None:
+    """Settings are read at import time, so this must run before importing the app."""
+    os.environ["OPENAI_FAKE"] = "1"
+    os.environ.setdefault("OPENAI_API_KEY", "loadtest")
+    os.environ["REDIS_URL"] = args.redis_url or os.environ.get("REDIS_URL") or "redis://localhost:6379"
+    os.environ["REDIS_CLUSTER"] = "1" if args.redis_cluster else "0"
+    os.environ["MONGODB_URI"] = args.mongo_uri or os.environ.get("MONGODB_URI") or "mongodb://localhost:27017"
+    os.environ.setdefault("MONGODB_DB", "chatbot_loadtest")
+    os.environ["CONVERSATION_SPOOL_DIR"] = spool_dir
+    os.environ["STREAM_RESPONSES"] = "1" if args.stream else "0"
+    os.environ["CONTEXT_SUMMARIZER"] = "stub"
+    if args.openai_rpm is not None:
+        os.environ["OPENAI_RPM"] = str(args.openai_rpm)
+        os.environ["OPENAI_TPM"] = "0" if args.openai_rpm == 0 else os.environ.get("OPENAI_TPM", "200000")
+    if args.max_sessions is not None:
+        os.environ["MAX_SESSIONS_PER_WORKER"] = str(args.max_sessions)
+    if args.customer_rpm is not None:
+        os.environ["CUSTOMER_MESSAGES_PER_MINUTE"] = str(args.customer_rpm)
+
+
+def install_stand_ins(args):
+    """Swap in local stand-ins before the app modules bind them at import."""
+    import app.core.redis_client as redis_module
+    import app.core.mongodb_client as mongo_module
+
+    if not args.redis_url:
+        import fakeredis
+        import fakeredis.aioredis
+        server = fakeredis.FakeServer()
+        # FakeRedis caps its pool at 100 connections; redis.from_url (what the app uses) doesn't
+        redis_module.redis_client = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True, max_connections=2 ** 16)
+        redis_module.redis_binary_client = fakeredis.aioredis.FakeRedis(server=server, max_connections=2 ** 16)
+        redis_module.redis_pubsub_client = redis_module.redis_client
+
+    if args.redis_latency:
+        # One delay per command sent (a pipeline or script call is a single send), for real and fake Redis
+        import redis.asyncio.connection as redis_connection
+        send = redis_connection.AbstractConnection.send_packed_command
+
+        async def delayed_send(self, command, check_health=True):
+            await asyncio.sleep(args.redis_latency)
+            await send(self, command, check_health)
+
+        redis_connection.AbstractConnection.send_packed_command = delayed_send
+
+    if not args.mongo_uri:
+        from mongomock_motor import AsyncMongoMockClient
+        mongo_module.client = None
+        mongo_module.db = AsyncMongoMockClient()[os.environ["MONGODB_DB"]]
+
+    from main import app
+    from app.api import websocket
+    from app.utils.fake_openai import FakeAsyncOpenAI
+
+    websocket.openai_client.client = FakeAsyncOpenAI(
+        latency=args.llm_latency,
+        jitter=args.llm_jitter,
+        distribution=args.llm_dist,
+        token_delay=args.llm_token_delay,
+    )
+
+    if not args.verbose:
+        from loguru import logger
+        logger.remove()
+    return app
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        # Peak RSS; KB on Linux, bytes on macOS
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == "darwin" else usage * 1024
+
+
+def percentiles(values):
+    import numpy as np
+    if not values:
+        return {}
+    arr = np.array(values) * 1000
+    return {
+        "count": len(values),
+        "p50_ms": round(float(np.percentile(arr, 50)), 2),
+        "p95_ms": round(float(np.percentile(arr, 95)), 2),
+        "p99_ms": round(float(np.percentile(arr, 99)), 2),
+        "max_ms": round(float(arr.max()), 2),
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+class Results:
+    def __init__(self, clients: int):
+        self.setup = []
+        self.turns = []
+        # Time to a "busy" refusal from admission control
+        self.rejected = []
+        self.throttled = 0
+        self.errors = {}
+        self.connected = 0
+        self.clients = clients
+        self.all_connected = asyncio.Event()
+        self.start_turns = asyncio.Event()
+
+    def error(self, kind: str) -> None:
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+async def recv_reply(ws, stream: bool, end_marker: str) -> str:
+    if not stream:
+        return await ws.recv()
+    parts = []
+    while True:
+        frame = await ws.recv()
+        if frame == end_marker:
+            return "".join(parts)
+        parts.append(frame)
+
+
+async def run_client(i: int, args, url: str, results: Results, end_marker: str) -> None:
+    import websockets
+
+    await asyncio.sleep(random.uniform(0, args.ramp))
+    phone = f"98{i:08d}"
+    counted = False
+    try:
+        started = time.perf_counter()
+        async with websockets.connect(url, max_size=None, ping_interval=None) as ws:
+            first = await ws.recv()
+            if first.startswith("Server busy"):
+                results.rejected.append(time.perf_counter() - started)
+                return
+            await ws.send(args.company)
+            await ws.recv()
+            await ws.send(phone)
+            greeting = await ws.recv()
+            if not greeting.startswith("Hello"):
+                results.error("handshake_rejected")
+                return
+            results.setup.append(time.perf_counter() - started)
+
+            results.connected += 1
+            counted = True
+            if results.connected == results.clients:
+                results.all_connected.set()
+            await results.start_turns.wait()
+
+            for turn in range(args.turns):
+                await asyncio.sleep(random.expovariate(1 / args.think_time) if args.think_time > 0 else 0)
+                if random.random() < args.faq_ratio:
+                    message = random.choice(FAQ)
+                else:
+                    message = f"Client {i} question {turn}: where is order {random.randint(1000, 9999)}?"
+                sent = time.perf_counter()
+                await ws.send(message)
+                reply = await recv_reply(ws, args.stream, end_marker)
+                if reply.startswith("You're sending messages too quickly"):
+                    results.throttled += 1
+                    continue
+                results.turns.append(time.perf_counter() - sent)
+    except Exception as e:
+        results.error(type(e).__name__)
+    finally:
+        if not counted:
+            # Don't let a failed client hold up the memory barrier
+            results.clients -= 1
+            if results.connected >= results.clients:
+                results.all_connected.set()
+
+
+async def main(args) -> dict:
+    import uvicorn
+
+    app = install_stand_ins(args)
+    from app.core.config import settings
+    from app.utils.company_kb_manager import CompanyKBManager
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", ws_max_size=16 * 1024 * 1024))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    await CompanyKBManager().upload_kb(
+        args.company,
+        [f"Entry {n}: answer about topic {n % 97} and order policy {n % 13}." for n in range(args.kb_entries)],
+    )
+
+    results = Results(args.clients)
+    rss_before = rss_bytes()
+    url = f"ws://127.0.0.1:{port}/ws/chat"
+    clients = [asyncio.create_task(run_client(i, args, url, results, settings.STREAM_END_MARKER)) for i in range(args.clients)]
+
+    await results.all_connected.wait()
+    rss_connected = rss_bytes()
+    turns_started = time.perf_counter()
+    results.start_turns.set()
+    await asyncio.gather(*clients)
+    turns_elapsed = time.perf_counter() - turns_started
+
+    server.should_exit = True
+    await server_task
+
+    connected = len(results.setup)
+    return {
+        "git_commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": vars(args),
+        "stand_ins": {"redis": not args.redis_url, "mongo": not args.mongo_uri, "openai": True},
+        "redis_cluster": args.redis_cluster,
+        "clients_connected": connected,
+        "rejected": percentiles(results.rejected) or {"count": 0},
+        "throttled": results.throttled,
+        "errors": results.errors,
+        "setup_latency": percentiles(results.setup),
+        "turn_latency": percentiles(results.turns),
+        "turns_completed": len(results.turns),
+        "throughput_turns_per_s": round(len(results.turns) / turns_elapsed, 2) if turns_elapsed else None,
+        # Client sockets live in the same process, so this is an upper bound for the server side
+        "rss_per_connection_kb": round((rss_connected - rss_before) / connected / 1024, 2) if connected else None,
+    }
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as spool_dir:
+        configure_env(args, spool_dir)
+        report = asyncio.run(main(args))
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps({k: report[k] for k in ("clients_connected", "rejected", "throttled", "errors", "setup_latency", "turn_latency", "throughput_turns_per_s", "rss_per_connection_kb")}, indent=2))
+    print(f"Results written to {args.out}")
@@ -0,0 +1,111 @@
+"""
+Micro-benchmark of the logging cost of one chat turn on the event loop.
+
+Replays the log calls websocket_chat makes per turn (received message, reply
+timing, sent reply) against four setups and reports microseconds per turn:
+
+  legacy     f-strings, a fresh logger.opt(depth=1, exception=True) per call
+             and a synchronous print() sink (the previous behaviour)
+  current    lazy format arguments, cached DepthLogger, queued StdoutSink
+  sampled    current + --sample-rate for the per-turn INFO events and
+             payloads clipped to --payload-chars
+  warning    current with the console at WARNING (INFO is level-gated)
+
+Console output goes to /dev/null (or --output) so the numbers are the cost
+paid by the caller. "flush" is the extra time for the queued sink to finish
+writing after the loop, i.e. work moved off the event loop.
+
+Usage:
+    python logbench.py --turns 20000 --message-chars 500 --reply-chars 1500
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Per-turn logging cost")
+    p.add_argument("--turns", type=int, default=20000)
+    p.add_argument("--message-chars", type=int, default=500)
+    p.add_argument("--reply-chars", type=int, default=1500)
+    p.add_argument("--sample-rate", type=float, default=0.1)
+    p.add_argument("--payload-chars", type=int, default=200)
+    p.add_argument("--output", default=os.devnull, help="where console lines go")
+    return p.parse_args()
+
+
+def legacy_turn(logger, data, reply, metrics):
+    log = logger.bind(session_id="s-1", customer_id="c-1")
+    log.info(f"Received msg: {data}")
+    log.bind(
+        ttft_ms=round(metrics["ttft"] * 1000, 1),
+        generation_ms=round(metrics["total"] * 1000, 1),
+    ).info("Streamed reply")
+    log.info(f"Sent reply: {reply}")
+
+
+def current_turn(logger, data, reply, metrics, sampled, clip):
+    log = logger.bind(session_id="s-1", customer_id="c-1")
+    if sampled("received_msg"):
+        log.info("Received msg: {}", clip(data))
+    if sampled("reply_timing"):
+        log.bind(
+            ttft_ms=round(metrics["ttft"] * 1000, 1),
+            generation_ms=round(metrics["total"] * 1000, 1),
+        ).info("Streamed reply")
+    if sampled("sent_reply"):
+        log.info("Sent reply: {}", clip(reply))
+
+
+def main(args) -> dict:
+    from loguru import logger as _logger
+    from app.core import newrelic_logger as nl
+
+    class LegacyDepthLogger:
+        def __getattr__(self, name):
+            return getattr(_logger.opt(depth=1, exception=True), name)
+
+    out = open(args.output, "w")
+    data = "x" * args.message_chars
+    reply = "y" * args.reply_chars
+    metrics = {"ttft": 0.4321, "total": 1.2345}
+    always = lambda event: True
+    whole = lambda text: text
+
+    def clip(text):
+        return nl.clip(text, args.payload_chars)
+
+    nl.SAMPLE_RATES.update({event: args.sample_rate for event in ("received_msg", "reply_timing", "sent_reply")})
+
+    def run(turn, *extra, sink=None, level="DEBUG", logger=None):
+        _logger.remove()
+        if sink is None:
+            handler = _logger.add(lambda msg: print(msg, end="", file=out), level=level)
+        else:
+            handler = _logger.add(sink, level=level)
+        started = time.perf_counter()
+        for _ in range(args.turns):
+            turn(logger, data, reply, metrics, *extra)
+        elapsed = time.perf_counter() - started
+        flush = 0.0
+        if sink is not None:
+            t = time.perf_counter()
+            sink.drain(60)
+            flush = time.perf_counter() - t
+        _logger.remove(handler)
+        return {"us_per_turn": round(elapsed / args.turns * 1e6, 2), "flush_s": round(flush, 3)}
+
+    results = {
+        "legacy": run(legacy_turn, logger=LegacyDepthLogger()),
+        "current": run(current_turn, always, whole, sink=nl.StdoutSink(out), logger=nl.DepthLogger()),
+        "sampled": run(current_turn, nl.sampled, clip, sink=nl.StdoutSink(out), logger=nl.DepthLogger()),
+        "warning": run(current_turn, always, whole, sink=nl.StdoutSink(out), level="WARNING", logger=nl.DepthLogger()),
+    }
+    return {"config": vars(args), "results": results}
+
+
+if __name__ == "__main__":
+    print(json.dumps(main(parse_args()), indent=2), file=sys.stderr)
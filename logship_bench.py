@@ -0,0 +1,157 @@
+"""
+Event-loop latency while shipping ERROR logs to a slow or unreachable New Relic.
+
+Starts a stub ingest server on localhost and logs --rate ERROR records per
+second from a coroutine while a probe task measures how late a 5 ms sleep
+wakes up (event-loop lag). Each scenario runs for --seconds:
+
+  ok         stub answers 202 right away
+  slow       stub waits --slow-seconds before answering (longer than the sink timeout)
+  down       nothing listens on the ingest port (connection refused)
+
+against two sinks:
+
+  queued     NewRelicSink (bounded queue + background shipper thread)
+  sync       a synchronous POST per record from the sink (the previous behaviour)
+
+The queued sink must keep lag flat in every scenario; --check exits non-zero
+if its p99 lag exceeds --max-lag-ms in any of them.
+
+Usage:
+    python logship_bench.py --seconds 3 --rate 200 --check
+"""
+
+import argparse
+import asyncio
+import json
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Event-loop lag under a slow/down log ingest endpoint")
+    p.add_argument("--seconds", type=float, default=3)
+    p.add_argument("--rate", type=int, default=200, help="ERROR records logged per second")
+    p.add_argument("--slow-seconds", type=float, default=2.0)
+    p.add_argument("--sink-timeout", type=float, default=1.0)
+    p.add_argument("--skip-sync", action="store_true", help="only measure the queued sink")
+    p.add_argument("--max-lag-ms", type=float, default=20)
+    p.add_argument("--check", action="store_true")
+    return p.parse_args()
+
+
+def stub_server(delay: float):
+    """Ingest stand-in that answers 202 after `delay` seconds. Returns (server, url)."""
+    class Handler(BaseHTTPRequestHandler):
+        received = 0
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(delay)
+            Handler.received += 1
+            try:
+                self.send_response(202)
+                self.end_headers()
+            except OSError:
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/log/v1"
+
+
+def closed_port_url() -> str:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    return f"http://127.0.0.1:{port}/log/v1"
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    pick = lambda q: round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 2)
+    return {"p50_ms": pick(0.5), "p99_ms": pick(0.99), "max_ms": round(values[-1] * 1000, 2)}
+
+
+async def measure(log, seconds: float, rate: int) -> dict:
+    lags = []
+    stop = time.perf_counter() + seconds
+
+    async def probe():
+        while time.perf_counter() < stop:
+            t = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lags.append(time.perf_counter() - t - 0.005)
+
+    async def produce():
+        n = 0
+        while time.perf_counter() < stop:
+            log.error("Simulated failure {}", n)
+            n += 1
+            await asyncio.sleep(1 / rate)
+        return n
+
+    _, logged = await asyncio.gather(probe(), produce())
+    return {"logged": logged, "lag": percentiles(lags)}
+
+
+def run(args) -> dict:
+    import requests
+    from loguru import logger as _logger
+    from app.core.newrelic_logger import DepthLogger, NewRelicSink
+
+    _logger.remove()
+    log = DepthLogger()
+    results = {}
+    for scenario in ("ok", "slow", "down"):
+        server = None
+        if scenario == "down":
+            url = closed_port_url()
+        else:
+            server, url = stub_server(args.slow_seconds if scenario == "slow" else 0)
+
+        sinks = {"queued": None} if args.skip_sync else {"queued": None, "sync": None}
+        for name in sinks:
+            if name == "queued":
+                sink = NewRelicSink(url=url, batch_size=50, flush_interval=0.2, timeout=args.sink_timeout)
+                handler = _logger.add(sink, level="ERROR")
+            else:
+                sink = None
+
+                def post(message, url=url):
+                    try:
+                        requests.post(url, json={"message": message.record["message"]}, timeout=args.sink_timeout)
+                    except Exception:
+                        pass
+
+                handler = _logger.add(post, level="ERROR")
+
+            result = asyncio.run(measure(log, args.seconds, args.rate))
+            _logger.remove(handler)
+            if sink is not None:
+                result["sink"] = sink.stats()
+                sink.close(timeout=0.5)
+            results[f"{scenario}/{name}"] = result
+        if server is not None:
+            server.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = run(args)
+    print(json.dumps({"config": vars(args), "results": results}, indent=2))
+    if args.check:
+        over = {k: v["lag"]["p99_ms"] for k, v in results.items() if k.endswith("/queued") and v["lag"]["p99_ms"] > args.max_lag_ms}
+        if over:
+            print(f"Event-loop lag over {args.max_lag_ms} ms: {over}", file=sys.stderr)
+            sys.exit(1)
@@ -1,39 +1,120 @@
+import time
+IMPORT_STARTED = time.perf_counter()
+
 import newrelic.agent
 newrelic.agent.initialize("newrelic.ini")
 
-from app.core.newrelic_logger import logger
+from app.core.newrelic_logger import close_log_sinks, log_stats, logger, newrelic_sink
 
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse
 # from loguru import logger
 
 from app.core.config import settings
 from app.api.websocket import router as websocket_router
+from app.api.kb import router as kb_router
+from app.api.conversations import router as conversations_router
 from app.core.mongodb_init import init_mongodb
 from app.core.mongodb_client import close_mongodb_connection
+from app.core.metrics import registry
+from app.utils.company_kb_manager import CompanyKBManager
+from app.utils.conversation_manager import ConversationManager
+from app.utils.conversation_writer import conversation_writer
+from app.utils.kb_retriever import kb_retriever
+from app.utils.answer_cache import answer_cache
+from app.utils.openai_limiter import openai_limiter
+from app.utils.prompt_assembler import prompt_assembler
+from app.utils.rate_limiter import admission_control, rate_limiter
+from app.utils.session_reaper import session_reaper
+from app.utils.warmup import dependency_status, warmup
+from app.api import websocket
+
+# Filled in below and by lifespan; exported as chatbot_startup_* gauges and in /ready
+startup_timings = {}
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Starting up the app")
+    started = time.perf_counter()
     try:
         await init_mongodb()
-        yield
     except Exception as e:
         logger.error(f"Failed to initialize MongoDB: {e}")
         raise
 
+    if settings.CONVERSATION_WRITE_BEHIND:
+        conversations = ConversationManager()
+        await conversation_writer.start(lambda: conversations.collection)
+
+    kb_listener = asyncio.create_task(CompanyKBManager().listen_for_invalidations())
+    reaper = asyncio.create_task(session_reaper.run())
+    # Serve (and answer /ready with 503) while pools and hot KBs warm up
+    warming = asyncio.create_task(warmup.run(websocket.openai_client.client))
+    startup_timings["lifespan_seconds"] = round(time.perf_counter() - started, 3)
+    logger.info(f"Startup: imports {startup_timings['import_seconds']}s, lifespan {startup_timings['lifespan_seconds']}s")
+    yield
+
     logger.info("Shutting down the app")
+    kb_listener.cancel()
+    reaper.cancel()
+    warming.cancel()
+    await conversation_writer.close()
     await close_mongodb_connection()
+    await asyncio.to_thread(close_log_sinks)
 
 
 app = FastAPI(title=settings.PROJECT_NAME, lifespan=lifespan)
 
+registry.register_collector("chatbot_kb_cache", kb_retriever.stats)
+registry.register_collector("chatbot_answer_cache", answer_cache.stats)
+registry.register_collector("chatbot_openai_limiter", openai_limiter.stats)
+registry.register_collector("chatbot_conversation_writer", conversation_writer.stats)
+registry.register_collector("chatbot_newrelic_sink", newrelic_sink.stats)
+registry.register_collector("chatbot_session_reaper", session_reaper.stats)
+registry.register_collector("chatbot_prompt_prefix", prompt_assembler.stats)
+registry.register_collector("chatbot_admission", admission_control.stats)
+registry.register_collector("chatbot_rate_limiter", rate_limiter.stats)
+registry.register_collector("chatbot_logging", log_stats)
+registry.register_collector("chatbot_startup", lambda: {**startup_timings, **warmup.stats()})
+
 app.include_router(websocket_router)
+app.include_router(kb_router)
+app.include_router(conversations_router)
+
+startup_timings["import_seconds"] = round(time.perf_counter() - IMPORT_STARTED, 3)
 
 @app.get('/health')
 async def health_check():
-    logger.info("Health check called")
-    return {
-        "status": "ok",
-        "project": settings.PROJECT_NAME
-    }
+    """ok only if Redis and MongoDB answer a ping; 503 with the failing dependency otherwise."""
+    dependencies = await dependency_status()
+    healthy = all(status == "ok" for status in dependencies.values())
+    return JSONResponse(
+        {
+            "status": "ok" if healthy else "unavailable",
+            "project": settings.PROJECT_NAME,
+            "dependencies": dependencies,
+        },
+        status_code=200 if healthy else 503,
+    )
+
+@app.get('/ready')
+async def ready_check():
+    """200 once warm-up finished and Redis/MongoDB are reachable; route traffic here only then."""
+    dependencies = await dependency_status()
+    ready = warmup.ready and all(status == "ok" for status in dependencies.values())
+    return JSONResponse(
+        {
+            "status": "ready" if ready else "warming" if not warmup.done else "unavailable",
+            "dependencies": dependencies,
+            "warmup": warmup.report(),
+            "startup": startup_timings,
+        },
+        status_code=200 if ready else 503,
+    )
+
+@app.get('/metrics', response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text exposition of stage latencies, errors, timeouts and component stats."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,163 @@
+"""
+Rename Redis keys from the old names to the hash-tagged names used for
+Redis Cluster support (session:<id> -> session:{<id>}, kb:company:<id> ->
+kb:company:{<id>}, ...). Safe to run more than once, and while workers are
+serving: tagged keys are never touched, and where a worker already wrote
+the tagged key, the old key is dropped. KB version counters are the
+exception: the tagged counter is set to the larger of the two, so a version
+number is never reused (workers would keep serving their cached copy of the
+older KB with the same number).
+
+Moving from a single Redis to a cluster:
+    1. deploy the new version, still pointing at the single Redis
+    2. python migrate_redis_keys.py              # RENAMENX on the single node
+    3. redis-cli --cluster import <cluster-node> --cluster-from <old-redis> --cluster-copy
+    4. switch the workers to REDIS_CLUSTER=1 and the cluster's REDIS_URL
+Keys copied into a cluster under their old names can also be migrated in
+place with REDIS_CLUSTER=1 (DUMP/RESTORE, since RENAME cannot cross slots).
+
+Not migrated: KB staging lists (an interrupted upload is simply retried) and
+rate-limit buckets (new ones start full). The session:deadlines zset keeps its
+name; each migrated session gets its reap_at field from it.
+
+Usage:
+    python migrate_redis_keys.py --dry-run
+    python migrate_redis_keys.py
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from typing import Optional
+
+# Raise a counter to at least ARGV[1]; one key, so it runs on a cluster too
+# KEYS[1] counter; ARGV[1] value
+MAX_COUNTER_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+if tonumber(ARGV[1]) > current then
+    redis.call('SET', KEYS[1], ARGV[1])
+    return ARGV[1]
+end
+return tostring(current)
+"""
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Migrate Redis keys to hash-tagged names")
+    p.add_argument("--scan-count", type=int, default=1000, help="COUNT hint per SCAN call")
+    p.add_argument("--dry-run", action="store_true", help="only count what would move")
+    return p.parse_args()
+
+
+def new_name(key: str) -> Optional[str]:
+    """Tagged name for an old key, or None if it is not migrated."""
+    from app.utils.company_kb_manager import CompanyKBManager
+    from app.utils.context_manager import ContextManager
+    from app.utils.context_policy import ContextPolicy
+    from app.utils.session_manager import SessionManager
+
+    if "{" in key or key == SessionManager.DEADLINES_KEY:
+        return None
+    # kb:company: and kb:version: must be tried before the per-session kb: prefix
+    builders = [
+        (SessionManager.LEASE_PREFIX, SessionManager.lease_key),
+        (SessionManager.SESSION_PREFIX, SessionManager.session_key),
+        (ContextPolicy.SUMMARY_PREFIX, ContextPolicy.summary_key),
+        (ContextManager.CONTEXT_PREFIX, ContextManager.context_key),
+        (CompanyKBManager.REDIS_PREFIX, CompanyKBManager.redis_key),
+        (CompanyKBManager.VERSION_PREFIX, CompanyKBManager.version_key),
+        (ContextManager.KB_PREFIX, ContextManager.kb_key),
+    ]
+    for prefix, build in builders:
+        if key.startswith(prefix):
+            value = key[len(prefix):]
+            if prefix == CompanyKBManager.REDIS_PREFIX and ":upload:" in value:
+                return None
+            return build(value)
+    return None
+
+
+async def move(client, old: str, new: str, cluster: bool) -> str:
+    """Returns "moved", "superseded" (the tagged key already existed) or "gone"."""
+    from redis.exceptions import ResponseError
+
+    if not cluster:
+        try:
+            if await client.renamenx(old, new):
+                return "moved"
+        except ResponseError:
+            # Expired between SCAN and RENAMENX
+            return "gone"
+        await client.delete(old)
+        return "superseded"
+
+    dump, ttl = await asyncio.gather(client.dump(old), client.pttl(old))
+    if dump is None:
+        return "gone"
+    try:
+        await client.restore(new, max(ttl, 0), dump)
+        status = "moved"
+    except ResponseError as e:
+        if "BUSYKEY" not in str(e):
+            raise
+        status = "superseded"
+    await client.delete(old)
+    return status
+
+
+async def merge_counter(client, old: str, new: str) -> str:
+    """Carry a counter over as max(old, new). Returns "moved", "merged" (both existed) or "gone"."""
+    value = await client.get(old)
+    if value is None:
+        return "gone"
+    existed = await client.exists(new)
+    await client.eval(MAX_COUNTER_SCRIPT, 1, new, int(value))
+    await client.delete(old)
+    return "merged" if existed else "moved"
+
+
+async def copy_deadline(client, old: str, new: str) -> None:
+    from app.utils.session_manager import SessionManager
+
+    session_id = old[len(SessionManager.SESSION_PREFIX):]
+    deadline = await client.zscore(SessionManager.DEADLINES_KEY, session_id)
+    if deadline is not None:
+        await client.hsetnx(new, "reap_at", deadline)
+
+
+async def main(args) -> dict:
+    from app.core.config import settings
+    from app.core.redis_client import redis_binary_client as client
+    from app.utils.company_kb_manager import CompanyKBManager
+    from app.utils.session_manager import SessionManager
+
+    counts = {"scanned": 0, "moved": 0, "merged": 0, "superseded": 0, "gone": 0, "skipped": 0, "would_move": 0}
+    started = time.perf_counter()
+    # Old names only; tagged keys match these patterns too and are skipped by new_name
+    for pattern in ("session:*", "session_lease:*", "context*", "kb:*"):
+        async for raw in client.scan_iter(match=pattern, count=args.scan_count):
+            old = raw.decode("utf-8")
+            counts["scanned"] += 1
+            new = new_name(old)
+            if new is None:
+                counts["skipped"] += 1
+                continue
+            if args.dry_run:
+                counts["would_move"] += 1
+                continue
+            if old.startswith(CompanyKBManager.VERSION_PREFIX):
+                status = await merge_counter(client, old, new)
+            else:
+                status = await move(client, old, new, settings.REDIS_CLUSTER)
+            counts[status] += 1
+            if status == "moved" and old.startswith(SessionManager.SESSION_PREFIX):
+                await copy_deadline(client, old, new)
+
+    counts["seconds"] = round(time.perf_counter() - started, 2)
+    counts["dry_run"] = args.dry_run
+    return counts
+
+
+if __name__ == "__main__":
+    print(json.dumps(asyncio.run(main(parse_args())), indent=2))
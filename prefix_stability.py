@@ -0,0 +1,173 @@
+"""
+Check that the prompt prefix is byte-stable, across turns and across workers.
+
+Starts --workers processes, each with a different PYTHONHASHSEED, so anything
+that depends on set or dict-of-str ordering would show. Each worker runs
+main.app in-process with the loadtest.py stand-ins, uploads the same KBs for
+two companies (one small enough to be inlined in the prefix, one that is
+not) and drives --sessions sessions of --turns messages through the
+WebSocket. Every request sent to the (fake) LLM is serialized as JSON bytes.
+
+Per worker and company:
+
+  digest           CompiledPrefix.digest of the company's prefix
+  prefix_sha256    hashes of the prefix messages as they were sent, over all
+                   turns and sessions (exactly one is expected)
+  turn_mismatches  turns whose request does not start with the previous
+                   turn's request, minus that turn's question and its KB
+                   snippets (what the provider's prompt cache can reuse)
+
+--check exits non-zero unless every worker reports one prefix hash per
+company, no turn mismatches, and the same digests and hashes as the others.
+
+Usage:
+    python prefix_stability.py --workers 4 --check
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+KB_SNIPPETS_HEADER = "Relevant company knowledge base entries:"
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Prompt prefix byte stability across turns and workers")
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--sessions", type=int, default=3)
+    p.add_argument("--turns", type=int, default=4)
+    p.add_argument("--check", action="store_true")
+    p.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = p.parse_args()
+    # Fields loadtest.configure_env / install_stand_ins expect
+    args.redis_url = args.mongo_uri = None
+    args.redis_cluster = False
+    args.redis_latency = 0.0
+    args.llm_latency, args.llm_jitter, args.llm_dist, args.llm_token_delay = 0.0, 0.0, "uniform", 0.0
+    args.stream, args.openai_rpm, args.max_sessions, args.customer_rpm = False, 0, None, None
+    args.verbose = False
+    return args
+
+
+def company_kbs():
+    small = ["Refunds are issued within 7 days.", "We ship to 40 countries.", "Support is open 9am-6pm CET."]
+    large = [f"Entry {n}: answer about topic {n % 97}, shipping zone {n % 7} and order policy {n % 13}." for n in range(2000)]
+    return {"inline-co": small, "retrieval-co": large}
+
+
+def encode(messages) -> bytes:
+    return json.dumps(messages, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def reusable(request):
+    """The part of a request the next turn should repeat: all but the question and its KB snippets."""
+    stable = request[:-1]
+    if stable and stable[-1]["role"] == "system" and stable[-1]["content"].startswith(KB_SNIPPETS_HEADER):
+        stable = stable[:-1]
+    return stable
+
+
+async def worker(args) -> dict:
+    import uvicorn
+    import websockets
+    from loadtest import free_port, install_stand_ins
+
+    app = install_stand_ins(args)
+    from app.api import websocket
+    from app.utils.company_kb_manager import CompanyKBManager
+    from app.utils.prompt_assembler import prompt_assembler
+
+    requests = []
+    llm = websocket.openai_client.client
+    llm.reply_fn = lambda messages: requests.append(list(messages)) or f"Reply #{llm.calls}"
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    kb = CompanyKBManager()
+    url = f"ws://127.0.0.1:{port}/ws/chat"
+    report = {"hash_seed": os.environ.get("PYTHONHASHSEED"), "companies": {}}
+    for company, entries in company_kbs().items():
+        await kb.upload_kb(company, entries)
+        prefix = prompt_assembler.prefix(company)
+        hashes, mismatches = set(), 0
+        for s in range(args.sessions):
+            sent = []
+            async with websockets.connect(url, ping_interval=None) as ws:
+                await ws.recv()
+                await ws.send(company)
+                await ws.recv()
+                await ws.send(f"95{s:08d}")
+                await ws.recv()
+                for turn in range(args.turns):
+                    del requests[:]
+                    await ws.send(f"Question {turn} of session {s}: what about topic {turn * 7 + s}?")
+                    await ws.recv()
+                    sent.extend(requests)
+            for n, request in enumerate(sent):
+                hashes.add(hashlib.sha256(encode(request[:len(prefix.messages)])).hexdigest())
+                if n:
+                    previous = encode(reusable(sent[n - 1]))
+                    mismatches += not encode(request).startswith(previous[:-1])
+        report["companies"][company] = {
+            "kb_inline": prefix.kb_inline,
+            "digest": prefix.digest,
+            "prefix_sha256": sorted(hashes),
+            "requests": args.sessions * args.turns,
+            "turn_mismatches": mismatches,
+        }
+
+    server.should_exit = True
+    await server_task
+    return report
+
+
+def main(args) -> dict:
+    seeds = ["0", "1", "4242", "random"][:args.workers] + [str(n) for n in range(args.workers - 4)]
+    cmd = [sys.executable, os.path.abspath(__file__), "--worker", f"--sessions={args.sessions}", f"--turns={args.turns}"]
+    reports = []
+    for seed in seeds:
+        env = {**os.environ, "PYTHONHASHSEED": seed}
+        out = subprocess.run(cmd, env=env, stdout=subprocess.PIPE, check=True).stdout.decode("utf-8")
+        # The New Relic agent prints its own lines around the report
+        reports.append(json.loads(next(line for line in reversed(out.splitlines()) if line.startswith("{"))))
+
+    failures = []
+    for report in reports:
+        for company, result in report["companies"].items():
+            if len(result["prefix_sha256"]) != 1:
+                failures.append(f"{company}: {len(result['prefix_sha256'])} different prefixes (PYTHONHASHSEED={report['hash_seed']})")
+            if result["turn_mismatches"]:
+                failures.append(f"{company}: {result['turn_mismatches']} turn mismatches (PYTHONHASHSEED={report['hash_seed']})")
+    for company in company_kbs():
+        seen = {(r["companies"][company]["digest"], tuple(r["companies"][company]["prefix_sha256"])) for r in reports}
+        if len(seen) != 1:
+            failures.append(f"{company}: workers disagree on the prefix ({len(seen)} variants)")
+    return {"config": {k: v for k, v in vars(args).items() if k in ("workers", "sessions", "turns")}, "workers": reports, "failures": failures}
+
+
+if __name__ == "__main__":
+    from loadtest import configure_env
+
+    args = parse_args()
+    if args.worker:
+        with tempfile.TemporaryDirectory() as spool_dir:
+            configure_env(args, spool_dir)
+            # Every turn has to reach the LLM to be compared with the next one
+            os.environ["ANSWER_CACHE_ENABLED"] = "0"
+            report = asyncio.run(worker(args))
+        print(json.dumps(report), flush=True)
+        sys.exit(0)
+    report = main(args)
+    print(json.dumps(report, indent=2))
+    if args.check and report["failures"]:
+        print("\n".join(report["failures"]), file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,153 @@
+"""
+Redis round trips and latency per chat turn.
+
+Runs main.app in-process (same stand-ins as loadtest.py) and drives one
+session at a time through the WebSocket: handshake, --turns messages, close.
+Every command sent to Redis is counted, with a pipeline or script call
+counting as one round trip, and tagged with its command names. Each turn's
+count includes the background writes it started (reply commit, answer cache
+store), which are given --settle seconds to land before the next message.
+
+Point --redis-url at a local redis-server to measure real latency; with
+--redis-latency every round trip is delayed by that many seconds, which shows
+how per-turn latency scales with the Redis RTT.
+
+Usage:
+    python redis_roundtrips.py --sessions 20 --turns 5
+    python redis_roundtrips.py --redis-url redis://localhost:6379 --redis-latency 0.002
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import tempfile
+import time
+from collections import Counter
+
+COMMAND_NAME = re.compile(rb"\*\d+\r\n\$\d+\r\n([A-Za-z]+)\r\n")
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Redis round trips per chat turn")
+    p.add_argument("--sessions", type=int, default=20)
+    p.add_argument("--turns", type=int, default=5)
+    p.add_argument("--settle", type=float, default=0.05, help="seconds to let background writes finish")
+    p.add_argument("--company", default="roundtrips-co")
+    p.add_argument("--kb-entries", type=int, default=200)
+    p.add_argument("--redis-url", help="use a real Redis instead of fakeredis")
+    p.add_argument("--redis-latency", type=float, default=0.0, help="seconds added to every Redis round trip")
+    args = p.parse_args()
+    # Fields install_stand_ins expects from loadtest's parser
+    args.redis_cluster = False
+    args.mongo_uri = None
+    args.llm_latency, args.llm_jitter, args.llm_dist, args.llm_token_delay = 0.0, 0.0, "uniform", 0.0
+    args.stream, args.openai_rpm, args.max_sessions, args.customer_rpm = False, 0, None, None
+    args.verbose = False
+    return args
+
+
+class RoundTrips:
+    """Counts Redis sends by patching the connection every client uses."""
+
+    def __init__(self):
+        self.count = 0
+        self.commands = Counter()
+
+    def install(self):
+        import redis.asyncio.connection as redis_connection
+        send = redis_connection.AbstractConnection.send_packed_command
+        counter = self
+
+        async def counted_send(conn, command, check_health=True):
+            counter.count += 1
+            packed = command if isinstance(command, (bytes, bytearray)) else b"".join(bytes(c) for c in command)
+            names = [n.decode().upper() for n in COMMAND_NAME.findall(packed)]
+            counter.commands["+".join(n for n in names if n not in ("MULTI", "EXEC")) or "+".join(names)] += 1
+            await send(conn, command, check_health)
+
+        redis_connection.AbstractConnection.send_packed_command = counted_send
+
+    def take(self):
+        count, commands = self.count, self.commands
+        self.count, self.commands = 0, Counter()
+        return count, commands
+
+
+def summary(values):
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {"p50": pick(0.5), "p95": pick(0.95), "max": values[-1], "mean": round(sum(values) / len(values), 2)}
+
+
+async def main(args) -> dict:
+    import uvicorn
+    import websockets
+    from loadtest import free_port, install_stand_ins
+
+    counter = RoundTrips()
+    # Counting sits under the simulated latency so each delayed send is counted once
+    counter.install()
+    app = install_stand_ins(args)
+    from app.utils.company_kb_manager import CompanyKBManager
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    await CompanyKBManager().upload_kb(
+        args.company, [f"Entry {n}: answer about topic {n % 97} and order policy {n % 13}." for n in range(args.kb_entries)]
+    )
+    await asyncio.sleep(args.settle)
+
+    setup_trips, turn_trips, turn_ms, close_trips = [], [], [], []
+    turn_commands = Counter()
+    url = f"ws://127.0.0.1:{port}/ws/chat"
+    for i in range(args.sessions):
+        counter.take()
+        async with websockets.connect(url, ping_interval=None) as ws:
+            await ws.recv()
+            await ws.send(args.company)
+            await ws.recv()
+            await ws.send(f"97{i:08d}")
+            await ws.recv()
+            await asyncio.sleep(args.settle)
+            setup_trips.append(counter.take()[0])
+            for turn in range(args.turns):
+                sent = time.perf_counter()
+                await ws.send(f"Session {i} question {turn}: what is the order policy for topic {turn}?")
+                await ws.recv()
+                turn_ms.append((time.perf_counter() - sent) * 1000)
+                await asyncio.sleep(args.settle)
+                count, commands = counter.take()
+                turn_trips.append(count)
+                turn_commands.update(commands)
+        await asyncio.sleep(args.settle)
+        close_trips.append(counter.take()[0])
+
+    server.should_exit = True
+    await server_task
+
+    turns = len(turn_trips)
+    return {
+        "config": vars(args),
+        "round_trips": {
+            "setup": summary(setup_trips),
+            "turn": summary(turn_trips),
+            "session_end": summary(close_trips),
+        },
+        "turn_commands_per_turn": {k: round(v / turns, 2) for k, v in turn_commands.most_common()},
+        "turn_latency_ms": {k: round(v, 2) for k, v in summary(turn_ms).items()},
+    }
+
+
+if __name__ == "__main__":
+    from loadtest import configure_env
+
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as spool_dir:
+        configure_env(args, spool_dir)
+        os.environ.setdefault("COMPANY_MESSAGES_PER_MINUTE", "0")
+        print(json.dumps(asyncio.run(main(args)), indent=2))
@@ -0,0 +1,112 @@
+"""
+Roll up conversations created since the last run into the analytics tables
+shown on the admin dashboard (streamlit_backend.py).
+
+Run periodically (cron, a k8s CronJob, ...) from one place. Each run resumes
+from the watermark stored in MongoDB; see app/utils/conversation_analytics.py.
+
+Usage:
+    python run_analytics.py
+    python run_analytics.py --rebuild          # drop rollups, start from scratch
+    python run_analytics.py --benchmark 10000000
+        # aggregate generated data in chunks, no MongoDB needed
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+
+def parse_args():
+    from app.core.config import settings
+    p = argparse.ArgumentParser(description="Incremental conversation analytics")
+    p.add_argument("--chunk-size", type=int, default=settings.ANALYTICS_CHUNK_SIZE)
+    p.add_argument("--rebuild", action="store_true")
+    p.add_argument("--benchmark", type=int, metavar="N",
+                   help="aggregate N generated conversations instead of reading MongoDB")
+    p.add_argument("--companies", type=int, default=100, help="companies in generated data")
+    p.add_argument("--days", type=int, default=30, help="days spanned by generated data")
+    return p.parse_args()
+
+
+def generate_chunk(rng, size: int, start_ns: int, step_ns: float, companies: int):
+    """Conversations in created_at order, roughly like production: a few minutes, a handful of turns."""
+    import numpy as np
+    import pandas as pd
+
+    starts = start_ns + (np.arange(size) * step_ns).astype(np.int64)
+    durations = (rng.lognormal(mean=np.log(240), sigma=1.0, size=size) * 1e9).astype(np.int64)
+    return pd.DataFrame({
+        "company_id": pd.Categorical.from_codes(
+            rng.zipf(1.5, size) % companies, [f"company-{i}" for i in range(companies)]
+        ).astype(object),
+        "start_time": pd.to_datetime(starts, utc=True),
+        "end_time": pd.to_datetime(starts + durations, utc=True),
+        "message_count": rng.poisson(8, size),
+    })
+
+
+def benchmark(args) -> dict:
+    import numpy as np
+    from datetime import datetime, timezone
+    from app.utils.conversation_analytics import aggregate_chunk, frame_from_docs
+
+    rng = np.random.default_rng(0)
+    start_ns = int(datetime(2025, 1, 1, tzinfo=timezone.utc).timestamp() * 1e9)
+    step_ns = args.days * 86400e9 / args.benchmark
+
+    generate = aggregate = 0.0
+    company_days = active_rows = 0
+    for offset in range(0, args.benchmark, args.chunk_size):
+        size = min(args.chunk_size, args.benchmark - offset)
+        t0 = time.perf_counter()
+        frame = generate_chunk(rng, size, start_ns + int(offset * step_ns), step_ns, args.companies)
+        t1 = time.perf_counter()
+        daily, active = aggregate_chunk(frame)
+        aggregate += time.perf_counter() - t1
+        generate += t1 - t0
+        company_days += len(daily)
+        active_rows += len(active)
+
+    # Building the frame from Mongo documents is the other per-row cost; time one chunk of dicts
+    docs = frame.to_dict("records")
+    t0 = time.perf_counter()
+    frame_from_docs(docs)
+    decode_per_row = (time.perf_counter() - t0) / len(docs)
+
+    return {
+        "conversations": args.benchmark,
+        "chunk_size": args.chunk_size,
+        "aggregate_seconds": round(aggregate, 2),
+        "conversations_per_second": round(args.benchmark / aggregate),
+        "frame_from_docs_seconds_projected": round(decode_per_row * args.benchmark, 2),
+        "generate_seconds": round(generate, 2),
+        "company_day_updates": company_days,
+        "active_minute_updates": active_rows,
+    }
+
+
+async def main(args) -> dict:
+    import app.core.mongodb_client as mongo_client
+    from app.core.mongodb_init import init_mongodb
+    from app.utils.conversation_analytics import ConversationAnalytics
+
+    await init_mongodb()
+    analytics = ConversationAnalytics(chunk_size=args.chunk_size)
+    if args.rebuild:
+        await analytics.reset()
+
+    started = time.perf_counter()
+    result = await analytics.run()
+    result["seconds"] = round(time.perf_counter() - started, 2)
+    watermark = await analytics.watermark()
+    result["watermark"] = watermark and str(watermark["created_at"])
+    await mongo_client.close_mongodb_connection()
+    return result
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    result = benchmark(args) if args.benchmark else asyncio.run(main(args))
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,174 @@
+"""
+Connection-setup (sign-in) latency under concurrent sign-ins.
+
+Times what websocket_chat does between receiving the phone number and having
+a customer id: phone normalization plus CustomerManager.get_or_create_customer.
+--clients sign-ins start at once in each scenario:
+
+  same       every client signs in with the same new number
+  different  every client has its own new number
+  returning  the "different" numbers again (existing customers)
+
+for two implementations:
+
+  before     the previous path: two uncached phonenumbers parses (handshake and
+             Customer model), find_one, then insert_one for a new number
+  after      memoized normalize_phone_number and one atomic upsert, with the
+             phone -> customer_id cache (CUSTOMER_CACHE_SIZE) as configured
+
+Uses mongomock-motor unless --mongo-uri is given; --mongo-latency adds that
+many seconds to every MongoDB call, to model the network round trip.
+Reports latency percentiles, MongoDB calls per sign-in, failed sign-ins and
+the distinct customer ids created for the shared number (1 is correct).
+mongomock runs every call in Python on the event loop (about 1 ms for an
+upsert), so with many concurrent new numbers its own CPU time, not the
+modelled round trips, dominates; use --mongo-uri for latencies to quote.
+
+Usage:
+    python signin_bench.py --clients 200 --mongo-latency 0.002
+    python signin_bench.py --clients 200 --mongo-uri mongodb://localhost:27017
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Concurrent sign-in latency, before and after the atomic upsert")
+    p.add_argument("--clients", type=int, default=200)
+    p.add_argument("--mongo-uri", help="use a real MongoDB instead of mongomock-motor")
+    p.add_argument("--mongo-latency", type=float, default=0.002, help="seconds added to every MongoDB call")
+    p.add_argument("--cache-size", type=int, help="override CUSTOMER_CACHE_SIZE (0 disables the id cache)")
+    return p.parse_args()
+
+
+class LatencyCollection:
+    """Wraps a collection: counts calls and delays each awaited one by `delay`."""
+
+    def __init__(self, collection, delay: float):
+        self._collection = collection
+        self._delay = delay
+        self.calls = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            self.calls += 1
+            if self._delay:
+                await asyncio.sleep(self._delay)
+            return await attr(*args, **kwargs)
+
+        return call
+
+
+class Database:
+    def __init__(self, db, delay: float):
+        self._collections = {}
+        self._db = db
+        self._delay = delay
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = LatencyCollection(self._db[name], self._delay)
+        return self._collections[name]
+
+
+async def legacy_sign_in(collection, phone_raw: str) -> str:
+    """get_or_create_customer and the handshake validation as they were before the upsert."""
+    from app.models.customer import normalize_phone_number
+
+    parse = normalize_phone_number.__wrapped__
+    normalized_phone = parse(phone_raw)  # websocket handshake
+    normalized_phone = parse(phone_raw)  # Customer model inside the manager
+    customer = await collection.find_one({"phone_number": normalized_phone})
+    if customer:
+        return customer["_id"]
+    customer_id = str(uuid.uuid4())
+    await collection.insert_one({"_id": customer_id, "phone_number": phone_raw, "name": None, "email": None, "address": None})
+    return customer_id
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    pick = lambda q: round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 3)
+    return {"p50_ms": pick(0.5), "p99_ms": pick(0.99), "max_ms": round(values[-1] * 1000, 3)}
+
+
+async def run(name: str, db, clients: int, cache_size) -> dict:
+    from app.core.config import settings
+    from app.models.customer import normalize_phone_number
+    from app.utils.customer_manager import CustomerManager
+
+    collection = db[CustomerManager.COLLECTION]
+    await collection.delete_many({})
+    await collection.create_index("phone_number", unique=True)
+    normalize_phone_number.cache_clear()
+    manager = CustomerManager(settings.CUSTOMER_CACHE_SIZE if cache_size is None else cache_size)
+
+    async def sign_in(phone_raw: str):
+        started = time.perf_counter()
+        try:
+            if name == "before":
+                customer_id = await legacy_sign_in(collection, phone_raw)
+            else:
+                customer_id = await manager.get_or_create_customer(normalize_phone_number(phone_raw))
+        except Exception as e:
+            return None, type(e).__name__
+        return time.perf_counter() - started, customer_id
+
+    shared = "+919800000000"
+    different = [f"+9197{n:08d}" for n in range(clients)]
+    results = {}
+    for scenario, numbers in (("same", [shared] * clients), ("different", different), ("returning", different)):
+        collection.calls = 0
+        outcomes = await asyncio.gather(*(sign_in(n) for n in numbers))
+        ok = [(lat, cid) for lat, cid in outcomes if lat is not None]
+        errors = {}
+        for lat, error in outcomes:
+            if lat is None:
+                errors[error] = errors.get(error, 0) + 1
+        results[scenario] = {
+            "latency": percentiles([lat for lat, _ in ok]),
+            "mongo_calls_per_sign_in": round(collection.calls / clients, 2),
+            "errors": errors,
+        }
+        if scenario == "same":
+            results[scenario]["distinct_customer_ids"] = len({cid for _, cid in ok})
+    return results
+
+
+async def main(args) -> dict:
+    import app.core.newrelic_logger  # noqa: F401  adds the app's sinks, removed below
+    from loguru import logger
+
+    logger.remove()
+    if args.mongo_uri:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        raw_db = AsyncIOMotorClient(args.mongo_uri)[os.environ["MONGODB_DB"]]
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+        raw_db = AsyncMongoMockClient()[os.environ["MONGODB_DB"]]
+    db = Database(raw_db, args.mongo_latency)
+
+    import app.core.mongodb_client as mongo_module
+    mongo_module.db = db
+    return {
+        "config": vars(args),
+        "results": {name: await run(name, db, args.clients, args.cache_size) for name in ("before", "after")},
+    }
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    os.environ.setdefault("OPENAI_API_KEY", "signin-bench")
+    os.environ.setdefault("MONGODB_DB", "chatbot_signin_bench")
+    print(json.dumps(asyncio.run(main(args)), indent=2))
@@ -19,8 +19,17 @@ async def connect_ws():
 async def send_and_receive(ws, message: str):
     """Send message to backend and wait for reply"""
     await ws.send(message)
-    reply = await ws.recv()
-    return reply
+    if not settings.STREAM_RESPONSES:
+        reply = await ws.recv()
+        return reply
+
+    # Streaming mode: collect deltas until the end-of-message marker
+    parts = []
+    while True:
+        delta = await ws.recv()
+        if delta == settings.STREAM_END_MARKER:
+            return "".join(parts)
+        parts.append(delta)
 
 #async def send_json(ws, payload: dict):
 #    await ws.send(json.dumps(payload))
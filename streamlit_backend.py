@@ -1,7 +1,7 @@
 import streamlit as st
 import asyncio
-from app.core.redis_client import redis_client
 from app.utils.company_kb_manager import CompanyKBManager
+from app.utils.conversation_analytics import conversation_analytics
 from app.core.mongodb_init import init_mongodb
 
 kb_manager = CompanyKBManager()
@@ -18,15 +18,6 @@ async def setup_mongo():
 def run_async(coro):
     return st.session_state.loop.run_until_complete(coro)
 
-async def upload_to_redis(company_id: str, kb_entries: list[str]):
-    """
-    Save KB entries to Redis for quick session access.
-    """
-    key = f"kb:company:{company_id}"
-    for entry in kb_entries:
-        await redis_client.rpush(key, entry)
-    return True
-
 st.session_state.loop.run_until_complete(setup_mongo())
 
 # -------------------------Admin KB Upload-----------------------
@@ -40,13 +31,33 @@ if st.button("Upload KB"):
         st.warning("Provide both Company ID and KB content")
     else:
         kb_entries = [line.strip() for line in kb_input.split("\n") if line.strip()]
-        kb_text = "\n".join(kb_entries)
         try:
-            # Upload to MongoDB
-            run_async(kb_manager.upload_kb(company_id, kb_text))
-            # Upload to Redis
-            run_async(upload_to_redis(company_id, kb_entries))
+            # Replaces the KB in MongoDB and Redis in one versioned swap
+            run_async(kb_manager.upload_kb(company_id, kb_entries))
 
             st.success(f"Upload {len(kb_entries)} KB entries for company {company_id}")
         except Exception as e:
-            st.error(f"Error uploading KB: {e}")
\ No newline at end of file
+            st.error(f"Error uploading KB: {e}")
+
+# -------------------------Conversation Analytics-----------------------
+st.header("Conversation analytics")
+st.caption("Daily rollups written by run_analytics.py (UTC days, by session start).")
+
+analytics_company = st.text_input("Company ID (blank for all):", key="analytics_company")
+analytics_days = st.number_input("Days", min_value=1, max_value=365, value=30)
+
+if st.button("Update rollups now"):
+    try:
+        result = run_async(conversation_analytics.run())
+        st.success(f"Rolled up {result['conversations']} new conversations")
+    except Exception as e:
+        st.error(f"Error updating rollups: {e}")
+
+rollups = run_async(conversation_analytics.daily_frame(analytics_company.strip() or None, int(analytics_days)))
+if rollups.empty:
+    st.info("No rollups yet. Run: python run_analytics.py")
+else:
+    totals = rollups.groupby("day")[["sessions", "turns"]].sum().sort_index()
+    st.line_chart(totals)
+    st.bar_chart(rollups.groupby("day")["peak_concurrency"].max().sort_index())
+    st.dataframe(rollups, use_container_width=True)
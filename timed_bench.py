@@ -0,0 +1,154 @@
+"""
+Overhead of the per-stage latency metrics (timed() in app/core/metrics.py).
+
+Two measurements:
+
+  micro     timeit of an empty function call, an empty `with timed(...)`
+            block (perf_counter twice plus the histogram observe), and the
+            same block raising, which also counts chatbot_stage_errors_total
+  per_turn  main.app in-process with the loadtest.py stand-ins, driven one
+            session at a time through the WebSocket; every histogram observe
+            is counted by stage and backend, so the report shows how many
+            timed() blocks a turn runs and what they cost next to the turn
+
+Usage:
+    python timed_bench.py
+    python timed_bench.py --sessions 20 --turns 5 --number 200000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+import timeit
+from collections import Counter
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="timed() overhead per block and per chat turn")
+    p.add_argument("--number", type=int, default=200000, help="timeit iterations per micro-benchmark")
+    p.add_argument("--sessions", type=int, default=10)
+    p.add_argument("--turns", type=int, default=5)
+    p.add_argument("--settle", type=float, default=0.05, help="seconds to let background writes finish")
+    p.add_argument("--company", default="timed-bench-co")
+    args = p.parse_args()
+    # Fields install_stand_ins expects from loadtest's parser
+    args.redis_url = args.mongo_uri = None
+    args.redis_cluster = False
+    args.redis_latency = 0.0
+    args.llm_latency, args.llm_jitter, args.llm_dist, args.llm_token_delay = 0.0, 0.0, "uniform", 0.0
+    args.stream, args.openai_rpm, args.max_sessions, args.customer_rpm = False, 0, None, None
+    args.verbose = False
+    return args
+
+
+def micro(number: int) -> dict:
+    from app.core.metrics import timed
+
+    def empty():
+        pass
+
+    def block():
+        with timed("bench", "local", "bench-co"):
+            pass
+
+    def failing():
+        try:
+            with timed("bench_error", "local", "bench-co"):
+                raise ValueError
+        except ValueError:
+            pass
+
+    def per_call_ns(fn):
+        # Best of 5, like python -m timeit
+        return round(min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e9, 1)
+
+    return {"empty_call_ns": per_call_ns(empty), "timed_block_ns": per_call_ns(block), "timed_block_raising_ns": per_call_ns(failing)}
+
+
+async def per_turn(args) -> dict:
+    import uvicorn
+    import websockets
+    from loadtest import free_port, install_stand_ins
+
+    app = install_stand_ins(args)
+    from app.core.metrics import STAGE_SECONDS
+    from app.utils.company_kb_manager import CompanyKBManager
+
+    blocks = Counter()
+    observe = STAGE_SECONDS.observe
+
+    def counted_observe(value, *labels):
+        blocks[f"{labels[0]}/{labels[1]}"] += 1
+        observe(value, *labels)
+
+    STAGE_SECONDS.observe = counted_observe
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    await CompanyKBManager().upload_kb(args.company, ["Refunds are issued within 7 days.", "We ship to 40 countries."])
+
+    # Distinct questions, so turns reach the LLM rather than the answer cache
+    words = ["refund", "order", "ship", "country", "damaged", "invoice", "account", "password", "delivery", "return",
+             "warranty", "discount", "address", "payment", "card", "tracking", "late", "missing", "size", "colour"]
+    rng = random.Random(0)
+    turn_blocks, turn_ms = Counter(), []
+    url = f"ws://127.0.0.1:{port}/ws/chat"
+    for i in range(args.sessions):
+        async with websockets.connect(url, ping_interval=None) as ws:
+            await ws.recv()
+            await ws.send(args.company)
+            await ws.recv()
+            await ws.send(f"96{i:08d}")
+            await ws.recv()
+            await asyncio.sleep(args.settle)
+            blocks.clear()
+            for turn in range(args.turns):
+                sent = time.perf_counter()
+                await ws.send(" ".join(rng.sample(words, 6)) + "?")
+                await ws.recv()
+                turn_ms.append((time.perf_counter() - sent) * 1000)
+                # Count the turn's background writes too
+                await asyncio.sleep(args.settle)
+            turn_blocks.update(blocks)
+
+    server.should_exit = True
+    await server_task
+
+    turns = args.sessions * args.turns
+    turn_ms.sort()
+    return {
+        "blocks_per_turn": round(sum(turn_blocks.values()) / turns, 2),
+        "by_stage": {k: round(v / turns, 2) for k, v in turn_blocks.most_common()},
+        "turn_latency_p50_ms": round(turn_ms[len(turn_ms) // 2], 2),
+    }
+
+
+async def main(args) -> dict:
+    import app.core.newrelic_logger  # noqa: F401  adds the app's sinks, removed below
+    from loguru import logger
+
+    logger.remove()
+    report = {"config": vars(args), "micro": micro(args.number), "per_turn": await per_turn(args)}
+    block_us = (report["micro"]["timed_block_ns"] - report["micro"]["empty_call_ns"]) / 1000
+    report["per_turn"]["overhead_us"] = round(block_us * report["per_turn"]["blocks_per_turn"], 1)
+    report["per_turn"]["overhead_share"] = round(
+        report["per_turn"]["overhead_us"] / 1000 / report["per_turn"]["turn_latency_p50_ms"], 5
+    )
+    return report
+
+
+if __name__ == "__main__":
+    from loadtest import configure_env
+
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as spool_dir:
+        configure_env(args, spool_dir)
+        os.environ.setdefault("COMPANY_MESSAGES_PER_MINUTE", "0")
+        print(json.dumps(asyncio.run(main(args)), indent=2))
@@ -0,0 +1,156 @@
+"""
+Transcript persistence throughput on a mass disconnect.
+
+--sessions sessions end at once (a deploy or network blip) and each calls
+ConversationManager.save_conversation, as the websocket finally block does:
+
+  inline        the previous behaviour: one insert_one per session
+  write_behind  the ConversationWriter: spool + queued insert_many batches
+                (CONVERSATION_BATCH_SIZE, CONVERSATION_WRITE_CONCURRENCY)
+
+Reports how long the save call holds up each session's cleanup, how long
+until every transcript is in MongoDB, and MongoDB calls made.
+
+Uses mongomock-motor unless --mongo-uri is given. The stand-in is given a
+server model: every call holds one of --mongo-pool connections (motor's
+maxPoolSize) for --mongo-latency plus --doc-cost per document written.
+
+Usage:
+    python writebehind_bench.py --sessions 5000
+    python writebehind_bench.py --sessions 5000 --mongo-uri mongodb://localhost:27017
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Inline inserts vs write-behind batches on a mass disconnect")
+    p.add_argument("--sessions", type=int, default=5000)
+    p.add_argument("--messages", type=int, default=20, help="messages per transcript")
+    p.add_argument("--mongo-uri", help="use a real MongoDB instead of mongomock-motor")
+    p.add_argument("--mongo-latency", type=float, default=0.002, help="seconds per MongoDB call (stand-in only)")
+    p.add_argument("--doc-cost", type=float, default=0.0001, help="seconds per document written (stand-in only)")
+    p.add_argument("--mongo-pool", type=int, default=100, help="concurrent MongoDB calls (stand-in only)")
+    return p.parse_args()
+
+
+class ModelledCollection:
+    """mongomock collection behind a connection pool with per-call and per-document cost."""
+
+    def __init__(self, collection, pool: asyncio.Semaphore, latency: float, doc_cost: float):
+        self._collection = collection
+        self._pool = pool
+        self._latency = latency
+        self._doc_cost = doc_cost
+        self.calls = 0
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    async def _hold(self, docs: int) -> None:
+        self.calls += 1
+        async with self._pool:
+            await asyncio.sleep(self._latency + docs * self._doc_cost)
+
+    async def insert_one(self, doc, *args, **kwargs):
+        await self._hold(1)
+        return await self._collection.insert_one(doc, *args, **kwargs)
+
+    async def insert_many(self, docs, *args, **kwargs):
+        await self._hold(len(docs))
+        return await self._collection.insert_many(docs, *args, **kwargs)
+
+
+class Database:
+    def __init__(self, db, wrap):
+        self._db = db
+        self._wrap = wrap
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = self._wrap(self._db[name])
+        return self._collections[name]
+
+
+def percentiles(values):
+    values = sorted(values)
+    pick = lambda q: round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 3)
+    return {"p50_ms": pick(0.5), "p99_ms": pick(0.99), "max_ms": round(values[-1] * 1000, 3)}
+
+
+async def run(mode: str, args, db) -> dict:
+    from app.utils.conversation_manager import ConversationManager
+    from app.utils.conversation_writer import conversation_writer
+
+    manager = ConversationManager()
+    collection = db[ConversationManager.COLLECTION]
+    await collection.delete_many({})
+    if hasattr(collection, "calls"):
+        collection.calls = 0
+    if mode == "write_behind":
+        await conversation_writer.start(lambda: manager.collection)
+
+    start = datetime.now(timezone.utc) - timedelta(minutes=10)
+    messages = [
+        {"role": "user" if n % 2 == 0 else "bot", "message": f"Message {n} about my order and the refund policy.", "timestamp": start + timedelta(seconds=n)}
+        for n in range(args.messages)
+    ]
+
+    async def end_session(n: int) -> float:
+        started = time.perf_counter()
+        await manager.save_conversation(
+            customer_id=f"customer-{n}", session_id=f"session-{n}", company_id="bench-co",
+            phone_number=f"+9196{n:08d}", messages=messages, start_time=start, end_time=start + timedelta(minutes=5),
+        )
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    cleanup = await asyncio.gather(*(end_session(n) for n in range(args.sessions)))
+    if mode == "write_behind":
+        await conversation_writer.close(timeout=600)
+    elapsed = time.perf_counter() - started
+
+    persisted = await collection.count_documents({})
+    return {
+        "save_call_latency": percentiles(cleanup),
+        "all_persisted_s": round(elapsed, 3),
+        "transcripts_per_s": round(persisted / elapsed, 1),
+        "persisted": persisted,
+        "mongo_calls": getattr(collection, "calls", None),
+    }
+
+
+async def main(args) -> dict:
+    import app.core.newrelic_logger  # noqa: F401  adds the app's sinks, removed below
+    import app.core.mongodb_client as mongo_module
+    from loguru import logger
+
+    logger.remove()
+    if args.mongo_uri:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        db = AsyncIOMotorClient(args.mongo_uri)[os.environ["MONGODB_DB"]]
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+        pool = asyncio.Semaphore(args.mongo_pool)
+        db = Database(
+            AsyncMongoMockClient()[os.environ["MONGODB_DB"]],
+            lambda c: ModelledCollection(c, pool, args.mongo_latency, args.doc_cost),
+        )
+    mongo_module.db = db
+    return {"config": vars(args), "results": {mode: await run(mode, args, db) for mode in ("inline", "write_behind")}}
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    os.environ.setdefault("OPENAI_API_KEY", "writebehind-bench")
+    os.environ.setdefault("MONGODB_DB", "chatbot_writebehind_bench")
+    with tempfile.TemporaryDirectory() as spool_dir:
+        os.environ["CONVERSATION_SPOOL_DIR"] = spool_dir
+        print(json.dumps(asyncio.run(main(args)), indent=2))